@@ -1,16 +1,16 @@
 # import Libraries of other lib packages
 import bob.ip.base
 import bob.io.base
-import bob.learn.boosting
 
 from . import version
 from .version import module as __version__
 
-from ._library import FeatureExtractor, BoundingBox, prune_detections, overlapping_detections
+from ._library import FeatureExtractor, BoundingBox, ImagePyramid, prune_detections, overlapping_detections
+from .boxes import BoundingBoxArray
 from .detector import *
-from .train import *
 
-from .detect import default_cascade, best_detection, detect_single_face, detect_all_faces
+from .detect import default_cascade, best_detection, detect_single_face, detect_all_faces, detect_faces_batch
+from .stream import FaceStream, detect_stream
 
 
 def get_config():
@@ -20,5 +20,35 @@ def get_config():
   return bob.extension.get_config(__name__, version.externals)
 
 
-# gets sphinx autodoc done right - don't remove it
-__all__ = [_ for _ in dir() if not _.startswith('_')]
+# The training utilities (which import further packages such as bob.io.image and bob.learn.boosting) and the scripts are only imported when they are first accessed.
+# This speeds up importing this package for face detection only.
+_lazy_modules = ('train', 'script')
+_eager = [_ for _ in dir() if not _.startswith('_')]
+
+import sys
+if sys.version_info >= (3, 7):
+  def _train_names():
+    # the public names of the train module, as exported by "from .train import *"
+    import importlib
+    train = importlib.import_module(".train", __name__)
+    return [_ for _ in getattr(train, '__all__', dir(train)) if not _.startswith('_')]
+
+  def __getattr__(name):
+    import importlib
+    if name in _lazy_modules:
+      return importlib.import_module("." + name, __name__)
+    if name == '__all__':
+      # gets sphinx autodoc done right - don't remove it
+      return _eager + [_ for _ in _train_names() if _ not in _eager]
+    if not name.startswith('_') and name in _train_names():
+      return getattr(importlib.import_module(".train", __name__), name)
+    raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
+
+  def __dir__():
+    return sorted(set(globals()) | set(_lazy_modules) | set(_train_names()))
+else:
+  # module level __getattr__ is not available
+  from .train import *
+  # gets sphinx autodoc done right - don't remove it
+  __all__ = [_ for _ in dir() if not _.startswith('_')]
+del sys
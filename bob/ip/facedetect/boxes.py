@@ -0,0 +1,308 @@
+import numpy
+
+from ._library import BoundingBox
+
+
+class BoundingBoxArray:
+  """This class stores many bounding boxes in a single contiguous array.
+
+  In opposition to a list of :py:class:`BoundingBox` objects, the top, left, height and width of all bounding boxes are stored in one :py:class:`numpy.ndarray` of type :py:class:`numpy.float64` and shape ``(N, 4)``, see :py:attr:`boxes`.
+  All geometric operations are vectorized, i.e., they process all bounding boxes at once, which is much faster when many bounding boxes need to be handled, e.g., the raw detections of an image.
+  A bounding box array can be passed to :py:func:`numpy.asarray`, which returns a view of :py:attr:`boxes` without copying, and to :py:func:`prune_detections` and :py:func:`overlapping_detections`, which return bounding box arrays in this case.
+
+  The geometry is computed exactly as in :py:class:`BoundingBox`, e.g., ``BoundingBoxArray(boxes).similarity(other)[i,j]`` is identical to ``boxes[i].similarity(other[j])``.
+
+  **Constructor Documentation:**
+
+    Creates a bounding box array from the given bounding boxes.
+
+    **Parameters:**
+
+    ``boxes`` : array_like (2D, float) or [:py:class:`BoundingBox`] or :py:class:`BoundingBoxArray` or ``None``
+      Either an array of shape ``(N, 4)`` with one ``(top, left, height, width)`` row for each bounding box, or a list of bounding boxes; if ``None``, the array is empty.
+      Arrays of type :py:class:`numpy.float64` in C order are not copied.
+  """
+
+  def __init__(self, boxes = None):
+    if boxes is None:
+      boxes = numpy.zeros((0, 4))
+    elif isinstance(boxes, BoundingBoxArray):
+      boxes = boxes.boxes
+    elif isinstance(boxes, (list, tuple)) and boxes and isinstance(boxes[0], BoundingBox):
+      boxes = [bb.topleft_f + bb.size_f for bb in boxes]
+    self.boxes = numpy.ascontiguousarray(boxes, numpy.float64).reshape((-1, 4))
+
+
+  @staticmethod
+  def from_arrays(top, left, height, width):
+    """from_arrays(top, left, height, width) -> boxes
+
+    Creates a bounding box array from the given arrays of coordinates; scalar values are broadcast.
+
+    **Parameters:**
+
+    ``top, left, height, width`` : array_like (1D, float) or float
+      The coordinates of the bounding boxes
+
+    **Returns:**
+
+    ``boxes`` : :py:class:`BoundingBoxArray`
+      The bounding box array
+    """
+    top, left, height, width = numpy.broadcast_arrays(*[numpy.asarray(a, numpy.float64) for a in (top, left, height, width)])
+    return BoundingBoxArray(numpy.column_stack((top.ravel(), left.ravel(), height.ravel(), width.ravel())))
+
+
+  def __len__(self):
+    """Returns the number of bounding boxes."""
+    return self.boxes.shape[0]
+
+
+  def __array__(self, dtype = None, copy = None):
+    """Returns the :py:attr:`boxes` (without copying, if no other ``dtype`` is requested).
+
+    Following :py:func:`numpy.array`, a copy is always returned when ``copy`` is ``True``, and a :py:class:`ValueError` is raised when ``copy`` is ``False``, but the ``dtype`` requires a copy."""
+    if dtype is None or numpy.dtype(dtype) == self.boxes.dtype:
+      return self.boxes.copy() if copy else self.boxes
+    if copy is False:
+      raise ValueError("Unable to avoid copying the bounding boxes when converting them to %s" % numpy.dtype(dtype))
+    return self.boxes.astype(dtype)
+
+
+  def __getitem__(self, index):
+    """Returns the :py:class:`BoundingBox` with the given integral index, or a :py:class:`BoundingBoxArray` for slices, index arrays and boolean masks."""
+    if isinstance(index, (int, numpy.integer)):
+      top, left, height, width = self.boxes[index].tolist()
+      return BoundingBox((top, left), (height, width))
+    return BoundingBoxArray(self.boxes[index])
+
+
+  def __iter__(self):
+    """Iterates over all bounding boxes as :py:class:`BoundingBox` objects."""
+    for top, left, height, width in self.boxes.tolist():
+      yield BoundingBox((top, left), (height, width))
+
+
+  def __eq__(self, other):
+    return isinstance(other, BoundingBoxArray) and self.boxes.shape == other.boxes.shape and (self.boxes == other.boxes).all()
+
+
+  def __ne__(self, other):
+    return not self == other
+
+
+  def __repr__(self):
+    return "<BoundingBoxArray with %d bounding boxes>" % len(self)
+
+
+  def to_list(self):
+    """to_list() -> bounding_boxes
+
+    Converts this array into a list of bounding boxes.
+
+    **Returns:**
+
+    ``bounding_boxes`` : [:py:class:`BoundingBox`]
+      The bounding boxes
+    """
+    return list(self)
+
+
+  @property
+  def top(self):
+    """The top positions of the bounding boxes (a view into :py:attr:`boxes`)"""
+    return self.boxes[:,0]
+
+  @property
+  def left(self):
+    """The left positions of the bounding boxes (a view into :py:attr:`boxes`)"""
+    return self.boxes[:,1]
+
+  @property
+  def height(self):
+    """The heights of the bounding boxes (a view into :py:attr:`boxes`)"""
+    return self.boxes[:,2]
+
+  @property
+  def width(self):
+    """The widths of the bounding boxes (a view into :py:attr:`boxes`)"""
+    return self.boxes[:,3]
+
+  @property
+  def bottom(self):
+    """The bottom positions of the bounding boxes, which are just outside the bounding boxes"""
+    return self.boxes[:,0] + self.boxes[:,2]
+
+  @property
+  def right(self):
+    """The right positions of the bounding boxes, which are just outside the bounding boxes"""
+    return self.boxes[:,1] + self.boxes[:,3]
+
+  @property
+  def center(self):
+    """The centers of the bounding boxes, as an array of shape ``(N, 2)``"""
+    return self.boxes[:,0:2] + self.boxes[:,2:4] / 2.
+
+  @property
+  def area(self):
+    """The areas of the bounding boxes"""
+    return self.boxes[:,2] * self.boxes[:,3]
+
+
+  def shift(self, offset):
+    """shift(offset) -> boxes
+
+    Returns the bounding boxes shifted by the given offset, see :py:meth:`BoundingBox.shift`.
+
+    **Parameters:**
+
+    ``offset`` : (float, float) or array_like (2D, float)
+      The offset, by which all bounding boxes are shifted, or an array of shape ``(N, 2)`` with one offset for each bounding box
+
+    **Returns:**
+
+    ``boxes`` : :py:class:`BoundingBoxArray`
+      The shifted bounding boxes
+    """
+    boxes = self.boxes.copy()
+    boxes[:,0:2] += offset
+    return BoundingBoxArray(boxes)
+
+
+  def scale(self, scale, centered = False):
+    """scale(scale, [centered]) -> boxes
+
+    Returns the bounding boxes scaled by the given factor, see :py:meth:`BoundingBox.scale`.
+
+    **Parameters:**
+
+    ``scale`` : float or array_like (1D, float)
+      The scale, by which all bounding boxes are scaled, or one scale for each bounding box
+
+    ``centered`` : bool
+      Should the scaling be done with respect to the centers of the bounding boxes?
+
+    **Returns:**
+
+    ``boxes`` : :py:class:`BoundingBoxArray`
+      The scaled bounding boxes
+    """
+    scale = numpy.asarray(scale, numpy.float64)
+    if scale.ndim:
+      scale = scale[:,numpy.newaxis]
+    if centered:
+      boxes = numpy.empty(self.boxes.shape)
+      boxes[:,0:2] = self.boxes[:,0:2] - self.boxes[:,2:4] / 2. * (scale - 1.)
+      boxes[:,2:4] = self.boxes[:,2:4] * scale
+    else:
+      boxes = self.boxes * scale
+    return BoundingBoxArray(boxes)
+
+
+  def mirror_x(self, width):
+    """mirror_x(width) -> boxes
+
+    Returns the horizontally mirrored bounding boxes, see :py:meth:`BoundingBox.mirror_x`.
+
+    **Parameters:**
+
+    ``width`` : int
+      The width of the image, at which the bounding boxes should be mirrored
+
+    **Returns:**
+
+    ``boxes`` : :py:class:`BoundingBoxArray`
+      The mirrored bounding boxes
+    """
+    boxes = self.boxes.copy()
+    boxes[:,1] = width - self.boxes[:,3] - self.boxes[:,1]
+    return BoundingBoxArray(boxes)
+
+
+  def similarity(self, other):
+    """similarity(other) -> sim
+
+    Computes the Jaccard similarity between all pairs of bounding boxes of this and the given array, see :py:meth:`BoundingBox.similarity`.
+
+    **Parameters:**
+
+    ``other`` : :py:class:`BoundingBoxArray` or :py:class:`BoundingBox`
+      The bounding boxes to compare with
+
+    **Returns:**
+
+    ``sim`` : array_like (2D, float)
+      The similarity matrix of shape ``(len(self), len(other))``; if ``other`` is a single :py:class:`BoundingBox`, an array of shape ``(len(self),)``
+    """
+    single = isinstance(other, BoundingBox)
+    other = BoundingBoxArray([other]) if single else BoundingBoxArray(other)
+    # compute the intersection rectangles of all pairs
+    t = numpy.maximum(self.top[:,numpy.newaxis], other.top[numpy.newaxis,:])
+    b = numpy.minimum(self.bottom[:,numpy.newaxis], other.bottom[numpy.newaxis,:])
+    l = numpy.maximum(self.left[:,numpy.newaxis], other.left[numpy.newaxis,:])
+    r = numpy.minimum(self.right[:,numpy.newaxis], other.right[numpy.newaxis,:])
+    intersection = numpy.where((b > t) & (r > l), (b - t) * (r - l), 0.)
+    union = self.area[:,numpy.newaxis] + other.area[numpy.newaxis,:] - intersection
+    similarity = intersection / numpy.where(intersection > 0, union, 1.)
+    return similarity[:,0] if single else similarity
+
+
+  def contains(self, points):
+    """contains(points) -> contained
+
+    Checks, which of the bounding boxes contain the given point(s), see :py:meth:`BoundingBox.contains`.
+
+    **Parameters:**
+
+    ``points`` : (float, float) or array_like (2D, float)
+      A single ``(y, x)`` point, or an array of shape ``(P, 2)`` of points
+
+    **Returns:**
+
+    ``contained`` : array_like (1D or 2D, bool)
+      For a single point, an array of shape ``(N,)``, otherwise an array of shape ``(N, P)``, which is ``True`` where the bounding box contains the point
+    """
+    points = numpy.asarray(points, numpy.float64)
+    single = points.ndim == 1
+    points = points.reshape((-1, 2))
+    y, x = points[numpy.newaxis,:,0], points[numpy.newaxis,:,1]
+    contained = (y >= self.top[:,numpy.newaxis]) & (x >= self.left[:,numpy.newaxis]) & (y < self.bottom[:,numpy.newaxis]) & (x < self.right[:,numpy.newaxis])
+    return contained[:,0] if single else contained
+
+
+  def is_valid_for(self, size):
+    """is_valid_for(size) -> valid
+
+    Checks, which of the bounding boxes fit into an image of the given size, see :py:meth:`BoundingBox.is_valid_for`.
+
+    **Parameters:**
+
+    ``size`` : (int, int)
+      The size of the image
+
+    **Returns:**
+
+    ``valid`` : array_like (1D, bool)
+      ``True`` for all bounding boxes that fit into the image
+    """
+    return (self.top >= 0) & (self.bottom < size[0]) & (self.left >= 0) & (self.right < size[1])
+
+
+  @staticmethod
+  def concatenate(arrays):
+    """concatenate(arrays) -> boxes
+
+    Concatenates the given bounding box arrays.
+
+    **Parameters:**
+
+    ``arrays`` : [:py:class:`BoundingBoxArray`]
+      The bounding box arrays to concatenate
+
+    **Returns:**
+
+    ``boxes`` : :py:class:`BoundingBoxArray`
+      A bounding box array containing all the bounding boxes of the given ``arrays``
+    """
+    arrays = [a.boxes for a in arrays]
+    return BoundingBoxArray(numpy.concatenate(arrays) if arrays else None)
@@ -1,5 +1,8 @@
 #include "features.h"
 #include <bob.core/logging.h>
+#include <algorithm>
+#include <cmath>
+#include <limits>
 
 boost::shared_ptr<bob::ip::facedetect::BoundingBox> bob::ip::facedetect::BoundingBox::overlap(const BoundingBox& other) const{
   // compute intersection rectangle
@@ -31,6 +34,102 @@ bool gt(const indexer& a, const indexer& b){
   return a.first > b.first;
 }
 
+namespace {
+  // A uniform grid over the area that is covered by the given bounding boxes.
+  // Each cell stores the ids of the added boxes that touch the cell, so that the boxes that might overlap a query box can be found without comparing to all added boxes.
+  // In linear mode (e.g., for negative thresholds, where also non-overlapping boxes need to be compared), all added boxes are returned as candidates, in the order they were added.
+  class BoxGrid{
+    public:
+      BoxGrid(const std::vector<boost::shared_ptr<bob::ip::facedetect::BoundingBox>>& boxes, bool linear)
+      : m_linear(linear || boxes.empty()), m_rows(0), m_cols(0), m_count(0), m_query(0)
+      {
+        if (m_linear) return;
+        // get the extent of all boxes and their median size
+        std::vector<double> heights(boxes.size()), widths(boxes.size());
+        double bottom, right;
+        m_top = m_left = std::numeric_limits<double>::max();
+        bottom = right = -std::numeric_limits<double>::max();
+        for (size_t i = 0; i < boxes.size(); ++i){
+          m_top = std::min(m_top, boxes[i]->top());
+          m_left = std::min(m_left, boxes[i]->left());
+          bottom = std::max(bottom, boxes[i]->bottom());
+          right = std::max(right, boxes[i]->right());
+          heights[i] = boxes[i]->height();
+          widths[i] = boxes[i]->width();
+        }
+        std::nth_element(heights.begin(), heights.begin() + heights.size()/2, heights.end());
+        std::nth_element(widths.begin(), widths.begin() + widths.size()/2, widths.end());
+        m_cellHeight = heights[heights.size()/2];
+        m_cellWidth = widths[widths.size()/2];
+        if (!(m_cellHeight > 0. && m_cellWidth > 0. && std::isfinite(bottom - m_top) && std::isfinite(right - m_left))){
+          // degenerated boxes; just compare to all
+          m_linear = true;
+          return;
+        }
+        // limit the number of cells to be linear in the number of boxes
+        const double max_cells = 4. * boxes.size() + 64.;
+        double rows, cols;
+        while ((rows = std::floor((bottom - m_top) / m_cellHeight) + 1.) * (cols = std::floor((right - m_left) / m_cellWidth) + 1.) > max_cells){
+          m_cellHeight *= 2.;
+          m_cellWidth *= 2.;
+        }
+        m_rows = (int)rows;
+        m_cols = (int)cols;
+        m_cells.resize(m_rows * m_cols);
+      }
+
+      // adds the given box with the next id (starting with 0)
+      void add(const bob::ip::facedetect::BoundingBox& box){
+        if (!m_linear){
+          int r0, r1, c0, c1;
+          cells(box, r0, r1, c0, c1);
+          for (int r = r0; r <= r1; ++r)
+            for (int c = c0; c <= c1; ++c)
+              m_cells[r * m_cols + c].push_back(m_count);
+          m_visited.push_back(-1);
+        }
+        ++m_count;
+      }
+
+      // returns the ids of all added boxes that touch the cells of the given box, each id only once
+      const std::vector<int>& candidates(const bob::ip::facedetect::BoundingBox& box){
+        m_candidates.clear();
+        if (m_linear){
+          for (int i = 0; i < m_count; ++i) m_candidates.push_back(i);
+          return m_candidates;
+        }
+        ++m_query;
+        int r0, r1, c0, c1;
+        cells(box, r0, r1, c0, c1);
+        for (int r = r0; r <= r1; ++r)
+          for (int c = c0; c <= c1; ++c)
+            for (auto it = m_cells[r * m_cols + c].begin(); it != m_cells[r * m_cols + c].end(); ++it)
+              if (m_visited[*it] != m_query){
+                m_visited[*it] = m_query;
+                m_candidates.push_back(*it);
+              }
+        return m_candidates;
+      }
+
+    private:
+      int cell(double offset, double size, int count) const {return (int)std::max(0., std::min(std::floor(offset / size), count - 1.));}
+
+      void cells(const bob::ip::facedetect::BoundingBox& box, int& r0, int& r1, int& c0, int& c1) const {
+        r0 = cell(box.top() - m_top, m_cellHeight, m_rows);
+        r1 = cell(box.bottom() - m_top, m_cellHeight, m_rows);
+        c0 = cell(box.left() - m_left, m_cellWidth, m_cols);
+        c1 = cell(box.right() - m_left, m_cellWidth, m_cols);
+      }
+
+      bool m_linear;
+      double m_top, m_left, m_cellHeight, m_cellWidth;
+      int m_rows, m_cols;
+      std::vector<std::vector<int>> m_cells;
+      std::vector<int> m_visited, m_candidates;
+      int m_count, m_query;
+  };
+}
+
 void bob::ip::facedetect::pruneDetections(const std::vector<boost::shared_ptr<BoundingBox>>& boxes, const blitz::Array<double, 1>& weights, double threshold, std::vector<boost::shared_ptr<BoundingBox>>& pruned_boxes, blitz::Array<double, 1>& pruned_weights, const int number_of_detections){
   // sort boxes
   std::vector<indexer> sorted(boxes.size());
@@ -39,21 +138,25 @@ void bob::ip::facedetect::pruneDetections(const std::vector<boost::shared_ptr<Bo
   }
   std::sort(sorted.begin(), sorted.end(), gt);
 
-  std::list<indexer> pruned;
+  std::vector<indexer> pruned;
   std::vector<indexer>::const_iterator sit;
-  std::list<indexer>::const_iterator pit;
 
   if (threshold >= 1.){
     // for overlap == 1 (or larger), all detections will be returned, but sorted
-    pruned.insert(pruned.end(), sorted.begin(), sorted.end());
+    pruned = sorted;
   } else {
-    // prune detections (attention, this is O(n^2)!)
+    // prune detections; only the kept detections that share a grid cell can overlap the current detection
+    // (for negative thresholds, all kept detections need to be compared)
+    BoxGrid grid(boxes, threshold < 0.);
     for (sit = sorted.begin(); sit != sorted.end(); ++sit){
-      for (pit = pruned.begin(); pit != pruned.end(); ++pit){
-        if (boxes[pit->second]->similarity(*boxes[sit->second]) > threshold) break;
+      const std::vector<int>& candidates = grid.candidates(*boxes[sit->second]);
+      std::vector<int>::const_iterator cit;
+      for (cit = candidates.begin(); cit != candidates.end(); ++cit){
+        if (boxes[pruned[*cit].second]->similarity(*boxes[sit->second]) > threshold) break;
       }
-      if (pit == pruned.end()){
+      if (cit == candidates.end()){
         pruned.push_back(*sit);
+        grid.add(*boxes[sit->second]);
         if (number_of_detections > 0 && pruned.size() == (unsigned)number_of_detections){
           break;
         }
@@ -64,10 +167,9 @@ void bob::ip::facedetect::pruneDetections(const std::vector<boost::shared_ptr<Bo
   // fill pruned boxes
   pruned_boxes.reserve(pruned.size());
   pruned_weights.resize(pruned.size());
-  int i = 0;
-  for (pit = pruned.begin(); pit != pruned.end(); ++pit, ++i){
-    pruned_boxes.push_back(boxes[pit->second]);
-    pruned_weights(i) = pit->first;
+  for (size_t i = 0; i < pruned.size(); ++i){
+    pruned_boxes.push_back(boxes[pruned[i].second]);
+    pruned_weights(i) = pruned[i].first;
   }
 
   // done.
@@ -88,26 +190,28 @@ void bob::ip::facedetect::bestOverlap(const std::vector<boost::shared_ptr<Boundi
   std::list<indexer> overlapping;
   std::list<indexer>::const_iterator oit;
 
-  // compute all overlapping detections
-  // **this is O(n^2)!**
-  std::list<std::list<indexer> > collected;
-  std::list<indexer> best;
-  best.push_back(sorted.front());
-  collected.push_back(best);
+  // compute all overlapping detections; each detection is added to the first collection, whose first detection overlaps
+  // the first detections of the collections are stored in the grid, so that only the ones that share a grid cell need to be compared
+  std::vector<std::list<indexer> > collected;
+  BoxGrid grid(boxes, threshold < 0.);
+  collected.push_back(std::list<indexer>(1, sorted.front()));
+  grid.add(*boxes[sorted.front().second]);
 
   std::vector<indexer>::const_iterator sit = sorted.begin();
-  std::list<std::list<indexer> >::iterator cit;
+  std::vector<std::list<indexer> >::iterator cit;
   for (++sit; sit != sorted.end(); ++sit){
-    for (cit = collected.begin(); cit != collected.end(); ++cit){
-      if (boxes[sit->second]->similarity(*boxes[cit->front().second]) > threshold){
-        cit->push_back(*sit);
-        break;
+    const std::vector<int>& candidates = grid.candidates(*boxes[sit->second]);
+    int first = collected.size();
+    for (std::vector<int>::const_iterator it = candidates.begin(); it != candidates.end(); ++it){
+      if (*it < first && boxes[sit->second]->similarity(*boxes[collected[*it].front().second]) > threshold){
+        first = *it;
       }
     }
-    if (cit == collected.end()){
-      std::list<indexer> novel;
-      novel.push_back(*sit);
-      collected.push_back(novel);
+    if (first < (int)collected.size()){
+      collected[first].push_back(*sit);
+    } else {
+      collected.push_back(std::list<indexer>(1, *sit));
+      grid.add(*boxes[sit->second]);
     }
   }
 
@@ -1,5 +1,10 @@
 #include "features.h"
 #include <boost/format.hpp>
+#include <thread>
+#include <atomic>
+#include <mutex>
+#include <memory>
+#include <exception>
 
 bob::ip::facedetect::FeatureExtractor::FeatureExtractor(const blitz::TinyVector<int,2>& patchSize)
 : m_patchSize(patchSize),
@@ -7,7 +12,9 @@ bob::ip::facedetect::FeatureExtractor::FeatureExtractor(const blitz::TinyVector<
   m_extractors(),
   m_featureStarts(1),
   m_isMultiBlock(false),
-  m_hasSingleOffsets(false)
+  m_hasSingleOffsets(false),
+  m_denseCodes(false),
+  m_singlePrecision(false)
 {
   // first feature extractor always starts at zero
   m_featureStarts(0) = 0;
@@ -18,7 +25,9 @@ bob::ip::facedetect::FeatureExtractor::FeatureExtractor(const blitz::TinyVector<
   m_lookUpTable(0,3),
   m_extractors(),
   m_isMultiBlock(templAte.isMultiBlockLBP()),
-  m_hasSingleOffsets(false)
+  m_hasSingleOffsets(false),
+  m_denseCodes(false),
+  m_singlePrecision(false)
 {
   // initialize the extractors
   if (!m_isMultiBlock){
@@ -73,7 +82,9 @@ bob::ip::facedetect::FeatureExtractor::FeatureExtractor(const blitz::TinyVector<
 : m_patchSize(patchSize),
   m_lookUpTable(0,3),
   m_extractors(extractors),
-  m_hasSingleOffsets(false)
+  m_hasSingleOffsets(false),
+  m_denseCodes(false),
+  m_singlePrecision(false)
 {
   m_isMultiBlock = extractors[0]->isMultiBlockLBP();
   // check if all other lbp extractors have the same multi-block characteristics
@@ -88,14 +99,20 @@ bob::ip::facedetect::FeatureExtractor::FeatureExtractor(const blitz::TinyVector<
 
 bob::ip::facedetect::FeatureExtractor::FeatureExtractor(const FeatureExtractor& other)
 : m_patchSize(other.m_patchSize),
-  m_lookUpTable(other.m_lookUpTable),
-  m_extractors(other.m_extractors),
-  m_featureStarts(other.m_featureStarts),
-  m_modelIndices(other.m_modelIndices),
+  m_lookUpTable(other.m_lookUpTable.copy()),
+  m_featureStarts(other.m_featureStarts.copy()),
+  m_modelIndices(other.m_modelIndices.copy()),
   m_isMultiBlock(other.m_isMultiBlock),
-  m_hasSingleOffsets(other.m_hasSingleOffsets)
+  m_hasSingleOffsets(other.m_hasSingleOffsets),
+  m_denseCodes(other.m_denseCodes),
+  m_singlePrecision(other.m_singlePrecision)
 {
-  // we copy everything, except for the internally allocated memory
+  // we copy everything, except for the internally allocated memory;
+  // the (small) tables and the LBP extractors are deep-copied, since the reference counting of blitz arrays is not thread-safe,
+  // so that copies can be used in different threads at the same time
+  for (auto it = other.m_extractors.begin(); it != other.m_extractors.end(); ++it){
+    m_extractors.push_back(boost::shared_ptr<bob::ip::base::LBP>(new bob::ip::base::LBP(**it)));
+  }
   m_featureImages.clear();
   if (! m_hasSingleOffsets){
     for (int e = 0; e < (int)m_extractors.size(); ++e){
@@ -106,7 +123,10 @@ bob::ip::facedetect::FeatureExtractor::FeatureExtractor(const FeatureExtractor&
 }
 
 
-bob::ip::facedetect::FeatureExtractor::FeatureExtractor(bob::io::base::HDF5File& file){
+bob::ip::facedetect::FeatureExtractor::FeatureExtractor(bob::io::base::HDF5File& file)
+: m_denseCodes(false),
+  m_singlePrecision(false)
+{
   // read information from file
   load(file);
 }
@@ -194,8 +214,17 @@ void bob::ip::facedetect::FeatureExtractor::init(){
   }
 }
 
+void bob::ip::facedetect::FeatureExtractor::checkIntegralImages(bool square) const{
+  const blitz::TinyVector<int,2> shape = imageShape();
+  if (m_integralImage.extent(0) != shape[0] + 1 || m_integralImage.extent(1) != shape[1] + 1)
+    throw std::runtime_error("The mean requires the image to be prepared with the integral image!");
+  if (square && (m_integralSquareImage.extent(0) != shape[0] + 1 || m_integralSquareImage.extent(1) != shape[1] + 1))
+    throw std::runtime_error("The variance requires the image to be prepared with the integral square image!");
+}
+
 double bob::ip::facedetect::FeatureExtractor::mean(const BoundingBox& boundingBox) const{
-  int t = boundingBox.itop(), b = boundingBox.ibottom()-1, l = boundingBox.ileft(), r = boundingBox.iright()-1;
+  checkIntegralImages(false);
+  int t = boundingBox.itop(), b = boundingBox.ibottom(), l = boundingBox.ileft(), r = boundingBox.iright();
   // compute the mean using the integral image
   double sum = m_integralImage(t, l)
              + m_integralImage(b, r)
@@ -209,7 +238,8 @@ double bob::ip::facedetect::FeatureExtractor::mean(const BoundingBox& boundingBo
 
 
 double bob::ip::facedetect::FeatureExtractor::variance(const BoundingBox& boundingBox) const{
-  int t = boundingBox.itop(), b = boundingBox.ibottom()-1, l = boundingBox.ileft(), r = boundingBox.iright()-1;
+  checkIntegralImages(true);
+  int t = boundingBox.itop(), b = boundingBox.ibottom(), l = boundingBox.ileft(), r = boundingBox.iright();
   // compute the variance using the integral image and the integral square image
   double square = m_integralSquareImage(t, l)
                 + m_integralSquareImage(b, r)
@@ -228,7 +258,8 @@ double bob::ip::facedetect::FeatureExtractor::variance(const BoundingBox& boundi
 
 
 blitz::TinyVector<double,2> bob::ip::facedetect::FeatureExtractor::meanAndVariance(const BoundingBox& boundingBox) const{
-  int t = boundingBox.itop(), b = boundingBox.ibottom()-1, l = boundingBox.ileft(), r = boundingBox.iright()-1;
+  checkIntegralImages(true);
+  int t = boundingBox.itop(), b = boundingBox.ibottom(), l = boundingBox.ileft(), r = boundingBox.iright();
   // compute the variance using the integral image and the integral square image
   double square = m_integralSquareImage(t, l)
                 + m_integralSquareImage(b, r)
@@ -263,7 +294,10 @@ void bob::ip::facedetect::FeatureExtractor::extractAll(const BoundingBox& boundi
     } else {
       for (int i = m_lookUpTable.extent(0); i--;){
         const auto& lbp = m_extractors[m_lookUpTable(i,0)];
-        dataset(datasetIndex,i) = lbp->extract(m_image, boundingBox.itop() + m_lookUpTable(i,1), boundingBox.ileft() + m_lookUpTable(i,2));
+        if (hasSinglePrecisionImage())
+          dataset(datasetIndex,i) = lbp->extract(m_imageFloat, boundingBox.itop() + m_lookUpTable(i,1), boundingBox.ileft() + m_lookUpTable(i,2));
+        else
+          dataset(datasetIndex,i) = lbp->extract(m_image, boundingBox.itop() + m_lookUpTable(i,1), boundingBox.ileft() + m_lookUpTable(i,2));
       }
     }
   } else {
@@ -273,6 +307,11 @@ void bob::ip::facedetect::FeatureExtractor::extractAll(const BoundingBox& boundi
       for (int e = 0; e < (int)m_extractors.size(); ++e){
         m_extractors[e]->extract(subwindow, m_featureImages[e], true);
       }
+    } else if (hasSinglePrecisionImage()){
+      blitz::Array<float,2> subwindow = m_imageFloat(blitz::Range(boundingBox.itop(), boundingBox.ibottom()-1), blitz::Range(boundingBox.ileft(), boundingBox.iright()-1));
+      for (int e = 0; e < (int)m_extractors.size(); ++e){
+        m_extractors[e]->extract(subwindow, m_featureImages[e], false);
+      }
     } else {
       blitz::Array<double,2> subwindow = m_image(blitz::Range(boundingBox.itop(), boundingBox.ibottom()-1), blitz::Range(boundingBox.ileft(), boundingBox.iright()-1));
       for (int e = 0; e < (int)m_extractors.size(); ++e){
@@ -307,15 +346,303 @@ void bob::ip::facedetect::FeatureExtractor::extractIndexed(const BoundingBox& bo
       const auto& lbp = m_extractors[m_lookUpTable(index,0)];
       featureVector(index) = lbp->extract(m_integralImage, boundingBox.top() + m_lookUpTable(index,1), boundingBox.left() + m_lookUpTable(index,2), true);
     }
+  } else if (hasSinglePrecisionImage()){
+    for (int i = indices.extent(0); i--;){
+      int index = indices(i);
+      featureVector(index) = extractFeature(m_imageFloat, index, boundingBox.top(), boundingBox.left());
+    }
   } else {
     for (int i = indices.extent(0); i--;){
       int index = indices(i);
-      const auto& lbp = m_extractors[m_lookUpTable(index,0)];
-      featureVector(index) = lbp->extract(m_image, boundingBox.top() + m_lookUpTable(index,1), boundingBox.left() + m_lookUpTable(index,2));
+      featureVector(index) = extractFeature(m_image, index, boundingBox.top(), boundingBox.left());
     }
   }
 }
 
+void bob::ip::facedetect::FeatureExtractor::extractAllBatch(const blitz::Array<double,2>& boxes, blitz::Array<uint16_t,2>& dataset) const{
+  checkBatch(boxes, dataset);
+  for (int i = 0; i < boxes.extent(0); ++i){
+    extractAll(BoundingBox(boxes(i,0), boxes(i,1), boxes(i,2), boxes(i,3)), dataset, i);
+  }
+}
+
+void bob::ip::facedetect::FeatureExtractor::extractIndexedBatch(const blitz::Array<double,2>& boxes, blitz::Array<uint16_t,2>& dataset, const blitz::Array<int32_t,1>& indices) const{
+  checkBatch(boxes, dataset);
+  if (indices.extent(0) == 0 && m_modelIndices.extent(0) == 0)
+    throw std::runtime_error("Please set the model indices before calling this function!");
+  const blitz::Array<int32_t,1>& used = indices.extent(0) ? indices : m_modelIndices;
+  for (int i = 0; i < boxes.extent(0); ++i){
+    blitz::Array<uint16_t,1> featureVector = dataset(i, blitz::Range::all());
+    extractIndexed(BoundingBox(boxes(i,0), boxes(i,1), boxes(i,2), boxes(i,3)), featureVector, used);
+  }
+}
+
+void bob::ip::facedetect::FeatureExtractor::checkBatch(const blitz::Array<double,2>& boxes, const blitz::Array<uint16_t,2>& dataset) const{
+  if (boxes.extent(1) != 4)
+    throw std::runtime_error((boost::format("The bounding boxes must have 4 columns (top, left, height, width), but they have %d") % boxes.extent(1)).str());
+  if (dataset.extent(0) != boxes.extent(0) || dataset.extent(1) != numberOfFeatures())
+    throw std::runtime_error((boost::format("The dataset must have shape (%d, %d), but it has shape (%d, %d)") % boxes.extent(0) % numberOfFeatures() % dataset.extent(0) % dataset.extent(1)).str());
+}
+
+void bob::ip::facedetect::FeatureExtractor::computeCodeImages(){
+  // collect the extractors that are required
+  std::vector<bool> used(m_extractors.size(), m_modelIndices.extent(0) == 0);
+  for (int i = 0; i < m_modelIndices.extent(0); ++i){
+    used[m_lookUpTable(m_modelIndices(i),0)] = true;
+  }
+  if (hasSinglePrecisionImage())
+    computeCodeImages(m_imageFloat, used);
+  else
+    computeCodeImages(m_image, used);
+}
+
+template <typename T>
+void bob::ip::facedetect::FeatureExtractor::computeCodeImages(const blitz::Array<T,2>& source, const std::vector<bool>& used){
+  m_codeImages.resize(m_extractors.size());
+  for (int e = 0; e < (int)m_extractors.size(); ++e){
+    const auto& lbp = m_extractors[e];
+    blitz::TinyVector<int,2> shape = lbp->getLBPShape(source.shape(), false);
+    if (!used[e] || shape[0] <= 0 || shape[1] <= 0){
+      m_codeImages[e].free();
+      continue;
+    }
+    // compute the LBP codes for all valid positions at once, and shift the indices so that codes are accessed with the center position of the LBP
+    blitz::Array<uint16_t,2> codes(shape);
+    lbp->extract(source, codes, false);
+    codes.reindexSelf(lbp->getOffset());
+    m_codeImages[e].reference(codes);
+  }
+}
+
+void bob::ip::facedetect::FeatureExtractor::checkCascade(const blitz::Array<int32_t,1>& featureIndices, const blitz::Array<double,2>& lookUpTables, const blitz::Array<int32_t,1>& stageEnds, const blitz::Array<double,1>& stageThresholds, int distance){
+  if (featureIndices.extent(0) != lookUpTables.extent(0))
+    throw std::runtime_error("The number of feature indices and look-up tables differ!");
+  if (stageEnds.extent(0) != stageThresholds.extent(0))
+    throw std::runtime_error("The number of stage ends and stage thresholds differ!");
+  if (stageEnds.extent(0) && stageEnds(stageEnds.extent(0)-1) > featureIndices.extent(0))
+    throw std::runtime_error("The last stage ends after the last weak classifier!");
+  if (distance <= 0)
+    throw std::runtime_error("The distance must be positive!");
+}
+
+void bob::ip::facedetect::FeatureExtractor::checkVariance(double minimumVariance) const{
+  if (minimumVariance <= 0.) return;
+  const blitz::TinyVector<int,2> shape = imageShape();
+  if (m_integralSquareImage.extent(0) != shape[0] + 1 || m_integralSquareImage.extent(1) != shape[1] + 1)
+    throw std::runtime_error("The minimum variance requires the image to be prepared with the integral square image!");
+}
+
+void bob::ip::facedetect::FeatureExtractor::evaluateCascade(const blitz::Array<int32_t,1>& featureIndices, const blitz::Array<double,2>& lookUpTables, const blitz::Array<int32_t,1>& stageEnds, const blitz::Array<double,1>& stageThresholds, int distance, double threshold, std::vector<int32_t>& tops, std::vector<int32_t>& lefts, std::vector<double>& predictions, blitz::Array<int64_t,1>* stageCounts, double minimumVariance, int64_t* varianceRejections) const{
+  checkCascade(featureIndices, lookUpTables, stageEnds, stageThresholds, distance);
+  if (stageCounts && stageCounts->extent(0) != stageEnds.extent(0))
+    throw std::runtime_error("The number of stage counts and stage ends differ!");
+  checkVariance(minimumVariance);
+  evaluateCascadeRows(featureIndices, lookUpTables, stageEnds, stageThresholds, distance, threshold, 0, imageShape()[0] - m_patchSize[0], tops, lefts, predictions, stageCounts, minimumVariance, varianceRejections);
+}
+
+void bob::ip::facedetect::FeatureExtractor::evaluateCascadeRows(const blitz::Array<int32_t,1>& featureIndices, const blitz::Array<double,2>& lookUpTables, const blitz::Array<int32_t,1>& stageEnds, const blitz::Array<double,1>& stageThresholds, int distance, double threshold, int firstRow, int lastRow, std::vector<int32_t>& tops, std::vector<int32_t>& lefts, std::vector<double>& predictions, blitz::Array<int64_t,1>* stageCounts, double minimumVariance, int64_t* varianceRejections) const{
+  // the same patches as Sampler.sample_scaled would generate
+  const blitz::TinyVector<int,2> shape = imageShape();
+  const int maxY = std::min(lastRow, shape[0] - m_patchSize[0]), maxX = shape[1] - m_patchSize[1];
+  const std::vector<blitz::TinyVector<int,3> > weak = weakTable(featureIndices);
+
+  // multi-block LBP's extract from the integral image, all others from the image itself
+  if (m_isMultiBlock)
+    evaluateRows(m_integralImage, weak, lookUpTables, stageEnds, stageThresholds, distance, threshold, firstRow, maxY, maxX, tops, lefts, predictions, stageCounts, minimumVariance, varianceRejections);
+  else if (hasSinglePrecisionImage())
+    evaluateRows(m_imageFloat, weak, lookUpTables, stageEnds, stageThresholds, distance, threshold, firstRow, maxY, maxX, tops, lefts, predictions, stageCounts, minimumVariance, varianceRejections);
+  else
+    evaluateRows(m_image, weak, lookUpTables, stageEnds, stageThresholds, distance, threshold, firstRow, maxY, maxX, tops, lefts, predictions, stageCounts, minimumVariance, varianceRejections);
+}
+
+template <typename T>
+void bob::ip::facedetect::FeatureExtractor::evaluateRows(const blitz::Array<T,2>& source, const std::vector<blitz::TinyVector<int,3> >& weak, const blitz::Array<double,2>& lookUpTables, const blitz::Array<int32_t,1>& stageEnds, const blitz::Array<double,1>& stageThresholds, int distance, double threshold, int firstRow, int maxY, int maxX, std::vector<int32_t>& tops, std::vector<int32_t>& lefts, std::vector<double>& predictions, blitz::Array<int64_t,1>* stageCounts, double minimumVariance, int64_t* varianceRejections) const{
+  for (int y = firstRow; y < maxY; y += distance){
+    for (int x = 0; x < maxX; x += distance){
+      if (minimumVariance > 0. && isFlat(y, x, minimumVariance)){
+        // reject flat patches without extracting any feature
+        if (varianceRejections) ++(*varianceRejections);
+        continue;
+      }
+      const double prediction = evaluateWindow(source, weak, lookUpTables, stageEnds, stageThresholds, y, x, stageCounts);
+      if (prediction > threshold){
+        tops.push_back(y);
+        lefts.push_back(x);
+        predictions.push_back(prediction);
+      }
+    }
+  }
+}
+
+void bob::ip::facedetect::FeatureExtractor::evaluateCascadePositions(const blitz::Array<int32_t,1>& featureIndices, const blitz::Array<double,2>& lookUpTables, const blitz::Array<int32_t,1>& stageEnds, const blitz::Array<double,1>& stageThresholds, const blitz::Array<int32_t,2>& positions, double threshold, std::vector<int32_t>& tops, std::vector<int32_t>& lefts, std::vector<double>& predictions, blitz::Array<int64_t,1>* stageCounts, double minimumVariance, int64_t* varianceRejections) const{
+  checkCascade(featureIndices, lookUpTables, stageEnds, stageThresholds, 1);
+  if (stageCounts && stageCounts->extent(0) != stageEnds.extent(0))
+    throw std::runtime_error("The number of stage counts and stage ends differ!");
+  checkVariance(minimumVariance);
+  if (positions.extent(1) != 2)
+    throw std::runtime_error("The positions must have two columns (top, left)!");
+  const std::vector<blitz::TinyVector<int,3> > weak = weakTable(featureIndices);
+
+  if (m_isMultiBlock)
+    evaluatePositions(m_integralImage, weak, lookUpTables, stageEnds, stageThresholds, positions, threshold, tops, lefts, predictions, stageCounts, minimumVariance, varianceRejections);
+  else if (hasSinglePrecisionImage())
+    evaluatePositions(m_imageFloat, weak, lookUpTables, stageEnds, stageThresholds, positions, threshold, tops, lefts, predictions, stageCounts, minimumVariance, varianceRejections);
+  else
+    evaluatePositions(m_image, weak, lookUpTables, stageEnds, stageThresholds, positions, threshold, tops, lefts, predictions, stageCounts, minimumVariance, varianceRejections);
+}
+
+template <typename T>
+void bob::ip::facedetect::FeatureExtractor::evaluatePositions(const blitz::Array<T,2>& source, const std::vector<blitz::TinyVector<int,3> >& weak, const blitz::Array<double,2>& lookUpTables, const blitz::Array<int32_t,1>& stageEnds, const blitz::Array<double,1>& stageThresholds, const blitz::Array<int32_t,2>& positions, double threshold, std::vector<int32_t>& tops, std::vector<int32_t>& lefts, std::vector<double>& predictions, blitz::Array<int64_t,1>* stageCounts, double minimumVariance, int64_t* varianceRejections) const{
+  const blitz::TinyVector<int,2> shape = imageShape();
+  const int maxY = shape[0] - m_patchSize[0], maxX = shape[1] - m_patchSize[1];
+  for (int p = 0; p < positions.extent(0); ++p){
+    const int y = positions(p,0), x = positions(p,1);
+    if (y < 0 || x < 0 || y >= maxY || x >= maxX)
+      throw std::runtime_error((boost::format("The patch at position (%d, %d) does not fit into the prepared image") % y % x).str());
+    if (minimumVariance > 0. && isFlat(y, x, minimumVariance)){
+      // reject flat patches without extracting any feature
+      if (varianceRejections) ++(*varianceRejections);
+      continue;
+    }
+    const double prediction = evaluateWindow(source, weak, lookUpTables, stageEnds, stageThresholds, y, x, stageCounts);
+    if (prediction > threshold){
+      tops.push_back(y);
+      lefts.push_back(x);
+      predictions.push_back(prediction);
+    }
+  }
+}
+
+std::vector<blitz::TinyVector<int,3> > bob::ip::facedetect::FeatureExtractor::weakTable(const blitz::Array<int32_t,1>& featureIndices) const{
+  const int weakCount = featureIndices.extent(0);
+  std::vector<blitz::TinyVector<int,3> > weak(weakCount);
+  for (int w = 0; w < weakCount; ++w){
+    const int index = featureIndices(w);
+    weak[w] = blitz::TinyVector<int,3>(m_lookUpTable(index,0), m_lookUpTable(index,1), m_lookUpTable(index,2));
+  }
+  return weak;
+}
+
+void bob::ip::facedetect::FeatureExtractor::evaluateCascadeScales(const std::function<void(int)>& initialize, const std::function<void(FeatureExtractor&, int, int)>& prepare, const std::vector<blitz::TinyVector<int,2> >& shapes, const blitz::Array<int32_t,1>& featureIndices, const blitz::Array<double,2>& lookUpTables, const blitz::Array<int32_t,1>& stageEnds, const blitz::Array<double,1>& stageThresholds, int distance, double threshold, int numberOfThreads, std::vector<int32_t>& levels, std::vector<int32_t>& tops, std::vector<int32_t>& lefts, std::vector<double>& predictions, double minimumVariance) const{
+  checkCascade(featureIndices, lookUpTables, stageEnds, stageThresholds, distance);
+  if (numberOfThreads <= 0)
+    throw std::runtime_error("The number of threads must be positive!");
+
+  // the number of patches in each level
+  const int levelCount = (int)shapes.size();
+  std::vector<int> rows(levelCount);
+  std::vector<double> work(levelCount);
+  double totalWork = 0.;
+  for (int l = 0; l < levelCount; ++l){
+    const int maxY = shapes[l][0] - m_patchSize[0], maxX = shapes[l][1] - m_patchSize[1];
+    rows[l] = maxY > 0 && maxX > 0 ? (maxY + distance - 1) / distance : 0;
+    work[l] = maxY > 0 && maxX > 0 ? (double)rows[l] * ((maxX + distance - 1) / distance) : 0.;
+    totalWork += work[l];
+  }
+
+  // split the levels into horizontal bands, so that large levels do not keep a single thread busy for too long;
+  // the tasks are created in level and row order, so that the results are in the same order as in the sequential evaluation
+  struct Task {int level, firstRow, lastRow;};
+  std::vector<Task> tasks;
+  const double chunk = std::max(1., totalWork / (4. * numberOfThreads));
+  for (int l = 0; l < levelCount; ++l){
+    if (!rows[l]) continue;
+    const int bands = std::min(rows[l], (int)std::ceil(work[l] / chunk));
+    const int rowsPerBand = (rows[l] + bands - 1) / bands;
+    for (int first = 0; first < rows[l]; first += rowsPerBand){
+      tasks.push_back(Task{l, first * distance, (first + rowsPerBand) * distance});
+    }
+  }
+
+  // process the tasks of the largest levels first, so that the small ones can fill the gaps at the end
+  std::vector<int> order(tasks.size());
+  for (int t = 0; t < (int)tasks.size(); ++t) order[t] = t;
+  std::stable_sort(order.begin(), order.end(), [&](int a, int b){return work[tasks[a].level] > work[tasks[b].level];});
+
+  struct Result {std::vector<int32_t> tops, lefts; std::vector<double> predictions;};
+  std::vector<Result> results(tasks.size());
+
+  const int threadCount = std::max(1, std::min(numberOfThreads, (int)tasks.size()));
+  initialize(threadCount);
+
+  // each thread evaluates its bands with its own copy of this extractor (including its own LBP extractors)
+  std::vector<FeatureExtractor> extractors(threadCount, *this);
+  // each level is prepared only once in another copy of this extractor, by the first thread that processes one of its bands;
+  // all threads then attach their own extractor to the prepared images, which are only read during the evaluation.
+  // All copies are created before any thread starts, and the prepared images are released when the last band of their level is done
+  std::vector<std::unique_ptr<FeatureExtractor> > preparedLevels(levelCount);
+  std::vector<std::once_flag> preparedOnce(levelCount);
+  std::unique_ptr<std::atomic<int>[]> remaining(new std::atomic<int>[levelCount]);
+  for (int l = 0; l < levelCount; ++l){
+    remaining[l] = 0;
+  }
+  for (auto it = tasks.begin(); it != tasks.end(); ++it){
+    if (!remaining[it->level]++){
+      preparedLevels[it->level].reset(new FeatureExtractor(*this));
+    }
+  }
+  std::vector<std::exception_ptr> errors(threadCount);
+  std::atomic<int> next(0);
+
+  auto worker = [&](int thread){
+    try {
+      int attached = -1;
+      for (int i = next++; i < (int)order.size(); i = next++){
+        const Task& task = tasks[order[i]];
+        if (task.level != attached){
+          FeatureExtractor& level = *preparedLevels[task.level];
+          std::call_once(preparedOnce[task.level], [&](){prepare(level, thread, task.level);});
+          extractors[thread].attach(level);
+          attached = task.level;
+        }
+        Result& result = results[order[i]];
+        extractors[thread].evaluateCascadeRows(featureIndices, lookUpTables, stageEnds, stageThresholds, distance, threshold, task.firstRow, task.lastRow, result.tops, result.lefts, result.predictions, 0, minimumVariance, 0);
+        if (--remaining[task.level] == 0){
+          // all bands of the level are done, so no thread reads the prepared images anymore;
+          // they are owned by this copy only, so they can be released by any thread
+          preparedLevels[task.level].reset();
+        }
+      }
+    } catch (...) {
+      errors[thread] = std::current_exception();
+      // skip all remaining tasks
+      next = (int)order.size();
+    }
+  };
+
+  std::vector<std::thread> threads;
+  for (int t = 1; t < threadCount; ++t){
+    threads.push_back(std::thread(worker, t));
+  }
+  worker(0);
+  for (auto it = threads.begin(); it != threads.end(); ++it){
+    it->join();
+  }
+  for (auto it = errors.begin(); it != errors.end(); ++it){
+    if (*it) std::rethrow_exception(*it);
+  }
+
+  // collect the results
+  for (int t = 0; t < (int)tasks.size(); ++t){
+    const Result& result = results[t];
+    levels.insert(levels.end(), result.tops.size(), tasks[t].level);
+    tops.insert(tops.end(), result.tops.begin(), result.tops.end());
+    lefts.insert(lefts.end(), result.lefts.begin(), result.lefts.end());
+    predictions.insert(predictions.end(), result.predictions.begin(), result.predictions.end());
+  }
+}
+
+void bob::ip::facedetect::FeatureExtractor::attach(const FeatureExtractor& prepared){
+  view(prepared.m_image, m_image);
+  view(prepared.m_imageFloat, m_imageFloat);
+  view(prepared.m_integralImage, m_integralImage);
+  view(prepared.m_integralSquareImage, m_integralSquareImage);
+  m_codeImages.resize(prepared.m_codeImages.size());
+  for (int e = 0; e < (int)m_codeImages.size(); ++e){
+    view(prepared.m_codeImages[e], m_codeImages[e]);
+  }
+}
+
 void bob::ip::facedetect::FeatureExtractor::load(bob::io::base::HDF5File& hdf5file){
   // get global information
   m_patchSize[0] = hdf5file.read<int32_t>("PatchSize", 0);
@@ -375,3 +702,106 @@ void bob::ip::facedetect::FeatureExtractor::save(bob::io::base::HDF5File& hdf5fi
     hdf5file.setArray("SelectedOffsets", m_lookUpTable);
   }
 }
+
+
+std::vector<int> bob::ip::facedetect::ImagePyramid::allocate(const blitz::TinyVector<int,2>& shape){
+  // compute the shapes of all levels and the memory that is required for all of them
+  std::vector<blitz::TinyVector<int,2> > shapes;
+  size_t required = 0;
+  for (auto it = m_scales.begin(); it != m_scales.end(); ++it){
+    blitz::TinyVector<int,2> scaled = bob::ip::base::getScaledShape(shape, *it);
+    shapes.push_back(scaled);
+    required += scaled[0] * scaled[1];
+    if (m_hasIntegralImage) required += (scaled[0]+1) * (scaled[1]+1);
+    if (m_hasIntegralSquareImage) required += (scaled[0]+1) * (scaled[1]+1);
+  }
+
+  // allocate the arena and let all levels point into it
+  m_arena.resize(required);
+  double* data = m_arena.data();
+  for (auto it = shapes.begin(); it != shapes.end(); ++it){
+    m_images.push_back(blitz::Array<double,2>(data, *it, blitz::neverDeleteData));
+    data += (*it)[0] * (*it)[1];
+    blitz::TinyVector<int,2> integral((*it)[0]+1, (*it)[1]+1);
+    if (m_hasIntegralImage){
+      m_integralImages.push_back(blitz::Array<double,2>(data, integral, blitz::neverDeleteData));
+      data += integral[0] * integral[1];
+    }
+    if (m_hasIntegralSquareImage){
+      m_integralSquareImages.push_back(blitz::Array<double,2>(data, integral, blitz::neverDeleteData));
+      data += integral[0] * integral[1];
+    }
+  }
+
+  // the levels are computed from large to small, so that the smaller levels can be scaled from larger ones
+  std::vector<int> order(m_scales.size());
+  for (int i = 0; i < (int)order.size(); ++i) order[i] = i;
+  std::stable_sort(order.begin(), order.end(), [this](int a, int b){return m_scales[a] > m_scales[b];});
+  return order;
+}
+
+int bob::ip::facedetect::ImagePyramid::source(int level) const{
+  // find the smallest level that is at least twice as large as the given level
+  int best = -1;
+  for (int i = 0; i < (int)m_scales.size(); ++i){
+    if (m_scales[i] >= 2. * m_scales[level] && (best < 0 || m_scales[i] < m_scales[best])){
+      best = i;
+    }
+  }
+  return best;
+}
+
+void bob::ip::facedetect::ImagePyramid::integrate(int level){
+  if (m_hasIntegralSquareImage){
+    bob::ip::base::integral<double>(m_images[level], m_integralImages[level], m_integralSquareImages[level], true);
+  } else if (m_hasIntegralImage){
+    bob::ip::base::integral<double>(m_images[level], m_integralImages[level], true);
+  }
+}
+
+int bob::ip::facedetect::ImagePyramid::check(int level) const{
+  if (level < 0 || level >= (int)m_scales.size())
+    throw std::runtime_error((boost::format("The given level %d is not in range [0, %d[") % level % m_scales.size()).str());
+  return level;
+}
+
+const blitz::Array<double,2>& bob::ip::facedetect::ImagePyramid::integralImage(int level) const{
+  if (!m_hasIntegralImage)
+    throw std::runtime_error("The integral images have not been computed for this image pyramid");
+  return m_integralImages[check(level)];
+}
+
+const blitz::Array<double,2>& bob::ip::facedetect::ImagePyramid::integralSquareImage(int level) const{
+  if (!m_hasIntegralSquareImage)
+    throw std::runtime_error("The integral square images have not been computed for this image pyramid");
+  return m_integralSquareImages[check(level)];
+}
+
+void bob::ip::facedetect::FeatureExtractor::prepare(const boost::shared_ptr<const ImagePyramid>& pyramid, int level, bool computeIntegralSquareImage){
+  if ((m_isMultiBlock || computeIntegralSquareImage) && !pyramid->hasIntegralImage())
+    throw std::runtime_error("The image pyramid needs to contain integral images to extract multi-block LBP features");
+  if (computeIntegralSquareImage && !pyramid->hasIntegralSquareImage())
+    throw std::runtime_error("The image pyramid needs to contain integral square images to compute variances");
+
+  // keep the pyramid alive as long as we reference its levels
+  m_pyramid = pyramid;
+  m_image.reference(pyramid->image(level));
+  if (hasSinglePrecisionImage()){
+    m_imageFloat.resize(m_image.shape());
+    m_imageFloat = blitz::cast<float>(m_image);
+  }
+  // do not keep the integral images of a previously prepared image or pyramid, whose memory might already be freed
+  if (pyramid->hasIntegralImage()){
+    m_integralImage.reference(pyramid->integralImage(level));
+  } else {
+    m_integralImage.free();
+  }
+  if (pyramid->hasIntegralSquareImage()){
+    m_integralSquareImage.reference(pyramid->integralSquareImage(level));
+  } else {
+    m_integralSquareImage.free();
+  }
+  if (m_denseCodes && !m_isMultiBlock){
+    computeCodeImages();
+  }
+}
@@ -8,6 +8,7 @@
 #include <bob.core/array_convert.h>
 #include <boost/shared_ptr.hpp>
 #include <limits.h>
+#include <functional>
 
 namespace bob { namespace ip { namespace facedetect {
 
@@ -67,6 +68,68 @@ class BoundingBox{
 void pruneDetections(const std::vector<boost::shared_ptr<BoundingBox>>& detections, const blitz::Array<double, 1>& predictions, double threshold, std::vector<boost::shared_ptr<BoundingBox>>& pruned_boxes, blitz::Array<double, 1>& pruned_weights, const int number_of_detections);
 void bestOverlap(const std::vector<boost::shared_ptr<BoundingBox>>& detections, const blitz::Array<double, 1>& predictions, double threshold, std::vector<boost::shared_ptr<BoundingBox>>& pruned_boxes, blitz::Array<double, 1>& pruned_weights);
 
+class ImagePyramid{
+
+  public:
+    // Computes the levels of the given image for the given scales; each level is scaled from the nearest level that is at least twice as large
+    template <typename T>
+      ImagePyramid(const blitz::Array<T,2>& image, const std::vector<double>& scales, bool computeIntegralImage = false, bool computeIntegralSquareImage = false);
+
+    // the levels share a single memory arena, so they cannot be copied
+    ImagePyramid(const ImagePyramid& other) = delete;
+    ImagePyramid& operator =(const ImagePyramid& other) = delete;
+
+    int numberOfLevels() const {return (int)m_scales.size();}
+    double scale(int level) const {return m_scales[check(level)];}
+    const std::vector<double>& scales() const {return m_scales;}
+
+    bool hasIntegralImage() const {return m_hasIntegralImage;}
+    bool hasIntegralSquareImage() const {return m_hasIntegralSquareImage;}
+
+    // the scaled image and the integral images of the given level
+    const blitz::Array<double,2>& image(int level) const {return m_images[check(level)];}
+    const blitz::Array<double,2>& integralImage(int level) const;
+    const blitz::Array<double,2>& integralSquareImage(int level) const;
+
+  private:
+    // lays out all levels in the arena and returns the order, in which the levels need to be computed
+    std::vector<int> allocate(const blitz::TinyVector<int,2>& shape);
+    // returns the level, from which the given level is scaled, or -1 for the original image
+    int source(int level) const;
+    // computes the integral images of the given level
+    void integrate(int level);
+    int check(int level) const;
+
+    std::vector<double> m_scales;
+    bool m_hasIntegralImage;
+    bool m_hasIntegralSquareImage;
+
+    // all levels are views into this single array
+    blitz::Array<double,1> m_arena;
+    std::vector<blitz::Array<double,2> > m_images;
+    std::vector<blitz::Array<double,2> > m_integralImages;
+    std::vector<blitz::Array<double,2> > m_integralSquareImages;
+};
+
+template <typename T>
+  inline ImagePyramid::ImagePyramid(const blitz::Array<T,2>& image, const std::vector<double>& scales, bool computeIntegralImage, bool computeIntegralSquareImage)
+  : m_scales(scales),
+    m_hasIntegralImage(computeIntegralImage || computeIntegralSquareImage),
+    m_hasIntegralSquareImage(computeIntegralSquareImage)
+  {
+    std::vector<int> order = allocate(image.shape());
+    for (auto it = order.begin(); it != order.end(); ++it){
+      int s = source(*it);
+      if (s < 0){
+        bob::ip::base::scale(image, m_images[*it]);
+      } else {
+        bob::ip::base::scale(m_images[s], m_images[*it]);
+      }
+      integrate(*it);
+    }
+  }
+
+
 class FeatureExtractor{
 
   public:
@@ -93,6 +156,10 @@ class FeatureExtractor{
     void save(bob::io::base::HDF5File& file) const;
     const std::vector<boost::shared_ptr<bob::ip::base::LBP>>& getExtractors() const {return m_extractors;}
 
+    // the extractor index and the offset of each feature, when only selected offsets are extracted (see append)
+    bool hasSelectedOffsets() const {return m_hasSingleOffsets;}
+    const blitz::Array<int,2>& getSelectedOffsets() const {return m_lookUpTable;}
+
     // Model indices
     void setModelIndices(const blitz::Array<int32_t,1>& indices) {m_modelIndices.resize(indices.shape()); m_modelIndices = indices;}
     blitz::Array<int32_t,1> getModelIndices() const {return m_modelIndices;}
@@ -104,8 +171,22 @@ class FeatureExtractor{
     template <typename T>
       void prepare(const blitz::Array<T,2>& image, double scale, bool computeIntegralSquareImage);
 
-    // the prepared image
+    // attaches to the given level of the given image pyramid, without copying the level
+    void prepare(const boost::shared_ptr<const ImagePyramid>& pyramid, int level, bool computeIntegralSquareImage);
+
+    // the prepared image; when single precision is enabled, only the single precision image is valid
     const blitz::Array<double,2>& getImage() const {return m_image;}
+    const blitz::Array<float,2>& getSinglePrecisionImage() const {return m_imageFloat;}
+
+    // enables the extraction of regular (non-multi-block) LBP features from a single precision copy of the prepared image
+    void setSinglePrecision(bool singlePrecision) {m_singlePrecision = singlePrecision; if (!singlePrecision) m_imageFloat.free();}
+    bool getSinglePrecision() const {return m_singlePrecision;}
+    // returns true, if the features are extracted from the single precision image
+    bool hasSinglePrecisionImage() const {return m_singlePrecision && !m_isMultiBlock;}
+
+    // enables the computation of dense LBP code images in prepare; only used for non-multi-block LBP's
+    void setDenseCodes(bool denseCodes) {m_denseCodes = denseCodes; if (!denseCodes) m_codeImages.clear();}
+    bool getDenseCodes() const {return m_denseCodes;}
 
     // Extract the features
     void extractAll(const BoundingBox& boundingBox, blitz::Array<uint16_t,2>& dataset, int datasetIndex) const;
@@ -114,6 +195,22 @@ class FeatureExtractor{
 
     void extractIndexed(const BoundingBox& boundingBox, blitz::Array<uint16_t,1>& featureVector, const blitz::Array<int32_t,1>& indices) const;
 
+    // Extract the features of many bounding boxes, which are given as (top, left, height, width) rows, into the according rows of the dataset
+    void extractAllBatch(const blitz::Array<double,2>& boxes, blitz::Array<uint16_t,2>& dataset) const;
+    // if indices are empty, the model indices are used
+    void extractIndexedBatch(const blitz::Array<double,2>& boxes, blitz::Array<uint16_t,2>& dataset, const blitz::Array<int32_t,1>& indices) const;
+
+    // Evaluates a cascade of look-up-table classifiers for all patches of the prepared image, which are sampled with the given distance; if given, the number of patches that reach each stage is added to stageCounts
+    // If minimumVariance is positive, patches with a lower pixel variance are rejected before extracting any feature (the image must be prepared with the integral square image); their number is added to varianceRejections
+    void evaluateCascade(const blitz::Array<int32_t,1>& featureIndices, const blitz::Array<double,2>& lookUpTables, const blitz::Array<int32_t,1>& stageEnds, const blitz::Array<double,1>& stageThresholds, int distance, double threshold, std::vector<int32_t>& tops, std::vector<int32_t>& lefts, std::vector<double>& predictions, blitz::Array<int64_t,1>* stageCounts = 0, double minimumVariance = 0., int64_t* varianceRejections = 0) const;
+
+    // Evaluates the cascade only for the patches of the prepared image with the given top-left positions (one (top, left) row for each patch)
+    void evaluateCascadePositions(const blitz::Array<int32_t,1>& featureIndices, const blitz::Array<double,2>& lookUpTables, const blitz::Array<int32_t,1>& stageEnds, const blitz::Array<double,1>& stageThresholds, const blitz::Array<int32_t,2>& positions, double threshold, std::vector<int32_t>& tops, std::vector<int32_t>& lefts, std::vector<double>& predictions, blitz::Array<int64_t,1>* stageCounts = 0, double minimumVariance = 0., int64_t* varianceRejections = 0) const;
+
+    // Evaluates the cascade for all patches in all scales of the given image, using the given number of threads; each scale is prepared only once, and each thread evaluates it with its own copy of this extractor
+    template <typename T>
+      void evaluateCascadeScales(const blitz::Array<T,2>& image, const std::vector<double>& scales, const blitz::Array<int32_t,1>& featureIndices, const blitz::Array<double,2>& lookUpTables, const blitz::Array<int32_t,1>& stageEnds, const blitz::Array<double,1>& stageThresholds, int distance, double threshold, int numberOfThreads, std::vector<int32_t>& levels, std::vector<int32_t>& tops, std::vector<int32_t>& lefts, std::vector<double>& predictions, double minimumVariance = 0.) const;
+
     double mean(const BoundingBox& boundingBox) const;
     double variance(const BoundingBox& boundingBox) const;
     blitz::TinyVector<double,2> meanAndVariance(const BoundingBox& boundingBox) const;
@@ -121,12 +218,93 @@ class FeatureExtractor{
     blitz::TinyVector<int,2> patchSize() const {return m_patchSize;}
 
     const boost::shared_ptr<bob::ip::base::LBP> extractor(int32_t index) const {return m_extractors[m_lookUpTable(index,0)];}
+    int32_t extractorIndex(int32_t index) const {return m_lookUpTable(index,0);}
     blitz::TinyVector<int32_t,2> offset(int32_t index) const {return blitz::TinyVector<int,2>(m_lookUpTable(index,1), m_lookUpTable(index,2));}
 
   private:
 
     void init();
 
+    // computes the dense LBP code images of the prepared image for all extractors that are used by the model indices
+    void computeCodeImages();
+    // the shape of the prepared image, in single or double precision
+    blitz::TinyVector<int,2> imageShape() const {return hasSinglePrecisionImage() ? m_imageFloat.shape() : m_image.shape();}
+    // extracts a single feature from the prepared image, possibly using the dense code images
+    template <typename T>
+      uint16_t extractFeature(const blitz::Array<T,2>& source, int32_t index, int y, int x) const{
+        return extractFeatureAt(source, m_lookUpTable(index,0), y + m_lookUpTable(index,1), x + m_lookUpTable(index,2));
+      }
+    // extracts the feature of the given LBP extractor at the given (absolute) position in the prepared image
+    template <typename T>
+      uint16_t extractFeatureAt(const blitz::Array<T,2>& source, int e, int y, int x) const{
+        if (e < (int)m_codeImages.size() && m_codeImages[e].size()) return m_codeImages[e](y, x);
+        return m_extractors[e]->extract(source, y, x, m_isMultiBlock);
+      }
+    // computes the dense LBP code images from the given source image
+    template <typename T>
+      void computeCodeImages(const blitz::Array<T,2>& source, const std::vector<bool>& used);
+
+    // throws, if the bounding boxes and the dataset of a batch extraction do not fit together
+    void checkBatch(const blitz::Array<double,2>& boxes, const blitz::Array<uint16_t,2>& dataset) const;
+
+    // throws, if the integral image (and the integral square image, if square is enabled) of the prepared image is not available
+    void checkIntegralImages(bool square) const;
+    // throws, if the patch variances cannot be computed for the given minimum variance, i.e., if the integral square image was not prepared
+    void checkVariance(double minimumVariance) const;
+    // checks, if the pixel variance of the patch with the given top-left position is below the given minimum variance, using the integral (square) image
+    bool isFlat(int y, int x, double minimumVariance) const{
+      const int b = y + m_patchSize[0], r = x + m_patchSize[1];
+      const double pixelCount = m_patchSize[0] * m_patchSize[1];
+      // computed in the same way as in meanAndVariance
+      const double sum = m_integralImage(y, x) + m_integralImage(b, r) - m_integralImage(y, r) - m_integralImage(b, x);
+      const double square = m_integralSquareImage(y, x) + m_integralSquareImage(b, r) - m_integralSquareImage(y, r) - m_integralSquareImage(b, x);
+      return (square - sum*sum/pixelCount) / (pixelCount-1) < minimumVariance;
+    }
+
+    static void checkCascade(const blitz::Array<int32_t,1>& featureIndices, const blitz::Array<double,2>& lookUpTables, const blitz::Array<int32_t,1>& stageEnds, const blitz::Array<double,1>& stageThresholds, int distance);
+    // resolves the extractor and the offset of each weak classifier, so that they are stored contiguously
+    std::vector<blitz::TinyVector<int,3> > weakTable(const blitz::Array<int32_t,1>& featureIndices) const;
+    // evaluates the cascade for the single patch with the given top-left position
+    template <typename T>
+      double evaluateWindow(const blitz::Array<T,2>& source, const std::vector<blitz::TinyVector<int,3> >& weak, const blitz::Array<double,2>& lookUpTables, const blitz::Array<int32_t,1>& stageEnds, const blitz::Array<double,1>& stageThresholds, int y, int x, blitz::Array<int64_t,1>* stageCounts) const{
+        double prediction = 0.;
+        for (int s = 0, w = 0; s < stageEnds.extent(0); ++s){
+          if (stageCounts) ++(*stageCounts)(s);
+          // sum the weak classifiers of the current stage
+          double stage = 0.;
+          for (; w < stageEnds(s); ++w){
+            stage += lookUpTables(w, extractFeatureAt(source, weak[w][0], y + weak[w][1], x + weak[w][2]));
+          }
+          prediction += stage;
+          // break the cascade when the patch can already be rejected
+          if (prediction < stageThresholds(s)) break;
+        }
+        return prediction;
+      }
+    // evaluates the cascade for the patches of the given source image, which start in the rows [firstRow, maxY), or at the given positions
+    template <typename T>
+      void evaluateRows(const blitz::Array<T,2>& source, const std::vector<blitz::TinyVector<int,3> >& weak, const blitz::Array<double,2>& lookUpTables, const blitz::Array<int32_t,1>& stageEnds, const blitz::Array<double,1>& stageThresholds, int distance, double threshold, int firstRow, int maxY, int maxX, std::vector<int32_t>& tops, std::vector<int32_t>& lefts, std::vector<double>& predictions, blitz::Array<int64_t,1>* stageCounts, double minimumVariance, int64_t* varianceRejections) const;
+    template <typename T>
+      void evaluatePositions(const blitz::Array<T,2>& source, const std::vector<blitz::TinyVector<int,3> >& weak, const blitz::Array<double,2>& lookUpTables, const blitz::Array<int32_t,1>& stageEnds, const blitz::Array<double,1>& stageThresholds, const blitz::Array<int32_t,2>& positions, double threshold, std::vector<int32_t>& tops, std::vector<int32_t>& lefts, std::vector<double>& predictions, blitz::Array<int64_t,1>* stageCounts, double minimumVariance, int64_t* varianceRejections) const;
+    // evaluates the cascade for the patches of the prepared image, which start in the rows [firstRow, lastRow)
+    void evaluateCascadeRows(const blitz::Array<int32_t,1>& featureIndices, const blitz::Array<double,2>& lookUpTables, const blitz::Array<int32_t,1>& stageEnds, const blitz::Array<double,1>& stageThresholds, int distance, double threshold, int firstRow, int lastRow, std::vector<int32_t>& tops, std::vector<int32_t>& lefts, std::vector<double>& predictions, blitz::Array<int64_t,1>* stageCounts, double minimumVariance, int64_t* varianceRejections) const;
+    // makes the prepared images of this extractor views of the prepared images of the given extractor, without copying them
+    void attach(const FeatureExtractor& prepared);
+    // makes the target a view of the data of the given contiguous source, which neither copies the data nor modifies the reference count of the source
+    template <typename T>
+      static void view(const blitz::Array<T,2>& source, blitz::Array<T,2>& target){
+        if (!source.size()){
+          target.free();
+          return;
+        }
+        blitz::Array<T,2> data(const_cast<T*>(source.data()), source.shape(), blitz::neverDeleteData);
+        data.reindexSelf(source.base());
+        target.reference(data);
+      }
+    // distributes the levels with the given shapes over several threads; initialize(threads) is called with the number of used threads before any thread starts,
+    // and prepare(extractor, thread, level) is called exactly once for each level by the given thread, to prepare the level in the given extractor
+    void evaluateCascadeScales(const std::function<void(int)>& initialize, const std::function<void(FeatureExtractor&, int, int)>& prepare, const std::vector<blitz::TinyVector<int,2> >& shapes, const blitz::Array<int32_t,1>& featureIndices, const blitz::Array<double,2>& lookUpTables, const blitz::Array<int32_t,1>& stageEnds, const blitz::Array<double,1>& stageThresholds, int distance, double threshold, int numberOfThreads, std::vector<int32_t>& levels, std::vector<int32_t>& tops, std::vector<int32_t>& lefts, std::vector<double>& predictions, double minimumVariance) const;
+
     // look up table storing three information: lbp index, offset y, offset x
     blitz::TinyVector<int,2> m_patchSize;
     blitz::Array<int,2> m_lookUpTable;
@@ -137,21 +315,59 @@ class FeatureExtractor{
     blitz::Array<int32_t,1> m_modelIndices;
 
     blitz::Array<double,2> m_image;
+    blitz::Array<float,2> m_imageFloat;
     blitz::Array<double,2> m_integralImage;
     blitz::Array<double,2> m_integralSquareImage;
 
     mutable std::vector<blitz::Array<uint16_t,2> > m_featureImages;
     bool m_isMultiBlock;
     bool m_hasSingleOffsets;
+
+    // the image pyramid that the images above are attached to, if any
+    boost::shared_ptr<const ImagePyramid> m_pyramid;
+
+    // dense LBP code images, one for each extractor, indexed by the position of the LBP center in the prepared image; empty for unused extractors
+    bool m_denseCodes;
+    std::vector<blitz::Array<uint16_t,2> > m_codeImages;
+
+    // regular LBP features are extracted from a single precision copy of the prepared image, which halves the memory traffic
+    bool m_singlePrecision;
 };
 
 template <typename T>
   inline void FeatureExtractor::prepare(const blitz::Array<T,2>& image, double scale, bool computeIntegralSquareImage){
     // TODO: implement different MB-LBP behaviour here (i.e., scaling the LBP's instead of scaling the image)
 
+    if (m_pyramid){
+      // detach from the image pyramid, so that we do not overwrite its levels
+      m_pyramid.reset();
+      m_image.free();
+      m_integralImage.free();
+      m_integralSquareImage.free();
+    }
+    if (!computeIntegralSquareImage){
+      // do not keep the integral (square) images of a previously prepared image
+      m_integralSquareImage.free();
+      if (!m_isMultiBlock) m_integralImage.free();
+    }
+
+    if (hasSinglePrecisionImage() && scale == 1. && !computeIntegralSquareImage){
+      // the image does not need to be scaled, so it is converted to single precision directly
+      m_imageFloat.resize(image.shape());
+      m_imageFloat = blitz::cast<float>(image);
+      if (m_denseCodes){
+        computeCodeImages();
+      }
+      return;
+    }
+
     // scale image
     m_image.resize(bob::ip::base::getScaledShape(image.shape(), scale));
     bob::ip::base::scale(image, m_image);
+    if (hasSinglePrecisionImage()){
+      m_imageFloat.resize(m_image.shape());
+      m_imageFloat = blitz::cast<float>(m_image);
+    }
     if (m_isMultiBlock or computeIntegralSquareImage){
       // compute integral image of scaled image
       m_integralImage.resize(m_image.extent(0)+1, m_image.extent(1)+1);
@@ -162,6 +378,24 @@ template <typename T>
         bob::ip::base::integral<double>(m_image, m_integralImage, true);
       }
     }
+    if (m_denseCodes && !m_isMultiBlock){
+      computeCodeImages();
+    }
+  }
+
+template <typename T>
+  inline void FeatureExtractor::evaluateCascadeScales(const blitz::Array<T,2>& image, const std::vector<double>& scales, const blitz::Array<int32_t,1>& featureIndices, const blitz::Array<double,2>& lookUpTables, const blitz::Array<int32_t,1>& stageEnds, const blitz::Array<double,1>& stageThresholds, int distance, double threshold, int numberOfThreads, std::vector<int32_t>& levels, std::vector<int32_t>& tops, std::vector<int32_t>& lefts, std::vector<double>& predictions, double minimumVariance) const{
+    std::vector<blitz::TinyVector<int,2> > shapes;
+    for (auto it = scales.begin(); it != scales.end(); ++it){
+      shapes.push_back(bob::ip::base::getScaledShape(image.shape(), *it));
+    }
+    // the reference counting of blitz arrays is not thread-safe, so every thread scales its own copy of the image
+    std::vector<blitz::Array<T,2> > images;
+    evaluateCascadeScales(
+      [&images, &image](int threads){for (int t = 0; t < threads; ++t) images.push_back(image.copy());},
+      [&images, &scales, minimumVariance](FeatureExtractor& extractor, int thread, int level){extractor.prepare(images[thread], scales[level], minimumVariance > 0.);},
+      shapes, featureIndices, lookUpTables, stageEnds, stageThresholds, distance, threshold, numberOfThreads, levels, tops, lefts, predictions, minimumVariance
+    );
   }
 
 } } } // namespaces
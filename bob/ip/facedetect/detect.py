@@ -1,15 +1,54 @@
 import pkg_resources
 import math
-
-from .detector import Sampler, Cascade
+import os
+import time
+import tempfile
+import threading
+import multiprocessing
+
+from .detector import Sampler, Cascade, CompiledCascade, save_binary_cascade, load_binary_cascade
+from .detector.binary import _is_binary
 from ._library import BoundingBox, prune_detections, overlapping_detections
+from .boxes import BoundingBoxArray
 
 import bob.io.base
+import bob.ip.color
 import numpy
 
-def default_cascade():
-  """Returns the :py:class:`Cascade` that is loaded from the pre-trained cascade file provided by this package."""
-  return Cascade(bob.io.base.HDF5File(pkg_resources.resource_filename("bob.ip.facedetect", "MCT_cascade.hdf5")))
+# the default cascade, which is loaded only once per process, but never returned itself
+_default_cascade = None
+_default_cascade_lock = threading.Lock()
+# the default samplers for the patch sizes of the cascades
+_default_samplers = {}
+
+def default_cascade(cached = True):
+  """default_cascade([cached]) -> cascade
+
+  Returns the :py:class:`Cascade` that is loaded from the pre-trained cascade file provided by this package.
+
+  By default, the cascade file is read only once per process.
+  Each call returns a new context of the loaded cascade (see :py:meth:`Cascade.new_context`), so that the returned cascade can be used and modified (e.g., by adding classifiers or changing thresholds) without affecting other callers.
+  Only the weak classifiers themselves are shared, so they must not be modified in place; use ``cached = False`` to load an independent copy of the cascade.
+
+  **Parameters:**
+
+  ``cached`` : bool
+    Should the cascade, which is loaded once per process, be returned?
+
+  **Returns:**
+
+  ``cascade`` : :py:class:`Cascade`
+    The default cascade
+  """
+  if not cached:
+    return Cascade(bob.io.base.HDF5File(pkg_resources.resource_filename("bob.ip.facedetect", "MCT_cascade.hdf5")))
+
+  global _default_cascade
+  with _default_cascade_lock:
+    if _default_cascade is None:
+      _default_cascade = default_cascade(cached = False)
+    # creating the context compiles the loaded cascade on first use, so it is protected by the lock as well
+    return _default_cascade.new_context()
 
 
 def best_detection(detections, predictions, minimum_overlap = 0.2):
@@ -22,8 +61,8 @@ def best_detection(detections, predictions, minimum_overlap = 0.2):
 
   **Parameters:**
 
-  ``detections`` : [:py:class:`BoundingBox`]
-    The detected bounding boxes.
+  ``detections`` : [:py:class:`BoundingBox`] or :py:class:`BoundingBoxArray`
+    The detected bounding boxes; for a :py:class:`BoundingBoxArray`, the weighted sum is computed vectorized.
 
   ``predictions`` : [float]
     The predictions for the ``detections``.
@@ -39,6 +78,19 @@ def best_detection(detections, predictions, minimum_overlap = 0.2):
   ``prediction`` : float
     The prediction value of the bounding box, which is a weighted sum of the predictions with minimum overlap
   """
+  if isinstance(detections, BoundingBoxArray):
+    # remove all negative predictions since they harm the calculation of the weights
+    predictions = numpy.asarray(predictions, numpy.float64)
+    detections, predictions = detections[predictions > 0], predictions[predictions > 0]
+    if not len(detections):
+      raise ValueError("No detections with a prediction value > 0 have been found")
+
+    # keep only the bounding boxes with the highest overlap and compute their weighted mean
+    detections, predictions = overlapping_detections(detections, predictions, minimum_overlap)
+    weights = predictions / predictions.sum()
+    top, left, bottom, right = (numpy.dot(weights, c) for c in (detections.top, detections.left, detections.bottom, detections.right))
+    return BoundingBox((top, left), (bottom-top, right-left)), float(numpy.dot(weights, predictions))
+
   # remove all negative predictions since they harm the calculation of the weights
   detections = [detections[i] for i in range(len(detections)) if predictions[i] > 0]
   predictions = [predictions[i] for i in range(len(predictions)) if predictions[i] > 0]
@@ -64,8 +116,38 @@ def best_detection(detections, predictions, minimum_overlap = 0.2):
   return BoundingBox((top, left), (bottom-top, right-left)), value
 
 
-def detect_single_face(image, cascade = None, sampler = None, minimum_overlap=0.2):
-  """detect_single_face(image, [cascade], [sampler], [minimum_overlap]) -> bounding_box, quality
+def _load_cascade(cascade_file):
+  """Loads the cascade from the given binary or HDF5 file."""
+  if _is_binary(cascade_file):
+    return load_binary_cascade(cascade_file)
+  hdf5 = bob.io.base.HDF5File(cascade_file)
+  return CompiledCascade(hdf5) if hdf5.has_key("StageEnds") else Cascade(hdf5)
+
+
+def _sampler_parameters(sampler):
+  """Returns the parameters, with which the given sampler can be re-created."""
+  return dict(patch_size = sampler.m_patch_box.size, scale_factor = sampler.m_scale_factor, lowest_scale = sampler.m_lowest_scale, distance = sampler.m_distance, coarse_distance = sampler.m_coarse_distance, coarse_stages = sampler.m_coarse_stages, coarse_margin = sampler.m_coarse_margin, minimum_size = sampler.m_minimum_size, maximum_size = sampler.m_maximum_size, minimum_variance = sampler.m_minimum_variance)
+
+
+def _sampler(cascade, sampler, minimum_size, maximum_size):
+  """Returns the given sampler, or the default sampler if not given, limited to the given face sizes."""
+  if sampler is None:
+    if minimum_size is None and maximum_size is None:
+      # the default sampler is created only once for each patch size (samplers are not modified during sampling)
+      patch_size = tuple(cascade.extractor.patch_size)
+      if patch_size not in _default_samplers:
+        _default_samplers[patch_size] = Sampler(patch_size = patch_size, distance=2, scale_factor=math.pow(2.,-1./16.), lowest_scale=0.125)
+      return _default_samplers[patch_size]
+    return Sampler(patch_size = cascade.extractor.patch_size, distance=2, scale_factor=math.pow(2.,-1./16.), lowest_scale=0.125, minimum_size = minimum_size, maximum_size = maximum_size)
+  if minimum_size is None and maximum_size is None:
+    return sampler
+  parameters = _sampler_parameters(sampler)
+  parameters.update(minimum_size = minimum_size, maximum_size = maximum_size)
+  return Sampler(**parameters)
+
+
+def detect_single_face(image, cascade = None, sampler = None, minimum_overlap=0.2, num_threads = None, roi = None, minimum_size = None, maximum_size = None):
+  """detect_single_face(image, [cascade], [sampler], [minimum_overlap], [num_threads], [roi], [minimum_size], [maximum_size]) -> bounding_box, quality
 
   Detects a single face in the given image, i.e., the one with the highest prediction value.
 
@@ -75,7 +157,7 @@ def detect_single_face(image, cascade = None, sampler = None, minimum_overlap=0.
     The image to detect a face in.
 
   ``cascade`` : str or :py:class:`Cascade` or ``None``
-    If given, the cascade file name or the loaded cascade to be used.
+    If given, the cascade file name (in HDF5 or binary format, see :py:func:`save_binary_cascade`) or the loaded cascade to be used.
     If not given, the :py:func:`default_cascade` is used.
 
   ``sampler`` : :py:class:`Sampler` or ``None``
@@ -85,6 +167,15 @@ def detect_single_face(image, cascade = None, sampler = None, minimum_overlap=0.
   ``minimum_overlap`` : float between 0 and 1
     Computes the best detection using the given minimum overlap, see :py:func:`best_detection`
 
+  ``num_threads`` : int or ``None``
+    If given, the scales of the image are searched in parallel using the given number of threads, see :py:meth:`Sampler.iterate_cascade`
+
+  ``roi`` : :py:class:`BoundingBox` or ``None``
+    If given, the face is searched only inside this region of interest of the image, see :py:meth:`Sampler.iterate_cascade`
+
+  ``minimum_size, maximum_size`` : float or ``None``
+    If given, only faces with bounding boxes of at least or at most this height (in pixels) are searched; these limits are also applied to the given ``sampler``
+
   **Returns:**
 
   ``bounding_box`` : :py:class:`BoundingBox`
@@ -97,10 +188,9 @@ def detect_single_face(image, cascade = None, sampler = None, minimum_overlap=0.
   if cascade is None:
     cascade = default_cascade()
   elif isinstance(cascade, str):
-    cascade = Cascade(bob.io.base.HDF5File(cascade))
+    cascade = _load_cascade(cascade)
 
-  if sampler is None:
-    sampler = Sampler(patch_size = cascade.extractor.patch_size, distance=2, scale_factor=math.pow(2.,-1./16.), lowest_scale=0.125)
+  sampler = _sampler(cascade, sampler, minimum_size, maximum_size)
 
   if len(image.shape)==3:
     image = bob.ip.color.rgb_to_gray(image)
@@ -108,7 +198,7 @@ def detect_single_face(image, cascade = None, sampler = None, minimum_overlap=0.
   detections = []
   predictions = []
   # get the detection scores for the image
-  for prediction, bounding_box in sampler.iterate_cascade(cascade, image, None):
+  for prediction, bounding_box in sampler.iterate_cascade(cascade, image, None, num_threads, roi = roi):
     detections.append(bounding_box)
     predictions.append(prediction)
 
@@ -121,18 +211,22 @@ def detect_single_face(image, cascade = None, sampler = None, minimum_overlap=0.
   return bb, quality
 
 
-def detect_all_faces(image, cascade = None, sampler = None, threshold = 0, minimum_overlap = 0.2):
-  """detect_all_faces(image, [cascade], [sampler], [minimum_overlap]) -> bounding_boxes, qualities
+def detect_all_faces(image, cascade = None, sampler = None, threshold = 0, minimum_overlap = 0.2, num_threads = None, roi = None, minimum_size = None, maximum_size = None, tile_size = None):
+  """detect_all_faces(image, [cascade], [sampler], [threshold], [minimum_overlap], [num_threads], [roi], [minimum_size], [maximum_size], [tile_size]) -> bounding_boxes, qualities
 
   Detects a single face in the given image, i.e., the one with the highest prediction value.
 
+  For very large images, e.g., gigapixel scans or panoramas, a ``tile_size`` can be given together with the ``maximum_size`` of the faces of interest.
+  In this case, the image is searched in overlapping tiles (see :py:meth:`Sampler.iterate_cascade_tiled`), so that the memory consumption is bounded by the tile size.
+  The ``image`` can then also be a memory-mapped array (e.g., from ``numpy.load(filename, mmap_mode='r')``), of which only the current tile is read into memory.
+
   **Parameters:**
 
   ``image`` : array_like (2D aka gray or 3D aka RGB)
     The image to detect a face in.
 
   ``cascade`` : str or :py:class:`Cascade` or ``None``
-    If given, the cascade file name or the loaded cascade to be used to classify image patches.
+    If given, the cascade file name (in HDF5 or binary format, see :py:func:`save_binary_cascade`) or the loaded cascade to be used to classify image patches.
     If not given, the :py:func:`default_cascade` is used.
 
   ``sampler`` : :py:class:`Sampler` or ``None``
@@ -147,6 +241,18 @@ def detect_all_faces(image, cascade = None, sampler = None, threshold = 0, minim
   ``minimum_overlap`` : float between 0 and 1
     Computes the best detection using the given minimum overlap, see :py:func:`best_detection`
 
+  ``num_threads`` : int or ``None``
+    If given, the scales of the image are searched in parallel using the given number of threads, see :py:meth:`Sampler.iterate_cascade`
+
+  ``roi`` : :py:class:`BoundingBox` or ``None``
+    If given, the face is searched only inside this region of interest of the image, see :py:meth:`Sampler.iterate_cascade`
+
+  ``minimum_size, maximum_size`` : float or ``None``
+    If given, only faces with bounding boxes of at least or at most this height (in pixels) are searched; these limits are also applied to the given ``sampler``
+
+  ``tile_size`` : int or (int, int) or ``None``
+    If given, the image is searched in overlapping tiles of this size, see :py:meth:`Sampler.tiles`; requires a ``maximum_size`` (or a ``sampler`` with a maximum size) and cannot be combined with a ``roi``
+
   **Returns:**
 
   ``bounding_boxes`` : [:py:class:`BoundingBox`]
@@ -158,18 +264,24 @@ def detect_all_faces(image, cascade = None, sampler = None, threshold = 0, minim
   if cascade is None:
     cascade = default_cascade()
   elif isinstance(cascade, str):
-    cascade = Cascade(bob.io.base.HDF5File(cascade))
+    cascade = _load_cascade(cascade)
 
-  if sampler is None:
-    sampler = Sampler(patch_size = cascade.extractor.patch_size, distance=2, scale_factor=math.pow(2.,-1./16.), lowest_scale=0.125)
+  sampler = _sampler(cascade, sampler, minimum_size, maximum_size)
 
-  if len(image.shape)==3:
-    image = bob.ip.color.rgb_to_gray(image)
+  if tile_size is not None:
+    if roi is not None:
+      raise ValueError("Tiled detection cannot be restricted to a region of interest")
+    # the tiles are converted to gray scale one by one
+    results = sampler.iterate_cascade_tiled(cascade, image, tile_size, threshold, num_threads)
+  else:
+    if len(image.shape)==3:
+      image = bob.ip.color.rgb_to_gray(image)
+    results = sampler.iterate_cascade(cascade, image, threshold, num_threads, roi = roi)
 
   detections = []
   predictions = []
   # get the detection scores for the image
-  for prediction, bounding_box in sampler.iterate_cascade(cascade, image, threshold):
+  for prediction, bounding_box in results:
     detections.append(bounding_box)
     predictions.append(prediction)
 
@@ -180,3 +292,128 @@ def detect_all_faces(image, cascade = None, sampler = None, threshold = 0, minim
   bbs, qualities = prune_detections(detections, predictions, minimum_overlap)
 
   return bbs, qualities
+
+
+# the cascade and the sampler of the current worker process of detect_faces_batch
+_batch_worker = None
+
+def _init_batch_worker(cascade_file, sampler_parameters, minimum_overlap, threshold, num_threads):
+  """Loads the cascade and creates the sampler once per worker process of :py:func:`detect_faces_batch`."""
+  global _batch_worker
+  cascade = default_cascade() if cascade_file is None else _load_cascade(cascade_file)
+  sampler = Sampler(**sampler_parameters) if sampler_parameters is not None else None
+  _batch_worker = (cascade, sampler, minimum_overlap, threshold, num_threads)
+
+
+def _detect_batch_image(image):
+  """Detects the faces in the given image (or image file) using the cascade of the current worker process.
+
+  BoundingBox objects cannot be pickled, so they are returned as ``(top, left, height, width)`` tuples."""
+  cascade, sampler, minimum_overlap, threshold, num_threads = _batch_worker
+  start = time.time()
+  if isinstance(image, str):
+    image = bob.io.base.load(image)
+  if threshold is None:
+    detection = detect_single_face(image, cascade, sampler, minimum_overlap, num_threads)
+    result = None if detection is None else (detection[0].topleft_f + detection[0].size_f, detection[1])
+  else:
+    detections = detect_all_faces(image, cascade, sampler, threshold, minimum_overlap, num_threads)
+    result = ([], []) if detections is None else ([bb.topleft_f + bb.size_f for bb in detections[0]], list(detections[1]))
+  return result, time.time() - start
+
+
+def detect_faces_batch(images, cascade = None, sampler = None, minimum_overlap = 0.2, threshold = None, processes = None, chunk_size = 1, num_threads = None):
+  """detect_faces_batch(images, [cascade], [sampler], [minimum_overlap], [threshold], [processes], [chunk_size], [num_threads]) -> detection, quality, seconds
+
+  Detects faces in many images using a pool of worker processes, and yields the results in the order of the given ``images``.
+
+  Each worker process loads the ``cascade`` only once, and processes one image at a time.
+  The images are either given as image file names, which are loaded inside the worker processes, or as arrays, which are sent to the worker processes.
+  When ``threshold`` is not given, for each image the single best face is detected, see :py:func:`detect_single_face`, otherwise all faces are detected, see :py:func:`detect_all_faces`.
+
+  .. note::
+     The ``images`` are handed to the worker processes as quickly as possible.
+     To limit the memory consumption when processing large numbers of images, prefer giving image file names over arrays.
+
+  **Parameters:**
+
+  ``images`` : [str or array_like (2D aka gray or 3D aka RGB)]
+    The image file names or the images to detect faces in; can be a generator
+
+  ``cascade`` : str or :py:class:`Cascade` or :py:class:`CompiledCascade` or ``None``
+    If given, the cascade file name (in HDF5 or binary format, see :py:func:`save_binary_cascade`) or the loaded cascade to be used.
+    If not given, the :py:func:`default_cascade` is used.
+
+  ``sampler`` : :py:class:`Sampler` or ``None``
+    The sampler that defines the sampling of bounding boxes to search for the face.
+    If not specified, the default sampler of :py:func:`detect_single_face` or :py:func:`detect_all_faces` is used.
+
+  ``minimum_overlap`` : float between 0 and 1
+    The minimum overlap used to merge or prune detections, see :py:func:`detect_single_face` and :py:func:`detect_all_faces`
+
+  ``threshold`` : float or ``None``
+    If given, all faces with a quality higher than this threshold are detected using :py:func:`detect_all_faces`
+
+  ``processes`` : int or ``None``
+    The number of worker processes; if not given, one process per CPU is used.
+    If ``1``, all images are processed in the current process.
+
+  ``chunk_size`` : int
+    The number of images that are sent to a worker process at once; larger values reduce the communication overhead for small images
+
+  ``num_threads`` : int or ``None``
+    If given, each worker process searches the scales of an image with the given number of threads, see :py:meth:`Sampler.iterate_cascade`
+
+  **Yields:**
+
+  ``detection`` : :py:class:`BoundingBox` or [:py:class:`BoundingBox`] or ``None``
+    The detected face, or ``None`` if no face was found; or, when ``threshold`` is given, the list of detected faces
+
+  ``quality`` : float or [float] or ``None``
+    The quality of the detected face, or the qualities of all detected faces when ``threshold`` is given
+
+  ``seconds`` : float
+    The time that was needed to load the image and to detect the face(s) in it
+  """
+  # the cascade needs to be loaded from file in each worker process
+  # cascades that can be compiled are written in the binary format, so that the workers can share the memory-mapped tables
+  cascade_file, temporary_file = cascade, None
+  if isinstance(cascade, (Cascade, CompiledCascade)):
+    binary = cascade.has_native_evaluation()
+    handle, temporary_file = tempfile.mkstemp(suffix = ".bin" if binary else ".hdf5", prefix = "cascade_")
+    os.close(handle)
+    if binary:
+      save_binary_cascade(cascade, temporary_file)
+    else:
+      cascade.save(bob.io.base.HDF5File(temporary_file, 'w'))
+    cascade_file = temporary_file
+  sampler_parameters = None if sampler is None else _sampler_parameters(sampler)
+  initargs = (cascade_file, sampler_parameters, minimum_overlap, threshold, num_threads)
+
+  try:
+    if processes == 1:
+      _init_batch_worker(*initargs)
+      results = (_detect_batch_image(image) for image in images)
+      pool = None
+    else:
+      pool = multiprocessing.Pool(processes, _init_batch_worker, initargs)
+      results = pool.imap(_detect_batch_image, images, chunk_size)
+
+    for result, seconds in results:
+      if threshold is None:
+        if result is None:
+          yield None, None, seconds
+        else:
+          yield BoundingBox(result[0][:2], result[0][2:]), result[1], seconds
+      else:
+        yield [BoundingBox(bb[:2], bb[2:]) for bb in result[0]], result[1], seconds
+
+    if pool is not None:
+      pool.close()
+      pool.join()
+      pool = None
+  finally:
+    if pool is not None:
+      pool.terminate()
+    if temporary_file is not None:
+      os.remove(temporary_file)
@@ -1,2 +1,5 @@
 from .sampler import Sampler
 from .cascade import Cascade
+from .compiled import CompiledCascade
+from .statistics import CascadeStatistics
+from .binary import save_binary_cascade, load_binary_cascade
@@ -0,0 +1,226 @@
+import numpy
+import json
+import struct
+
+from .._library import FeatureExtractor
+from .cascade import Cascade
+from .compiled import CompiledCascade
+
+import bob.ip.base
+
+# the identifier of the binary cascade format and the current version
+_MAGIC = b"BOBFDCAS"
+_VERSION = 1
+# the alignment of the arrays inside the file
+_ALIGNMENT = 64
+# the arrays that are stored in the file, with their (little endian) data types
+_ARRAYS = (
+  ("Thresholds", "<f8"),
+  ("StageEnds", "<i4"),
+  ("FeatureIndices", "<i4"),
+  ("LookUpTables", "<f8"),
+  ("LookUpTableSizes", "<i4"),
+  ("Weights", "<f8"),
+  ("WeightedLookUpTables", "<f8"),
+  ("ExtractorIndices", "<i4"),
+  ("Offsets", "<i4"),
+  ("SelectedOffsets", "<i4"),
+)
+# the flags of the LBP extractors that are stored in the file
+_LBP_FLAGS = ("circular", "to_average", "add_average_bit", "uniform", "rotation_invariant", "elbp_type", "border_handling")
+# the flags that are accepted by the constructor of multi-block LBP extractors, which are never circular
+_MB_LBP_FLAGS = tuple(flag for flag in _LBP_FLAGS if flag != "circular")
+
+
+def _lbp_parameters(lbp):
+  # returns the parameters, with which the given LBP extractor can be re-created
+  parameters = dict((flag, getattr(lbp, flag)) for flag in _LBP_FLAGS)
+  parameters["points"] = lbp.points
+  parameters["is_multi_block_lbp"] = lbp.is_multi_block_lbp
+  if lbp.is_multi_block_lbp:
+    parameters["block_size"] = list(lbp.block_size)
+    parameters["block_overlap"] = list(lbp.block_overlap)
+  else:
+    parameters["radii"] = list(lbp.radii)
+  return parameters
+
+
+def _lbp(parameters):
+  # re-creates the LBP extractor from the given parameters
+  if parameters["is_multi_block_lbp"]:
+    flags = dict((flag, parameters[flag]) for flag in _MB_LBP_FLAGS)
+    return bob.ip.base.LBP(parameters["points"], tuple(parameters["block_size"]), tuple(parameters["block_overlap"]), **flags)
+  flags = dict((flag, parameters[flag]) for flag in _LBP_FLAGS)
+  return bob.ip.base.LBP(parameters["points"], parameters["radii"][0], parameters["radii"][1], **flags)
+
+
+def _extractor(header, arrays):
+  # re-creates the feature extractor from the header and the arrays
+  lbps = [_lbp(parameters) for parameters in header["Extractors"]]
+  patch_size = tuple(header["PatchSize"])
+  if "SelectedOffsets" not in arrays:
+    return FeatureExtractor(patch_size, lbps)
+  # the features are extracted only at selected offsets
+  extractor = FeatureExtractor(patch_size)
+  selected = arrays["SelectedOffsets"]
+  for index, lbp in enumerate(lbps):
+    extractor.append(lbp, [tuple(offset) for offset in selected[selected[:,0] == index, 1:].tolist()])
+  return extractor
+
+
+def _is_binary(filename):
+  # checks if the given file starts with the identifier of the binary cascade format
+  with open(filename, "rb") as f:
+    return f.read(len(_MAGIC)) == _MAGIC
+
+
+def save_binary_cascade(cascade, filename):
+  """save_binary_cascade(cascade, filename) -> None
+
+  Saves the given cascade into a compact binary file, which can be loaded quickly using :py:func:`load_binary_cascade`.
+
+  The binary file starts with an identifier, the format version and a JSON header, which contains the patch size, the parameters of the LBP extractors and the locations of the arrays in the file.
+  All tables of the :py:class:`CompiledCascade` (including the look-up tables with and without the weights applied, as well as the :py:attr:`FeatureExtractor.selected_offsets`) are stored as flat little endian arrays, aligned to 64 bytes.
+  Hence, the tables can be memory-mapped when loading, without parsing or copying them.
+
+  Only cascades that can be compiled (see :py:meth:`Cascade.has_native_evaluation`) can be saved in this format.
+
+  **Parameters:**
+
+  ``cascade`` : :py:class:`Cascade` or :py:class:`CompiledCascade`
+    The cascade to save
+
+  ``filename`` : str
+    The name of the binary file to write
+  """
+  compiled = cascade if isinstance(cascade, CompiledCascade) else cascade.compile()
+  extractor = compiled.extractor
+
+  # the lengths of the look-up tables of the weak classifiers
+  if isinstance(cascade, CompiledCascade):
+    sizes = [compiled.look_up_tables.shape[1]] * len(compiled.feature_indices)
+  else:
+    sizes = [weak.lut.shape[0] for machine in cascade.cascade for weak in machine.weak_machines]
+
+  arrays = {
+    "Thresholds" : compiled.thresholds,
+    "StageEnds" : compiled.stage_ends,
+    "FeatureIndices" : compiled.feature_indices,
+    "LookUpTables" : compiled.look_up_tables,
+    "LookUpTableSizes" : sizes,
+    "Weights" : compiled.weights,
+    "WeightedLookUpTables" : compiled.tables()[1],
+    "ExtractorIndices" : compiled.extractor_indices,
+    "Offsets" : compiled.offsets,
+    "SelectedOffsets" : extractor.selected_offsets,
+  }
+
+  # compute the locations of the arrays
+  header = {
+    "PatchSize" : list(extractor.patch_size),
+    "Extractors" : [_lbp_parameters(lbp) for lbp in extractor.extractors],
+    "Arrays" : {},
+  }
+  data = []
+  for name, dtype in _ARRAYS:
+    if arrays[name] is None:
+      continue
+    array = numpy.ascontiguousarray(arrays[name], dtype)
+    header["Arrays"][name] = {"dtype" : dtype, "shape" : list(array.shape)}
+    data.append((name, array))
+  # the offsets are relative to the end of the header, so that they do not change the length of the header itself
+  offset = 0
+  for name, array in data:
+    header["Arrays"][name]["offset"] = offset
+    offset += (array.nbytes + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+  encoded = json.dumps(header, sort_keys=True).encode("utf-8")
+  start = (len(_MAGIC) + 8 + len(encoded) + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+  with open(filename, "wb") as f:
+    f.write(_MAGIC)
+    f.write(struct.pack("<II", _VERSION, len(encoded)))
+    f.write(encoded)
+    for name, array in data:
+      f.write(b"\0" * (start + header["Arrays"][name]["offset"] - f.tell()))
+      f.write(array.tobytes())
+
+
+def load_binary_cascade(filename, compiled = True, mmap_mode = 'c'):
+  """load_binary_cascade(filename, [compiled], [mmap_mode]) -> cascade
+
+  Loads a cascade from the given binary file, which was written by :py:func:`save_binary_cascade`.
+
+  By default, the tables of the returned :py:class:`CompiledCascade` are memory-mapped from the file.
+  With the default ``mmap_mode = 'c'`` (copy-on-write), the pages of the file are shared by all processes that load the same file (including forked worker processes), while the arrays stay writable, as required by :py:meth:`FeatureExtractor.evaluate_cascade`.
+
+  With ``compiled = False``, a :py:class:`Cascade` of :py:class:`bob.learn.boosting.BoostedMachine`\s is re-created from the tables, which can, e.g., be saved in the HDF5 format using :py:meth:`Cascade.save`.
+
+  **Parameters:**
+
+  ``filename`` : str
+    The name of the binary file to read
+
+  ``compiled`` : bool
+    Should the compiled cascade be returned?
+
+  ``mmap_mode`` : str or ``None``
+    The mode to memory-map the file, see :py:class:`numpy.memmap`; if ``None``, the arrays are read into memory
+
+  **Returns:**
+
+  ``cascade`` : :py:class:`CompiledCascade` or :py:class:`Cascade`
+    The loaded cascade
+  """
+  with open(filename, "rb") as f:
+    if f.read(len(_MAGIC)) != _MAGIC:
+      raise ValueError("The file '%s' does not contain a binary cascade" % filename)
+    version, length = struct.unpack("<II", f.read(8))
+    if version > _VERSION:
+      raise ValueError("The binary cascade in file '%s' has version %d, but only versions up to %d are supported" % (filename, version, _VERSION))
+    header = json.loads(f.read(length).decode("utf-8"))
+  start = (len(_MAGIC) + 8 + length + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+  # get the arrays
+  if mmap_mode is None:
+    with open(filename, "rb") as f:
+      f.seek(start)
+      data = numpy.frombuffer(f.read(), numpy.uint8)
+  else:
+    data = numpy.memmap(filename, numpy.uint8, mmap_mode, offset = start)
+  arrays = {}
+  for name, info in header["Arrays"].items():
+    dtype = numpy.dtype(str(info["dtype"]))
+    size = int(numpy.prod(info["shape"])) * dtype.itemsize
+    arrays[name] = data[info["offset"] : info["offset"] + size].view(dtype).reshape(info["shape"])
+    if mmap_mode is None:
+      # the arrays need to be writable
+      arrays[name] = arrays[name].copy()
+
+  extractor = _extractor(header, arrays)
+
+  if compiled:
+    cascade = CompiledCascade.__new__(CompiledCascade)
+    cascade.extractor = extractor
+    cascade.feature_indices = arrays["FeatureIndices"]
+    cascade.look_up_tables = arrays["LookUpTables"]
+    cascade.weights = arrays["Weights"]
+    cascade.stage_ends = arrays["StageEnds"]
+    cascade.thresholds = arrays["Thresholds"]
+    cascade._init(weighted = arrays["WeightedLookUpTables"], extractor_indices = arrays["ExtractorIndices"], offsets = arrays["Offsets"])
+    return cascade
+
+  # re-create the strong classifiers from the tables, which requires bob.learn.boosting
+  import bob.learn.boosting
+  cascade = Cascade(feature_extractor = extractor)
+  indices, luts, sizes, weights = arrays["FeatureIndices"], arrays["LookUpTables"], arrays["LookUpTableSizes"], arrays["Weights"]
+  begin = 0
+  for end, threshold in zip(arrays["StageEnds"].tolist(), arrays["Thresholds"].tolist()):
+    machine = bob.learn.boosting.BoostedMachine()
+    for i in range(begin, end):
+      weak = bob.learn.boosting.LUTMachine(numpy.array(luts[i,:sizes[i]]).reshape((-1, 1)), numpy.array([indices[i]], numpy.int32))
+      machine.add_weak_machine(weak, float(weights[i]))
+    cascade.cascade.append(machine)
+    cascade.thresholds.append(threshold)
+    begin = end
+  cascade._indices()
+  return cascade
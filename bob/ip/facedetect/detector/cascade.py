@@ -1,7 +1,9 @@
 import numpy
+import copy
 from .._library import FeatureExtractor
+from .compiled import CompiledCascade
+from .statistics import CascadeStatistics
 
-import bob.learn.boosting
 
 class Cascade:
 
@@ -25,6 +27,7 @@ class Cascade:
 
     ``feature_extractor`` : :py:class:`FeatureExtractor`
       A feature extractor that will be used to extract features for the strong classifiers.
+      The cascade uses its own copy of this extractor (see :py:attr:`extractor`), so that the given extractor is not modified.
   """
 
 
@@ -33,7 +36,8 @@ class Cascade:
     if cascade_file is not None:
       self.load(cascade_file)
     else:
-      self.extractor = feature_extractor
+      # the model indices of the extractor are set by the cascade, so we use a copy
+      self.extractor = None if feature_extractor is None else FeatureExtractor(feature_extractor)
       self.cascade = []
       self.indices = []
       self.thresholds = []
@@ -55,6 +59,7 @@ class Cascade:
     ``begin``, ``end`` : int or ``None``
       If specified, only the weak machines with the indices ``range(begin,end)`` will be added.
     """
+    import bob.learn.boosting
     boosted_machine = bob.learn.boosting.BoostedMachine()
     if begin is None: begin = 0
     if end is None: end = len(classifier.weak_machines)
@@ -79,6 +84,7 @@ class Cascade:
     ``classification_threshold`` : float
       A single threshold that will be applied in all rounds of the cascade.
     """
+    import bob.learn.boosting
     indices = list(range(0, len(boosted_machine.weak_machines), classifiers_per_round))
     if indices[-1] != len(boosted_machine.weak_machines): indices.append(len(boosted_machine.weak_machines))
     self.cascade = []
@@ -92,6 +98,7 @@ class Cascade:
       self.thresholds = [classification_thresholds] * len(self.cascade)
     else:
       self.thresholds = classification_thresholds
+    self._indices()
 
 
   def generate_boosted_machine(self):
@@ -104,6 +111,7 @@ class Cascade:
     ``strong`` : :py:class:`bob.learn.boosting.BoostedMachine`
       The strong classifier as a combination of all classifiers in this cascade.
     """
+    import bob.learn.boosting
     strong = bob.learn.boosting.BoostedMachine()
     for machine, index in zip(self.cascade, self.indices):
       weak = machine.weak_machines
@@ -114,31 +122,185 @@ class Cascade:
     return strong
 
 
+  @property
+  def cascade(self):
+    """The list of strong classifiers :py:class:`bob.learn.boosting.BoostedMachine`; assigning a new list resets the compiled cascade, see :py:meth:`compile`"""
+    return self._cascade
+
+  @cascade.setter
+  def cascade(self, cascade):
+    self._cascade = cascade
+    self._compiled = None
+
+
+  @property
+  def thresholds(self):
+    """The rejection thresholds of the strong classifiers; assigning new thresholds resets the compiled cascade, see :py:meth:`compile`"""
+    return self._thresholds
+
+  @thresholds.setter
+  def thresholds(self, thresholds):
+    self._thresholds = thresholds
+    self._compiled = None
+
+
+  @property
+  def indices(self):
+    """The feature indices that are used by each of the strong classifiers; assigning new indices resets the compiled cascade, see :py:meth:`compile`"""
+    return self._indices_list
+
+  @indices.setter
+  def indices(self, indices):
+    self._indices_list = indices
+    self._compiled = None
+
+
   def _indices(self):
     # computes the list of indices from the current classifiers
     self.indices = []
     for classifier in self.cascade:
       self.indices.append(classifier.indices)
     self.feature = numpy.zeros(self.extractor.number_of_features, numpy.uint16)
+    if self.indices:
+      # the extractor only needs to compute dense LBP codes for the features that are used by the cascade
+      self.extractor.model_indices = numpy.unique(numpy.concatenate(self.indices)).astype(numpy.int32)
+    # the compiled cascade for the native evaluation is created on demand
+    self._compiled = None
+
+
+  def _compile(self):
+    # collects the feature indices, look-up tables and weights of all weak classifiers into a flat table
+    # returns None, when any of the weak classifiers is not a univariate LUT machine
+    import bob.learn.boosting
+    if self._compiled is not None and (len(self._compiled.stage_ends) != len(self.cascade) or not numpy.array_equal(self._compiled.thresholds, numpy.asarray(self.thresholds, numpy.float64).reshape((-1,)))):
+      # the strong classifiers or the thresholds have been modified in place
+      self._compiled = None
+    if self._compiled is None:
+      indices, luts, weights, ends = [], [], [], []
+      for machine in self.cascade:
+        machine_weights = machine.weights
+        for i, weak in enumerate(machine.weak_machines):
+          if not isinstance(weak, bob.learn.boosting.LUTMachine) or weak.lut.shape[1] != 1:
+            return None
+          indices.append(weak.indices[0])
+          luts.append(weak.lut[:,0])
+          weights.append(machine_weights[i,0])
+        ends.append(len(indices))
+      tables = numpy.zeros((len(luts), max(len(l) for l in luts) if luts else 0))
+      for i, lut in enumerate(luts):
+        tables[i,:len(lut)] = lut
+      # the compiled cascade shares the extractor of this cascade
+      self._compiled = CompiledCascade(extractor = self.extractor, feature_indices = indices, look_up_tables = tables, weights = weights, stage_ends = ends, thresholds = self.thresholds)._context(self.extractor)
+    return self._compiled
+
+
+  def compile(self):
+    """compile() -> compiled
+
+    Compiles this cascade into a flat table of weak classifiers.
+
+    The returned :py:class:`CompiledCascade` contains the feature index, the LBP extractor index, the offset, the look-up table and the weight of each weak classifier, as well as the stage boundaries and thresholds, in contiguous arrays.
+    It shares the :py:class:`FeatureExtractor` with this cascade, and it can be evaluated (and saved and loaded) without :py:mod:`bob.learn.boosting`.
+
+    .. note::
+       Cascades can only be compiled, when all weak classifiers are univariate :py:class:`bob.learn.boosting.LUTMachine`\s, see :py:meth:`has_native_evaluation`.
+       The returned compiled cascade is not updated when this cascade is modified afterwards.
+       However, the native evaluation functions of this cascade (e.g., :py:meth:`evaluate_scale`) always use the current :py:attr:`thresholds` and strong classifiers, as :py:meth:`__call__` does.
+
+    **Returns:**
+
+    ``compiled`` : :py:class:`CompiledCascade`
+      The compiled version of this cascade
+    """
+    compiled = self._compile()
+    if compiled is None:
+      raise ValueError("This cascade contains weak classifiers that cannot be compiled")
+    return compiled
+
+
+  def has_native_evaluation(self):
+    """has_native_evaluation() -> native
+
+    Checks whether this cascade can be evaluated using :py:meth:`evaluate_scale`.
+
+    This is the case, when all weak classifiers are univariate :py:class:`bob.learn.boosting.LUTMachine`\s, which is true for cascades trained with this package.
+
+    **Returns:**
+
+    ``native`` : bool
+      ``True`` if :py:meth:`evaluate_scale` can be used with this cascade, ``False`` otherwise
+    """
+    return self._compile() is not None
+
+
+  def new_context(self):
+    """new_context() -> context
+
+    Creates a new evaluation context for this cascade.
+
+    A cascade stores the prepared image in its :py:attr:`extractor`, and the features of the current patch in a feature buffer, so a single cascade cannot be used in several threads at the same time.
+    The returned cascade shares the strong classifiers and the compiled look-up tables (see :py:meth:`compile`) with this cascade, but it has its own lists of classifiers and thresholds, its own :py:class:`FeatureExtractor` (including its own copies of the LBP extractors) and feature buffer.
+    Hence, creating a context is much cheaper than loading the cascade again, and one loaded cascade can serve several threads, each of which uses its own context:
 
+    .. code-block:: py
 
-  def prepare(self, image, scale):
+       >>> contexts = [cascade.new_context() for thread in range(4)]
+
+    Since the global interpreter lock is released during the evaluation of the patches (see :py:meth:`evaluate_scale`), the threads actually run in parallel.
+    Preparing the images keeps the global interpreter lock, and a cascade, whose extractor is evaluated in one thread, cannot prepare a new image in another thread (a :py:class:`RuntimeError` is raised); hence, please use one context per thread.
+
+    .. note::
+       The contexts should be created after the cascade is complete, since they are not updated when this cascade is modified.
+
+    **Returns:**
+
+    ``context`` : :py:class:`Cascade`
+      A cascade with the same classifiers, but its own prepared image
+    """
+    context = copy.copy(self)
+    # the lists of classifiers and thresholds are copied, so that adding classifiers to the context does not modify this cascade
+    context._cascade, context._thresholds, context._indices_list = copy.copy(self._cascade), copy.copy(self._thresholds), copy.copy(self._indices_list)
+    context.extractor = FeatureExtractor(self.extractor)
+    context.feature = numpy.zeros(context.extractor.number_of_features, numpy.uint16)
+    # compile this cascade (if possible), so that the compiled tables are shared as well
+    compiled = self._compile()
+    context._compiled = None if compiled is None else compiled._context(context.extractor)
+    return context
+
+
+  def new_statistics(self):
+    """new_statistics() -> statistics
+
+    Creates an empty statistics object for this cascade, which can be passed to :py:meth:`evaluate_scale` or :py:meth:`Sampler.iterate_cascade`.
+
+    **Returns:**
+
+    ``statistics`` : :py:class:`CascadeStatistics`
+      The empty statistics for the stages of this cascade
+    """
+    return CascadeStatistics([len(machine.weak_machines) for machine in self.cascade])
+
+
+  def prepare(self, image, scale, compute_integral_square_image = False):
     """Prepares the cascade for extracting features of the given image in the given scale.
 
     **Parameters:**
 
-    ``image`` : array_like (2D, float)
-      The image from which features will be extracted
+    ``image`` : array_like (2D, float) or :py:class:`ImagePyramid`
+      The image from which features will be extracted, or an image pyramid containing the scaled image
+
+    ``scale`` : float or int
+      The scale of the image, for which features will be extracted; if ``image`` is an :py:class:`ImagePyramid`, the level of the pyramid
 
-    ``scale`` : float
-      The scale of the image, for which features will be extracted
+    ``compute_integral_square_image`` : bool
+      Compute the integral square image, which is required to compute the variance of patches, see :py:meth:`FeatureExtractor.mean_variance`
     """
     # prepare the feature extractor with the given image and scale
-    self.extractor.prepare(image, scale)
+    self.extractor.prepare(image, scale, compute_integral_square_image)
 
 
-  def __call__(self, bounding_box):
-    """__call__(bounding_box) -> sum
+  def __call__(self, bounding_box, stage_counts = None):
+    """__call__(bounding_box, [stage_counts]) -> sum
 
     Computes the classification result of this cascade for the given bounding_box.
 
@@ -153,6 +315,9 @@ class Cascade:
       The bounding box for which the features should be classified.
       Please assure that the bounding box is inside the image resolution at the scale that was set by the latest call to :py:meth:`prepare`.
 
+    ``stage_counts`` : array_like (1D, int) or ``None``
+      If given, the elements of the stages that are evaluated for this bounding box are incremented, see :py:meth:`CascadeStatistics.new_counts`
+
     **Returns:**
 
     ``sum`` : float
@@ -162,6 +327,8 @@ class Cascade:
     # computes the classification for the given bounding box
     result = 0.
     for i in range(len(self.indices)):
+      if stage_counts is not None:
+        stage_counts[i] += 1
       # extract the features that we need for this round
       self.extractor.extract_indexed(bounding_box, self.feature, self.indices[i])
       result += self.cascade[i](self.feature)
@@ -171,6 +338,151 @@ class Cascade:
     return result
 
 
+  def evaluate_scale(self, image, scale, distance, threshold = None, statistics = None, minimum_variance = None):
+    """evaluate_scale(image, scale, distance, [threshold], [statistics], [minimum_variance]) -> top, left, prediction
+
+    Computes the classification results of this cascade for all patches of the given image in the given scale.
+
+    The image is scaled and all patches are sampled in the same way as :py:meth:`Sampler.sample_scaled` does, with the given ``distance``.
+    In opposition to calling this cascade for each patch, the whole scale is evaluated in C++ using the flat table from :py:meth:`compile`, see :py:meth:`FeatureExtractor.evaluate_cascade`.
+    Only those patches are returned, for which the prediction exceeds the given ``threshold``.
+
+    .. note::
+       This function is only available, when :py:meth:`has_native_evaluation` returns ``True``.
+
+    **Parameters:**
+
+    ``image`` : array_like (2D, float) or :py:class:`ImagePyramid`
+      The image for which the patches should be classified, or an image pyramid containing the scaled image
+
+    ``scale`` : float or int
+      The scale of the image, for which the patches should be classified; if ``image`` is an :py:class:`ImagePyramid`, the level of the pyramid
+
+    ``distance`` : int
+      The distance in both horizontal and vertical direction between two patches
+
+    ``threshold`` : float or ``None``
+      If given, only the patches, for which the prediction exceeds the given threshold, are returned
+
+    ``statistics`` : :py:class:`CascadeStatistics` or ``None``
+      If given, the number of patches that reach each stage (or that are rejected by the ``minimum_variance``) and the time spent in preparing and classifying are added to the statistics, see :py:meth:`new_statistics`
+
+    ``minimum_variance`` : float or ``None``
+      If given, patches with a lower variance of the pixel gray values are rejected in constant time using the integral square image, before any feature is extracted; these patches are not returned.
+      For :py:class:`ImagePyramid`\s, the pyramid needs to contain the integral square images, see :py:meth:`Sampler.image_pyramid`
+
+    **Returns:**
+
+    ``top, left`` : array_like (1D, int32)
+      The top-left positions of the patches in the scaled image
+
+    ``prediction`` : array_like (1D, float)
+      The sum of the cascaded classifiers (which might have been stopped before the last classifier) for each of the patches
+    """
+    return self.compile().evaluate_scale(image, scale, distance, threshold, statistics, minimum_variance)
+
+
+  def evaluate_scale_coarse_to_fine(self, image, scale, distance, coarse_distance, coarse_stages = 1, margin = 0., threshold = None, statistics = None, minimum_variance = None):
+    """evaluate_scale_coarse_to_fine(image, scale, distance, coarse_distance, [coarse_stages], [margin], [threshold], [statistics], [minimum_variance]) -> top, left, prediction
+
+    Computes the classification results of this cascade for the patches of the given image in the given scale in two passes.
+
+    In the first pass, only the first ``coarse_stages`` stages of the cascade are evaluated for the patches sampled with the ``coarse_distance``, using the stage thresholds lowered by the given ``margin``.
+    In the second pass, the full cascade is evaluated for those patches that would be sampled with the fine ``distance`` (as in :py:meth:`evaluate_scale`), and that are closer than ``coarse_distance`` (in both directions) to one of the patches that passed the first pass.
+    Hence, the returned patches and predictions are a subset of the ones returned by :py:meth:`evaluate_scale`.
+
+    Since most of the image is usually rejected in the first pass, this is much faster than :py:meth:`evaluate_scale`, especially for images with only few faces.
+    On the other hand, faces might be missed, for which none of the coarse patches pass the first pass.
+    Increasing the ``margin`` or decreasing the ``coarse_distance`` reduces the number of missed faces, at the cost of evaluating more patches; the number of evaluated patches can be measured by passing ``statistics``.
+
+    .. note::
+       This function is only available, when :py:meth:`has_native_evaluation` returns ``True``.
+
+    **Parameters:**
+
+    ``image`` : array_like (2D, float) or :py:class:`ImagePyramid`
+      The image for which the patches should be classified, or an image pyramid containing the scaled image
+
+    ``scale`` : float or int
+      The scale of the image, for which the patches should be classified; if ``image`` is an :py:class:`ImagePyramid`, the level of the pyramid
+
+    ``distance`` : int
+      The distance in both horizontal and vertical direction between two patches in the second (fine) pass
+
+    ``coarse_distance`` : int
+      The distance in both horizontal and vertical direction between two patches in the first (coarse) pass
+
+    ``coarse_stages`` : int
+      The number of cascade stages that are evaluated in the first pass
+
+    ``margin`` : float
+      The value, by which the thresholds of the cascade stages are lowered in the first pass
+
+    ``threshold`` : float or ``None``
+      If given, only the patches, for which the prediction exceeds the given threshold, are returned
+
+    ``statistics`` : :py:class:`CascadeStatistics` or ``None``
+      If given, the number of patches of both passes that reach each stage (or that are rejected by the ``minimum_variance``) and the time spent in preparing and classifying are added to the statistics, see :py:meth:`new_statistics`
+
+    ``minimum_variance`` : float or ``None``
+      If given, patches with a lower variance of the pixel gray values are rejected in both passes before any feature is extracted, see :py:meth:`evaluate_scale`
+
+    **Returns:**
+
+    ``top, left`` : array_like (1D, int32)
+      The top-left positions of the patches in the scaled image
+
+    ``prediction`` : array_like (1D, float)
+      The sum of the cascaded classifiers (which might have been stopped before the last classifier) for each of the patches
+    """
+    return self.compile().evaluate_scale_coarse_to_fine(image, scale, distance, coarse_distance, coarse_stages, margin, threshold, statistics, minimum_variance)
+
+
+  def evaluate_scales(self, image, scales, distance, threshold = None, num_threads = 1, minimum_variance = None):
+    """evaluate_scales(image, scales, distance, [threshold], [num_threads], [minimum_variance]) -> level, top, left, prediction
+
+    Computes the classification results of this cascade for all patches of the given image in all given scales, using several threads.
+
+    The results are identical to calling :py:meth:`evaluate_scale` for each of the ``scales``, but the scales are evaluated in parallel, see :py:meth:`FeatureExtractor.evaluate_cascade_scales`.
+    Since the global interpreter lock is released during the evaluation, several images can also be processed by several python threads in parallel.
+
+    .. note::
+       This function is only available, when :py:meth:`has_native_evaluation` returns ``True``.
+
+    **Parameters:**
+
+    ``image`` : array_like (2D, uint8 or float)
+      The image for which the patches should be classified
+
+    ``scales`` : [float]
+      The scales of the image, for which the patches should be classified
+
+    ``distance`` : int
+      The distance in both horizontal and vertical direction between two patches
+
+    ``threshold`` : float or ``None``
+      If given, only the patches, for which the prediction exceeds the given threshold, are returned
+
+    ``num_threads`` : int
+      The number of threads to use
+
+    ``minimum_variance`` : float or ``None``
+      If given, patches with a lower variance of the pixel gray values are rejected before any feature is extracted, see :py:meth:`evaluate_scale`
+
+    **Returns:**
+
+    ``level`` : array_like (1D, int32)
+      The index into ``scales`` of the scale, in which each of the patches was found
+
+    ``top, left`` : array_like (1D, int32)
+      The top-left positions of the patches in the scaled image
+
+    ``prediction`` : array_like (1D, float)
+      The sum of the cascaded classifiers (which might have been stopped before the last classifier) for each of the patches
+    """
+    return self.compile().evaluate_scales(image, scales, distance, threshold, num_threads, minimum_variance)
+
+
   def save(self, hdf5):
     """Saves this cascade into the given HDF5 file.
 
@@ -200,6 +512,7 @@ class Cascade:
     ``hdf5`` : :py:class:`bob.io.base.HDF5File`
       An HDF5 file open for reading
     """
+    import bob.learn.boosting
     # write the cascade to file
     self.thresholds = hdf5.read("Thresholds")
     self.cascade = []
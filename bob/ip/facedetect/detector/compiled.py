@@ -0,0 +1,427 @@
+import numpy
+import time
+import copy
+from .._library import FeatureExtractor, ImagePyramid
+
+import bob.ip.base
+from .statistics import CascadeStatistics
+
+
+class CompiledCascade:
+
+  """This class stores a cascade of look-up-table classifiers in a flat table.
+
+  In a :py:class:`Cascade`, the weak classifiers are stored in several :py:class:`bob.learn.boosting.BoostedMachine`\s, which are evaluated one after another.
+  Here, all weak classifiers of all cascade stages are stored in contiguous arrays, which can be evaluated without requiring :py:mod:`bob.learn.boosting`.
+  Usually, objects of this class are created using :py:meth:`Cascade.compile`, but they can also be saved to and loaded from file.
+
+  A compiled cascade can be used everywhere, where a :py:class:`Cascade` is used for detection, e.g., in :py:meth:`Sampler.iterate_cascade` or :py:func:`detect_all_faces`.
+
+  **Constructor Documentation:**
+
+    The constructor has two different ways to be called.
+    The first way is to load the compiled cascade from the given ``hdf5`` file.
+    The second way creates the compiled cascade from the given flat tables.
+
+    **Parameters:**
+
+    ``hdf5`` : :py:class:`bob.io.base.HDF5File`
+      An HDF5 file open for reading, which was written by :py:meth:`save`
+
+    ``extractor`` : :py:class:`FeatureExtractor`
+      The feature extractor that extracts the features for the weak classifiers; the compiled cascade uses its own copy of this extractor, so that the given extractor is not modified
+
+    ``feature_indices`` : array_like (1D, int32)
+      The index of the feature of each weak classifier
+
+    ``look_up_tables`` : array_like (2D, float)
+      The look-up table of each weak classifier (one row for each)
+
+    ``weights`` : array_like (1D, float)
+      The weight of each weak classifier
+
+    ``stage_ends`` : array_like (1D, int32)
+      For each cascade stage, the index of the first weak classifier that does not belong to that stage
+
+    ``thresholds`` : array_like (1D, float)
+      The rejection threshold of each cascade stage
+  """
+
+  def __init__(self, hdf5 = None, extractor = None, feature_indices = None, look_up_tables = None, weights = None, stage_ends = None, thresholds = None):
+    if hdf5 is not None:
+      self.load(hdf5)
+    else:
+      # the model indices of the extractor are set by the compiled cascade, so we use a copy
+      self.extractor = FeatureExtractor(extractor)
+      self.feature_indices = numpy.array(feature_indices, numpy.int32)
+      self.look_up_tables = numpy.array(look_up_tables, numpy.float64).reshape((len(self.feature_indices), -1))
+      self.weights = numpy.array(weights, numpy.float64)
+      self.stage_ends = numpy.array(stage_ends, numpy.int32)
+      self.thresholds = numpy.array(thresholds, numpy.float64)
+      self._init()
+
+
+  def _init(self, weighted = None, extractor_indices = None, offsets = None):
+    # checks the consistency of the tables and computes the derived tables (unless they are given, e.g., memory-mapped from a binary file)
+    if len(self.look_up_tables) != len(self.feature_indices) or len(self.weights) != len(self.feature_indices):
+      raise ValueError("The number of feature indices, look-up tables and weights differ")
+    if len(self.stage_ends) != len(self.thresholds):
+      raise ValueError("The number of stage ends and thresholds differ")
+    if len(self.stage_ends) and self.stage_ends[-1] > len(self.feature_indices):
+      raise ValueError("The last stage ends after the last weak classifier")
+
+    # the extractor and the offset of each weak classifier
+    if extractor_indices is None:
+      extractor_indices = numpy.array([self.extractor.extractor_index(int(i)) for i in self.feature_indices], numpy.int32).reshape((-1,))
+    if offsets is None:
+      offsets = numpy.array([self.extractor.offset(int(i)) for i in self.feature_indices], numpy.int32).reshape((-1, 2))
+    self.extractor_indices = extractor_indices
+    self.offsets = offsets
+    # the look-up tables are evaluated with the weights already applied
+    self._weighted = self.look_up_tables * self.weights[:,numpy.newaxis] if weighted is None else weighted
+    self._stages = [(begin, end) for begin, end in zip([0] + list(self.stage_ends[:-1]), self.stage_ends)]
+    self._stage_indices = [numpy.ascontiguousarray(self.feature_indices[begin:end]) for begin, end in self._stages]
+    self.feature = numpy.zeros(self.extractor.number_of_features, numpy.uint16)
+    self.extractor.model_indices = numpy.unique(self.feature_indices).astype(numpy.int32)
+
+
+  def _context(self, extractor):
+    # creates a copy of this compiled cascade, which shares all tables, but uses the given extractor and its own feature buffer
+    context = copy.copy(self)
+    context.extractor = extractor
+    context.feature = numpy.zeros(extractor.number_of_features, numpy.uint16)
+    return context
+
+
+  def new_context(self):
+    """new_context() -> context
+
+    Creates a new evaluation context for this compiled cascade.
+
+    The returned compiled cascade shares all tables (including the :py:attr:`look_up_tables`) and the LBP extractors with this cascade, but it has its own :py:class:`FeatureExtractor` and feature buffer, which store the prepared image.
+    Hence, this cascade and all of its contexts can be used in different threads at the same time, see :py:meth:`Cascade.new_context`.
+
+    **Returns:**
+
+    ``context`` : :py:class:`CompiledCascade`
+      A compiled cascade with the same tables, but its own prepared image
+    """
+    return self._context(FeatureExtractor(self.extractor))
+
+
+  def has_native_evaluation(self):
+    """has_native_evaluation() -> native
+
+    Compiled cascades can always be evaluated natively using :py:meth:`evaluate_scale`.
+
+    **Returns:**
+
+    ``native`` : bool
+      Always ``True``
+    """
+    return True
+
+
+  def tables(self):
+    """tables() -> feature_indices, look_up_tables, stage_ends, thresholds
+
+    Returns the tables in the format that :py:meth:`FeatureExtractor.evaluate_cascade` requires.
+
+    **Returns:**
+
+    ``feature_indices`` : array_like (1D, int32)
+      The index of the feature of each weak classifier
+
+    ``look_up_tables`` : array_like (2D, float)
+      The look-up tables of all weak classifiers, already multiplied with their weights
+
+    ``stage_ends`` : array_like (1D, int32)
+      For each cascade stage, the index of the first weak classifier that does not belong to that stage
+
+    ``thresholds`` : array_like (1D, float)
+      The rejection threshold of each cascade stage
+    """
+    return self.feature_indices, self._weighted, self.stage_ends, self.thresholds
+
+
+  def new_statistics(self):
+    """new_statistics() -> statistics
+
+    Creates an empty statistics object for this cascade, which can be passed to :py:meth:`evaluate_scale` or :py:meth:`Sampler.iterate_cascade`.
+
+    **Returns:**
+
+    ``statistics`` : :py:class:`CascadeStatistics`
+      The empty statistics for the stages of this cascade
+    """
+    return CascadeStatistics(numpy.diff(numpy.concatenate(([0], self.stage_ends))))
+
+
+  def prepare(self, image, scale, compute_integral_square_image = False):
+    """Prepares the cascade for extracting features of the given image in the given scale.
+
+    **Parameters:**
+
+    ``image`` : array_like (2D, float) or :py:class:`ImagePyramid`
+      The image from which features will be extracted, or an image pyramid containing the scaled image
+
+    ``scale`` : float or int
+      The scale of the image, for which features will be extracted; if ``image`` is an :py:class:`ImagePyramid`, the level of the pyramid
+
+    ``compute_integral_square_image`` : bool
+      Compute the integral square image, which is required to compute the variance of patches, see :py:meth:`FeatureExtractor.mean_variance`
+    """
+    self.extractor.prepare(image, scale, compute_integral_square_image)
+
+
+  def __call__(self, bounding_box, stage_counts = None):
+    """__call__(bounding_box, [stage_counts]) -> sum
+
+    Computes the classification result of this cascade for the given bounding_box.
+
+    The features will be extracted from the image at the scale that was set by the latest call to :py:meth:`prepare`.
+    The classification result is obtained by summing all results of all cascade steps, as long as the sum is not below the threshold of the current cascade step.
+
+    **Parameters:**
+
+    ``bounding_box`` : :py:class:`BoundingBox`
+      The bounding box for which the features should be classified.
+
+    ``stage_counts`` : array_like (1D, int) or ``None``
+      If given, the elements of the stages that are evaluated for this bounding box are incremented, see :py:meth:`CascadeStatistics.new_counts`
+
+    **Returns:**
+
+    ``sum`` : float
+      The sum of the cascaded classifiers (which might have been stopped before the last classifier)
+    """
+    result = 0.
+    for stage, ((begin, end), indices, threshold) in enumerate(zip(self._stages, self._stage_indices, self.thresholds)):
+      if stage_counts is not None:
+        stage_counts[stage] += 1
+      # extract the features that we need for this stage
+      self.extractor.extract_indexed(bounding_box, self.feature, indices)
+      result += self._weighted[numpy.arange(begin, end), self.feature[indices]].sum()
+      if result < threshold:
+        # break the cascade when the patch can already be rejected
+        break
+    return result
+
+
+  def evaluate_scale(self, image, scale, distance, threshold = None, statistics = None, minimum_variance = None):
+    """evaluate_scale(image, scale, distance, [threshold], [statistics], [minimum_variance]) -> top, left, prediction
+
+    Computes the classification results of this cascade for all patches of the given image in the given scale.
+
+    This function behaves exactly as :py:meth:`Cascade.evaluate_scale`.
+
+    **Parameters:**
+
+    ``image`` : array_like (2D, float) or :py:class:`ImagePyramid`
+      The image for which the patches should be classified, or an image pyramid containing the scaled image
+
+    ``scale`` : float or int
+      The scale of the image, for which the patches should be classified; if ``image`` is an :py:class:`ImagePyramid`, the level of the pyramid
+
+    ``distance`` : int
+      The distance in both horizontal and vertical direction between two patches
+
+    ``threshold`` : float or ``None``
+      If given, only the patches, for which the prediction exceeds the given threshold, are returned
+
+    ``statistics`` : :py:class:`CascadeStatistics` or ``None``
+      If given, the number of patches that reach each stage (or that are rejected by the ``minimum_variance``) and the time spent in preparing and classifying are added to the statistics
+
+    ``minimum_variance`` : float or ``None``
+      If given, patches with a lower variance of the pixel gray values are rejected before any feature is extracted, and they are not returned; for :py:class:`ImagePyramid`\s, the pyramid needs to contain the integral square images
+
+    **Returns:**
+
+    ``top, left`` : array_like (1D, int32)
+      The top-left positions of the patches in the scaled image
+
+    ``prediction`` : array_like (1D, float)
+      The sum of the cascaded classifiers for each of the patches
+    """
+    kwargs = {} if threshold is None else {'threshold' : threshold}
+    if minimum_variance is not None:
+      kwargs['minimum_variance'] = minimum_variance
+    if statistics is None:
+      self.prepare(image, scale, minimum_variance is not None)
+      return self.extractor.evaluate_cascade(*self.tables(), distance = distance, **kwargs)
+
+    start = time.time()
+    self.prepare(image, scale, minimum_variance is not None)
+    prepared = time.time()
+    counts = statistics.new_counts()
+    rejections = numpy.zeros(1, numpy.int64)
+    result = self.extractor.evaluate_cascade(*self.tables(), distance = distance, stage_counts = counts, variance_rejections = rejections, **kwargs)
+    statistics.add(image.scales[scale] if isinstance(image, ImagePyramid) else scale, counts, prepared - start, time.time() - prepared, rejections[0])
+    return result
+
+
+  def evaluate_scale_coarse_to_fine(self, image, scale, distance, coarse_distance, coarse_stages = 1, margin = 0., threshold = None, statistics = None, minimum_variance = None):
+    """evaluate_scale_coarse_to_fine(image, scale, distance, coarse_distance, [coarse_stages], [margin], [threshold], [statistics], [minimum_variance]) -> top, left, prediction
+
+    Computes the classification results of this cascade for the patches of the given image in the given scale in two passes.
+
+    This function behaves exactly as :py:meth:`Cascade.evaluate_scale_coarse_to_fine`.
+
+    **Parameters:**
+
+    ``image`` : array_like (2D, float) or :py:class:`ImagePyramid`
+      The image for which the patches should be classified, or an image pyramid containing the scaled image
+
+    ``scale`` : float or int
+      The scale of the image, for which the patches should be classified; if ``image`` is an :py:class:`ImagePyramid`, the level of the pyramid
+
+    ``distance`` : int
+      The distance in both horizontal and vertical direction between two patches in the second (fine) pass
+
+    ``coarse_distance`` : int
+      The distance in both horizontal and vertical direction between two patches in the first (coarse) pass
+
+    ``coarse_stages`` : int
+      The number of cascade stages that are evaluated in the first pass
+
+    ``margin`` : float
+      The value, by which the thresholds of the cascade stages are lowered in the first pass
+
+    ``threshold`` : float or ``None``
+      If given, only the patches, for which the prediction exceeds the given threshold, are returned
+
+    ``statistics`` : :py:class:`CascadeStatistics` or ``None``
+      If given, the number of patches of both passes that reach each stage (or that are rejected by the ``minimum_variance``) and the time spent in preparing and classifying are added to the statistics
+
+    ``minimum_variance`` : float or ``None``
+      If given, patches with a lower variance of the pixel gray values are rejected in both passes before any feature is extracted, and they are not returned; for :py:class:`ImagePyramid`\s, the pyramid needs to contain the integral square images
+
+    **Returns:**
+
+    ``top, left`` : array_like (1D, int32)
+      The top-left positions of the patches in the scaled image
+
+    ``prediction`` : array_like (1D, float)
+      The sum of the cascaded classifiers for each of the patches
+    """
+    if not len(self.stage_ends):
+      return self.evaluate_scale(image, scale, distance, threshold, statistics, minimum_variance)
+    if coarse_distance <= 0 or distance <= 0:
+      raise ValueError("The distances must be positive")
+
+    start = time.time()
+    self.prepare(image, scale, minimum_variance is not None)
+    prepared = time.time()
+    counts = None if statistics is None else statistics.new_counts()
+    rejections = numpy.zeros(1, numpy.int64)
+    variance = {} if minimum_variance is None else {'minimum_variance' : minimum_variance, 'variance_rejections' : rejections}
+    shape = image.shape(scale) if isinstance(image, ImagePyramid) else bob.ip.base.scaled_output_shape(image, scale)
+
+    # first pass: evaluate the first stages on the coarse grid, with the stage thresholds lowered by the margin
+    stages = max(1, min(coarse_stages, len(self.stage_ends)))
+    end = self.stage_ends[stages-1]
+    coarse_thresholds = self.thresholds[:stages] - margin
+    kwargs = {} if counts is None else {'stage_counts' : counts[:stages]}
+    kwargs.update(variance)
+    coarse_tops, coarse_lefts, _ = self.extractor.evaluate_cascade(self.feature_indices[:end], self._weighted[:end], self.stage_ends[:stages], coarse_thresholds, distance = coarse_distance, threshold = coarse_thresholds[-1], **kwargs)
+
+    # mark all patches of the fine grid that are closer than the coarse distance to one of the accepted coarse patches
+    rows = len(range(0, shape[-2] - self.extractor.patch_size[0], distance))
+    columns = len(range(0, shape[-1] - self.extractor.patch_size[1], distance))
+    mask = numpy.zeros((rows, columns), numpy.bool_)
+    for top, left in zip(coarse_tops.tolist(), coarse_lefts.tolist()):
+      mask[max((top - coarse_distance) // distance + 1, 0) : (top + coarse_distance - 1) // distance + 1, max((left - coarse_distance) // distance + 1, 0) : (left + coarse_distance - 1) // distance + 1] = True
+    positions = numpy.ascontiguousarray(numpy.transpose(numpy.nonzero(mask)) * distance, numpy.int32)
+
+    # second pass: evaluate the full cascade for the marked patches of the fine grid
+    kwargs = {} if threshold is None else {'threshold' : threshold}
+    if counts is not None:
+      kwargs['stage_counts'] = counts
+    kwargs.update(variance)
+    result = self.extractor.evaluate_cascade_positions(*self.tables(), positions = positions, **kwargs)
+    if statistics is not None:
+      statistics.add(image.scales[scale] if isinstance(image, ImagePyramid) else scale, counts, prepared - start, time.time() - prepared, rejections[0])
+    return result
+
+
+  def evaluate_scales(self, image, scales, distance, threshold = None, num_threads = 1, minimum_variance = None):
+    """evaluate_scales(image, scales, distance, [threshold], [num_threads], [minimum_variance]) -> level, top, left, prediction
+
+    Computes the classification results of this cascade for all patches of the given image in all given scales, using several threads.
+
+    This function behaves exactly as :py:meth:`Cascade.evaluate_scales`.
+
+    **Parameters:**
+
+    ``image`` : array_like (2D, uint8 or float)
+      The image for which the patches should be classified
+
+    ``scales`` : [float]
+      The scales of the image, for which the patches should be classified
+
+    ``distance`` : int
+      The distance in both horizontal and vertical direction between two patches
+
+    ``threshold`` : float or ``None``
+      If given, only the patches, for which the prediction exceeds the given threshold, are returned
+
+    ``num_threads`` : int
+      The number of threads to use
+
+    ``minimum_variance`` : float or ``None``
+      If given, patches with a lower variance of the pixel gray values are rejected before any feature is extracted, and they are not returned
+
+    **Returns:**
+
+    ``level`` : array_like (1D, int32)
+      The index into ``scales`` of the scale, in which each of the patches was found
+
+    ``top, left`` : array_like (1D, int32)
+      The top-left positions of the patches in the scaled image
+
+    ``prediction`` : array_like (1D, float)
+      The sum of the cascaded classifiers for each of the patches
+    """
+    scales = numpy.array(scales, numpy.float64)
+    kwargs = {} if threshold is None else {'threshold' : threshold}
+    if minimum_variance is not None:
+      kwargs['minimum_variance'] = minimum_variance
+    return self.extractor.evaluate_cascade_scales(image, scales, *self.tables(), distance = distance, num_threads = num_threads, **kwargs)
+
+
+  def save(self, hdf5):
+    """Saves this compiled cascade into the given HDF5 file.
+
+    **Parameters:**
+
+    ``hdf5`` : :py:class:`bob.io.base.HDF5File`
+      An HDF5 file open for writing
+    """
+    hdf5.set("FeatureIndices", self.feature_indices)
+    hdf5.set("LookUpTables", self.look_up_tables)
+    hdf5.set("Weights", self.weights)
+    hdf5.set("StageEnds", self.stage_ends)
+    hdf5.set("Thresholds", self.thresholds)
+    hdf5.create_group("FeatureExtractor")
+    hdf5.cd("FeatureExtractor")
+    self.extractor.save(hdf5)
+    hdf5.cd("..")
+
+
+  def load(self, hdf5):
+    """Loads this compiled cascade from the given HDF5 file.
+
+    **Parameters:**
+
+    ``hdf5`` : :py:class:`bob.io.base.HDF5File`
+      An HDF5 file open for reading
+    """
+    self.feature_indices = numpy.array(hdf5.read("FeatureIndices"), numpy.int32).reshape((-1,))
+    self.look_up_tables = numpy.array(hdf5.read("LookUpTables"), numpy.float64).reshape((len(self.feature_indices), -1))
+    self.weights = numpy.array(hdf5.read("Weights"), numpy.float64).reshape((-1,))
+    self.stage_ends = numpy.array(hdf5.read("StageEnds"), numpy.int32).reshape((-1,))
+    self.thresholds = numpy.array(hdf5.read("Thresholds"), numpy.float64).reshape((-1,))
+    hdf5.cd("FeatureExtractor")
+    self.extractor = FeatureExtractor(hdf5)
+    hdf5.cd("..")
+    self._init()
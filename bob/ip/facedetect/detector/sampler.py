@@ -1,8 +1,15 @@
 
 import math
-from .._library import BoundingBox
+import time
+import numpy
+from .._library import BoundingBox, ImagePyramid
+from ..boxes import BoundingBoxArray
 
 import bob.ip.base
+import bob.ip.color
+
+# the number of patches, for which Sampler.iterate extracts the features at once
+_ITERATE_BATCH_SIZE = 1024
 
 
 class Sampler:
@@ -28,20 +35,45 @@ class Sampler:
 
     ``distance`` : int
       the distance in both horizontal and vertical direction to generate samples
+
+    ``coarse_distance`` : int or ``None``
+      if given, :py:meth:`iterate_cascade` scans the images coarse-to-fine: patches sampled with the given (larger) distance are classified first, and only the neighborhoods of the accepted patches are sampled with ``distance``, see :py:meth:`Cascade.evaluate_scale_coarse_to_fine`
+
+    ``coarse_stages`` : int
+      the number of cascade stages that classify the coarsely sampled patches; only used when ``coarse_distance`` is given
+
+    ``coarse_margin`` : float
+      the value, by which the thresholds of the cascade stages are lowered for the coarsely sampled patches; only used when ``coarse_distance`` is given
+
+    ``minimum_size`` : float or None
+      if given, only bounding boxes with at least the given height (in pixels of the original image) are sampled
+
+    ``maximum_size`` : float or None
+      if given, only bounding boxes with at most the given height (in pixels of the original image) are sampled
+
+    ``minimum_variance`` : float or None
+      if given, :py:meth:`iterate_cascade` rejects all patches, whose pixel gray values (in the scaled image) have a lower variance, before the cascade is evaluated, see :py:meth:`Cascade.evaluate_scale`
   """
 
-  def __init__(self, patch_size = (24,20), scale_factor = math.pow(2., -1./16.), lowest_scale = math.pow(2., -6.), distance = 2):
+  def __init__(self, patch_size = (24,20), scale_factor = math.pow(2., -1./16.), lowest_scale = math.pow(2., -6.), distance = 2, coarse_distance = None, coarse_stages = 1, coarse_margin = 0., minimum_size = None, maximum_size = None, minimum_variance = None):
 
     self.m_patch_box = BoundingBox((0, 0), patch_size)
     self.m_scale_factor = scale_factor
     self.m_lowest_scale = lowest_scale
     self.m_distance = distance
+    self.m_coarse_distance = coarse_distance
+    self.m_coarse_stages = coarse_stages
+    self.m_coarse_margin = coarse_margin
+    self.m_minimum_size = minimum_size
+    self.m_maximum_size = maximum_size
+    self.m_minimum_variance = minimum_variance
 
 
   def scales(self, image):
     """scales(image) -> scale, shape
 
     Computes the all possible scales for the given image and yields a tuple of the scale and the scaled image shape as an iterator.
+    When the sampler was created with a ``minimum_size`` or ``maximum_size``, only the scales that sample bounding boxes of the according heights are returned.
 
     **Parameters::**
 
@@ -56,12 +88,26 @@ class Sampler:
     ``shape`` : (int, int) or (int, int, int)
       The shape of the image, when scaled with the current ``scale``
     """
+    for scale in self._scale_factors(image.shape):
+      scaled_image_shape = bob.ip.base.scaled_output_shape(image, scale)
+
+      # return both the scale and the scaled image size
+      yield scale, scaled_image_shape
+
+
+  def _scale_factors(self, shape):
+    # computes the scales of :py:meth:`scales` from the shape of the image only, so that the image itself is not accessed
     # compute the minimum scale so that the patch size still fits into the given image
-    minimum_scale = max(self.m_patch_box.size_f[0] / image.shape[-2], self.m_patch_box.size_f[1] / image.shape[-1])
+    minimum_scale = max(self.m_patch_box.size_f[0] / shape[-2], self.m_patch_box.size_f[1] / shape[-1])
     if self.m_lowest_scale:
       maximum_scale = min(minimum_scale / self.m_lowest_scale, 1.)
     else:
       maximum_scale = 1.
+    if self.m_minimum_size:
+      # bounding boxes in larger scales would be smaller than the minimum size
+      maximum_scale = min(maximum_scale, self.m_patch_box.size_f[0] / self.m_minimum_size)
+    # bounding boxes in smaller scales would be larger than the maximum size
+    smallest_scale = self.m_patch_box.size_f[0] / self.m_maximum_size if self.m_maximum_size else 0.
     current_scale_power = 0.
 
     # iterate over all possible scales
@@ -72,10 +118,69 @@ class Sampler:
         # image is smaller than the requested minimum size
         break
       current_scale_power -= 1.
-      scaled_image_shape = bob.ip.base.scaled_output_shape(image, scale)
+      if scale < smallest_scale:
+        # bounding boxes are larger than the requested maximum size
+        continue
+      yield scale
 
-      # return both the scale and the scaled image size
-      yield scale, scaled_image_shape
+
+  def image_pyramid(self, image, compute_integral_image = False, compute_integral_square_image = False):
+    """image_pyramid(image, [compute_integral_image], [compute_integral_square_image]) -> pyramid
+
+    Computes an :py:class:`ImagePyramid` of the given image, which contains the scaled images for all :py:meth:`scales`.
+
+    The returned pyramid can be passed to :py:meth:`iterate` and :py:meth:`iterate_cascade` instead of the image, so that the scaled images are computed only once, and smaller scales are computed from larger scales instead of from the full-resolution image.
+
+    .. note::
+       Since the scaled images are computed incrementally, they might differ slightly from the scaled images computed by :py:meth:`FeatureExtractor.prepare`, and so might the features and the predictions.
+
+    **Parameters:**
+
+    ``image`` : array_like(2D, uint8 or float)
+      The image, for which the pyramid should be computed
+
+    ``compute_integral_image`` : bool
+      Compute the integral images of all levels; required for multi-block LBP features
+
+    ``compute_integral_square_image`` : bool
+      Compute the integral square images of all levels; required to compute the variance of patches
+
+    **Returns:**
+
+    ``pyramid`` : :py:class:`ImagePyramid`
+      The image pyramid with one level for each of the :py:meth:`scales` of the given ``image``
+    """
+    scales = numpy.array([scale for scale, _ in self.scales(image)])
+    return ImagePyramid(image, scales, compute_integral_image, compute_integral_square_image)
+
+
+  def levels(self, image):
+    """levels(image) -> scale, shape, level
+
+    Yields the same scales and shapes as :py:meth:`scales`, together with the argument that needs to be passed to :py:meth:`FeatureExtractor.prepare`.
+
+    **Parameters::**
+
+    ``image`` : array_like(2D) or :py:class:`ImagePyramid`
+      The image, or the image pyramid as returned by :py:meth:`image_pyramid`
+
+    **Yields:**
+
+    ``scale`` : float
+      The next scale of the image to be considered
+
+    ``shape`` : (int, int)
+      The shape of the image, when scaled with the current ``scale``
+
+    ``level`` : float or int
+      The ``scale`` for images, or the level of the pyramid for :py:class:`ImagePyramid`\s
+    """
+    if isinstance(image, ImagePyramid):
+      for level, scale in enumerate(image.scales):
+        yield scale, image.shape(level), level
+    else:
+      for scale, scaled_image_shape in self.scales(image):
+        yield scale, scaled_image_shape, scale
 
 
   def sample_scaled(self, shape):
@@ -121,17 +226,78 @@ class Sampler:
         yield bb.scale(1./scale)
 
 
+  def sample_scaled_array(self, shape):
+    """sample_scaled_array(shape) -> positions
+
+    Returns the top-left positions of all bounding boxes that :py:meth:`sample_scaled` would generate for the given (scaled) image shape.
+
+    Instead of creating one :py:class:`BoundingBox` for each sampled patch, the positions are returned as a single array, in the same order as :py:meth:`sample_scaled` yields them.
+
+    **Parameters:**
+
+    ``shape`` : (int, int) or (int, int, int)
+      The (current) shape of the (scaled) image
+
+    **Returns:**
+
+    ``positions`` : array_like(2D, int32)
+      The top-left positions of all sampled patches, with one ``(top, left)`` row for each patch
+    """
+    tops = numpy.arange(0, shape[-2]-self.m_patch_box.bottomright[0], self.m_distance, dtype=numpy.int32)
+    lefts = numpy.arange(0, shape[-1]-self.m_patch_box.bottomright[1], self.m_distance, dtype=numpy.int32)
+    positions = numpy.empty((len(tops), len(lefts), 2), numpy.int32)
+    positions[:,:,0] = tops[:,numpy.newaxis] + self.m_patch_box.top
+    positions[:,:,1] = lefts[numpy.newaxis,:] + self.m_patch_box.left
+    return positions.reshape((-1, 2))
+
+
+  def sample_array(self, image):
+    """sample_array(image) -> windows
+
+    Returns all bounding boxes in different scales that :py:meth:`sample` would generate for the given image as a single array.
+
+    Each row of the returned array contains the scale, in which the patch was sampled, and the top, left, height and width of the patch in the coordinates of the original ``image``.
+    The rows are in the same order as the bounding boxes yielded by :py:meth:`sample`.
+
+    **Parameters:**
+
+    ``image`` : array_like(2D or 3D)
+      The image, for which the bounding boxes should be generated
+
+    **Returns:**
+
+    ``windows`` : array_like(2D, float)
+      An array of shape ``(N, 5)`` with one row ``(scale, top, left, height, width)`` for each of the ``N`` sampled patches
+    """
+    windows = []
+    for scale, scaled_image_shape in self.scales(image):
+      positions = self.sample_scaled_array(scaled_image_shape)
+      # compute the bounding boxes in the same way as BoundingBox.scale does
+      factor = 1./scale
+      scaled = numpy.empty((positions.shape[0], 5))
+      scaled[:,0] = scale
+      scaled[:,1:3] = positions * factor
+      scaled[:,3] = self.m_patch_box.size_f[0] * factor
+      scaled[:,4] = self.m_patch_box.size_f[1] * factor
+      windows.append(scaled)
+    if not windows:
+      return numpy.zeros((0, 5))
+    return numpy.concatenate(windows)
+
+
   def iterate(self, image, feature_extractor, feature_vector):
     """iterate(image, feature_extractor, feature_vector) -> bounding_box
 
     Scales the given image, and extracts features from all possible bounding boxes.
 
     For each of the sampled bounding boxes, this function fills the given pre-allocated feature vector and yields the current bounding box.
+    The features are extracted for batches of bounding boxes at once using :py:meth:`FeatureExtractor.extract_indexed_batch`, and copied into the ``feature_vector`` one by one.
+    Hence, only the features at the :py:attr:`FeatureExtractor.model_indices` of the ``feature_vector`` are valid.
 
     **Parameters:**
 
-    ``image`` : array_like(2D)
-      The given image to extract features for
+    ``image`` : array_like(2D) or :py:class:`ImagePyramid`
+      The given image to extract features for, or its image pyramid as returned by :py:meth:`image_pyramid`
 
     ``feature_extractor`` : :py:class:`FeatureExtractor`
       The feature extractor to use to extract the features for the sampled patches
@@ -144,17 +310,23 @@ class Sampler:
     ``bounding_box`` : :py:class:`BoundingBox`
       The bounding box for which the current features are extracted for
     """
-    for scale, scaled_image_shape in self.scales(image):
+    features = numpy.zeros((_ITERATE_BATCH_SIZE, len(feature_vector)), numpy.uint16)
+    height, width = self.m_patch_box.size_f
+    for scale, scaled_image_shape, level in self.levels(image):
       # prepare the feature extractor to extract features from the given image
-      feature_extractor.prepare(image, scale)
-      for bb in self.sample_scaled(scaled_image_shape):
-        # extract features for
-        feature_extractor.extract_indexed(bb, feature_vector)
-        yield bb.scale(1./scale)
+      feature_extractor.prepare(image, level)
+      positions = self.sample_scaled_array(scaled_image_shape)
+      # extract the features of a batch of patches at once
+      for start in range(0, len(positions), _ITERATE_BATCH_SIZE):
+        batch = positions[start : start + _ITERATE_BATCH_SIZE]
+        feature_extractor.extract_indexed_batch(BoundingBoxArray.from_arrays(batch[:,0], batch[:,1], height, width).boxes, features[:len(batch)])
+        for (top, left), feature in zip(batch.tolist(), features):
+          feature_vector[:] = feature
+          yield BoundingBox((top, left), (height, width)).scale(1./scale)
 
 
-  def iterate_cascade(self, cascade, image, threshold = None):
-    """iterate_cascade(self, cascade, image, [threshold]) -> prediction, bounding_box
+  def iterate_cascade(self, cascade, image, threshold = None, num_threads = None, statistics = None, roi = None):
+    """iterate_cascade(self, cascade, image, [threshold], [num_threads], [statistics], [roi]) -> prediction, bounding_box
 
     Iterates over the given image and computes the cascade of classifiers.
     This function will compute the cascaded classification result for the given ``image`` using the given ``cascade``.
@@ -163,19 +335,38 @@ class Sampler:
 
     .. note::
        The ``threshold`` does not overwrite the cascade thresholds `:py:attr:`Cascade.thresholds`, but only threshold the final prediction.
-       Specifying the ``threshold`` here is just slightly faster than thresholding the yielded prediction.
+       Specifying the ``threshold`` here is faster than thresholding the yielded prediction.
+
+    When the ``cascade`` supports it (see :py:meth:`Cascade.has_native_evaluation`), all patches of one scale are evaluated at once using :py:meth:`Cascade.evaluate_scale`.
+    If additionally ``num_threads`` is given, all scales are evaluated in parallel using :py:meth:`Cascade.evaluate_scales`, before the first result is yielded.
+    When this sampler was created with a ``coarse_distance``, each scale is instead scanned coarse-to-fine using :py:meth:`Cascade.evaluate_scale_coarse_to_fine`, which is faster, but might miss some of the faces; in this case, ``num_threads`` is ignored.
+
+    When this sampler was created with a ``minimum_variance``, flat patches (e.g., of uniform background) are rejected in constant time using the integral square image, before any feature is extracted; these patches are never yielded, independent of the ``threshold``.
+    For :py:class:`ImagePyramid`\s, the pyramid needs to be created with ``compute_integral_square_image`` enabled, see :py:meth:`image_pyramid`.
 
     **Parameters:**
 
     ``cascade`` : :py:class:`Cascade`
       The cascade that performs the predictions
 
-    ``image`` : array_like(2D)
-      The image for which the predictions should be computed
+    ``image`` : array_like(2D) or :py:class:`ImagePyramid`
+      The image for which the predictions should be computed, or its image pyramid as returned by :py:meth:`image_pyramid`
 
     ``threshold`` : float
       The threshold, which limits the number of predictions
 
+    ``num_threads`` : int or ``None``
+      If given, the number of threads that evaluate the scales of the ``image`` in parallel; ignored for :py:class:`ImagePyramid`\s and cascades without native evaluation
+
+    ``statistics`` : :py:class:`CascadeStatistics` or ``None``
+      If given, the number of windows that reach each cascade stage (or that are rejected by the ``minimum_variance``) and the time spent in preparing and classifying each scale are added to the statistics, see :py:meth:`Cascade.new_statistics`.
+      Statistics are collected scale by scale, so ``num_threads`` is ignored in this case.
+
+    ``roi`` : :py:class:`BoundingBox` or ``None``
+      If given, only the part of the ``image`` inside this region of interest is scaled and searched, i.e., all yielded bounding boxes lie inside of it.
+      The :py:meth:`scales` are computed for the region of interest, not for the whole ``image``.
+      Not supported for :py:class:`ImagePyramid`\s.
+
     **Yields:**
 
     ``prediction`` : float
@@ -185,11 +376,183 @@ class Sampler:
       An iterator over all possible sampled bounding boxes (which exceed the prediction ``threshold``, if given)
     """
 
-    for scale, scaled_image_shape in self.scales(image):
+    if roi is not None:
+      if isinstance(image, ImagePyramid):
+        raise ValueError("Regions of interest are not supported for image pyramids")
+      # search only the part of the image inside the region of interest
+      top, left = max(roi.top, 0), max(roi.left, 0)
+      bottom, right = min(roi.bottom, image.shape[-2]), min(roi.right, image.shape[-1])
+      if bottom > top and right > left:
+        for prediction, bounding_box in self.iterate_cascade(cascade, numpy.ascontiguousarray(image[top:bottom, left:right]), threshold, num_threads, statistics):
+          yield prediction, bounding_box.shift((top, left))
+      return
+
+    for prediction, bounding_box in self._iterate_cascade(cascade, image, self.levels(image), threshold, num_threads, statistics):
+      yield prediction, bounding_box
+
+
+  def _iterate_cascade(self, cascade, image, levels, threshold, num_threads, statistics):
+    # evaluates the cascade in the given levels (scale, shape, level) of the image, see iterate_cascade
+    if cascade.has_native_evaluation() and self.m_patch_box.size == cascade.extractor.patch_size:
+      if self.m_coarse_distance is not None:
+        for scale, scaled_image_shape, level in levels:
+          # evaluate the patches of the current scale coarse-to-fine
+          tops, lefts, predictions = cascade.evaluate_scale_coarse_to_fine(image, level, self.m_distance, self.m_coarse_distance, self.m_coarse_stages, self.m_coarse_margin, threshold, statistics, self.m_minimum_variance)
+          for top, left, prediction in zip(tops.tolist(), lefts.tolist(), predictions.tolist()):
+            yield prediction, self.m_patch_box.shift((top, left)).scale(1./scale)
+        return
+
+      if num_threads is not None and statistics is None and not isinstance(image, ImagePyramid):
+        # evaluate all scales at once in parallel
+        scales = [scale for scale, _, _ in levels]
+        levels, tops, lefts, predictions = cascade.evaluate_scales(image, scales, self.m_distance, threshold, num_threads, self.m_minimum_variance)
+        for level, top, left, prediction in zip(levels.tolist(), tops.tolist(), lefts.tolist(), predictions.tolist()):
+          yield prediction, self.m_patch_box.shift((top, left)).scale(1./scales[level])
+        return
+
+      for scale, scaled_image_shape, level in levels:
+        # evaluate all patches of the current scale at once
+        tops, lefts, predictions = cascade.evaluate_scale(image, level, self.m_distance, threshold, statistics, self.m_minimum_variance)
+        for top, left, prediction in zip(tops.tolist(), lefts.tolist(), predictions.tolist()):
+          yield prediction, self.m_patch_box.shift((top, left)).scale(1./scale)
+      return
+
+    for scale, scaled_image_shape, level in levels:
       # prepare the feature extractor to extract features from the given image
-      cascade.prepare(image, scale)
+      start = time.time()
+      cascade.prepare(image, level, self.m_minimum_variance is not None)
+      prepare_time, classification_time = time.time() - start, 0.
+      counts = None if statistics is None else statistics.new_counts()
+      rejections = 0
       for bb in self.sample_scaled(scaled_image_shape):
+        if self.m_minimum_variance is not None and cascade.extractor.mean_variance(bb, True)[1] < self.m_minimum_variance:
+          # reject flat patches without extracting any feature
+          rejections += 1
+          continue
         # return the prediction and the bounding box, if the prediction is over threshold
-        prediction = cascade(bb)
+        if statistics is None:
+          prediction = cascade(bb)
+        else:
+          start = time.time()
+          prediction = cascade(bb, counts)
+          classification_time += time.time() - start
         if threshold is None or prediction > threshold:
           yield prediction, bb.scale(1./scale)
+      if statistics is not None:
+        statistics.add(scale, counts, prepare_time, classification_time, rejections)
+
+
+  def tiles(self, shape, tile_size = None):
+    """tiles(shape, [tile_size]) -> tile, core
+
+    Splits an image of the given shape into overlapping tiles, which are searched by :py:meth:`iterate_cascade_tiled`.
+
+    Neighboring tiles overlap by the size of the largest bounding box that this sampler generates, which is defined by its ``maximum_size``.
+    The core of a tile is the tile without half of the overlap at each of its inner seams, so that the cores of all tiles partition the image.
+    Hence, each bounding box that is not larger than ``maximum_size`` lies completely inside of the tile, whose core contains the center of the bounding box.
+
+    **Parameters:**
+
+    ``shape`` : (int, int) or (int, int, int)
+      The shape of the image
+
+    ``tile_size`` : int or (int, int) or ``None``
+      The height and width of the tiles (including the overlap); if not given, four times the size of the largest bounding box
+
+    **Yields:**
+
+    ``tile`` : :py:class:`BoundingBox`
+      The next tile of the image
+
+    ``core`` : :py:class:`BoundingBox`
+      The core of the tile, which might have non-integral coordinates
+    """
+    if not self.m_maximum_size:
+      raise ValueError("Images can only be split into tiles by samplers with a maximum_size")
+    # the size of the largest bounding box
+    overlap = (int(math.ceil(self.m_maximum_size)), int(math.ceil(self.m_maximum_size * self.m_patch_box.size_f[1] / self.m_patch_box.size_f[0])))
+    if tile_size is None:
+      tile_size = (4 * overlap[0], 4 * overlap[1])
+    elif numpy.isscalar(tile_size):
+      tile_size = (tile_size, tile_size)
+    if tile_size[0] <= overlap[0] or tile_size[1] <= overlap[1]:
+      raise ValueError("The tile size %s needs to be larger than the largest bounding box %s" % (tuple(tile_size), overlap))
+
+    def _split(length, size, overlap):
+      # the start, the end and the core of the tiles along one axis
+      stride = size - overlap
+      count = max(int(math.ceil((length - overlap) / float(stride))), 1)
+      starts = [i * stride for i in range(count)]
+      cores = [0.] + [start + overlap / 2. for start in starts[1:]] + [float(length)]
+      return [(start, min(start + size, length), cores[i], cores[i+1]) for i, start in enumerate(starts)]
+
+    for top, bottom, core_top, core_bottom in _split(shape[-2], tile_size[0], overlap[0]):
+      for left, right, core_left, core_right in _split(shape[-1], tile_size[1], overlap[1]):
+        yield BoundingBox((top, left), (bottom - top, right - left)), BoundingBox((core_top, core_left), (core_bottom - core_top, core_right - core_left))
+
+
+  def iterate_cascade_tiled(self, cascade, image, tile_size = None, threshold = None, num_threads = None, statistics = None):
+    """iterate_cascade_tiled(self, cascade, image, [tile_size], [threshold], [num_threads], [statistics]) -> prediction, bounding_box
+
+    Iterates over the given (large) image tile by tile and computes the cascade of classifiers, see :py:meth:`iterate_cascade`.
+
+    The image is split into overlapping :py:meth:`tiles`, which are sized according to the ``maximum_size`` of this sampler, i.e., the largest face of interest.
+    Only one tile is copied into memory at a time, and all scaled images, integral images and LBP codes are computed for the current tile only.
+    Hence, the peak memory consumption is bounded by the ``tile_size``, not by the size of the ``image``.
+    When the ``image`` is a memory-mapped array, e.g., loaded with ``numpy.load(filename, mmap_mode='r')``, only the current tile is read from file.
+    Color images are converted to gray scale tile by tile.
+
+    All tiles are searched in the scales that :py:meth:`scales` computes for the whole ``image``.
+    The detections of all tiles are stitched at the tile seams: each bounding box is yielded only by the tile, whose core contains its center.
+    This removes duplicate detections in the overlapping regions, as well as detections of faces that are cut by the border of a tile, since these faces lie completely inside of a neighboring tile.
+    The remaining overlapping detections can be pruned with :py:func:`prune_detections`, as for :py:meth:`iterate_cascade`.
+
+    .. note::
+       The bounding boxes are sampled relative to the top-left corner of each tile, so they might differ slightly from the bounding boxes sampled by :py:meth:`iterate_cascade`.
+
+    **Parameters:**
+
+    ``cascade`` : :py:class:`Cascade`
+      The cascade that performs the predictions
+
+    ``image`` : array_like(2D aka gray or 3D aka RGB)
+      The image for which the predictions should be computed; can be a memory-mapped array
+
+    ``tile_size`` : int or (int, int) or ``None``
+      The size of the tiles, see :py:meth:`tiles`
+
+    ``threshold`` : float
+      The threshold, which limits the number of predictions
+
+    ``num_threads`` : int or ``None``
+      If given, the number of threads that evaluate the scales of each tile in parallel
+
+    ``statistics`` : :py:class:`CascadeStatistics` or ``None``
+      If given, the statistics of all tiles are added, see :py:meth:`iterate_cascade`
+
+    **Yields:**
+
+    ``prediction`` : float
+      The prediction value for the current bounding box
+
+    ``bounding_box`` : :py:class:`BoundingBox`
+      The current bounding box in the coordinates of the ``image``
+    """
+    scales = list(self._scale_factors(image.shape))
+    height, width = self.m_patch_box.size
+    for tile, core in self.tiles(image.shape, tile_size):
+      # copy only the current tile into memory
+      patch = numpy.ascontiguousarray(image[..., tile.top:tile.bottom, tile.left:tile.right])
+      if patch.ndim == 3:
+        patch = bob.ip.color.rgb_to_gray(patch)
+      # use the scales of the whole image, as far as the patch fits into the scaled tile
+      levels = []
+      for scale in scales:
+        shape = bob.ip.base.scaled_output_shape(patch, scale)
+        if shape[-2] > height and shape[-1] > width:
+          levels.append((scale, shape, scale))
+      for prediction, bounding_box in self._iterate_cascade(cascade, patch, levels, threshold, num_threads, statistics):
+        bounding_box = bounding_box.shift((tile.top, tile.left))
+        # stitch the tiles: keep only the bounding boxes that are centered in the core of this tile
+        if core.contains(bounding_box.center):
+          yield prediction, bounding_box
@@ -0,0 +1,152 @@
+import numpy
+
+
+class CascadeStatistics:
+  """This class accumulates statistics about the work that a cascade performs, separately for each scale of the image.
+
+  For each scale, the number of windows that reach each stage of the cascade, the number of windows rejected by the variance pre-filter (see ``minimum_variance`` in :py:class:`Sampler`), and the time spent in preparing the scaled image and in classifying the windows are recorded.
+  From these, further statistics such as the average number of features extracted per window or the rejection rate of each stage are derived.
+  Statistics can be accumulated by passing an object of this class to :py:meth:`Sampler.iterate_cascade`, :py:meth:`Cascade.evaluate_scale` or :py:meth:`Cascade.__call__`.
+
+  .. note::
+     When statistics are accumulated over several images, the statistics of all images are stored consecutively, i.e., :py:attr:`scales` might contain the same scale several times.
+
+  **Constructor Documentation:**
+
+    Creates an empty statistics object for a cascade with the given number of weak classifiers in each stage.
+
+    **Parameters:**
+
+    ``stage_sizes`` : [int]
+      The number of weak classifiers (i.e., of extracted features) in each stage of the cascade
+  """
+
+  def __init__(self, stage_sizes):
+    self.stage_sizes = numpy.array(stage_sizes, numpy.int64)
+    self.reset()
+
+
+  def reset(self):
+    """Removes all accumulated statistics."""
+    self.scales = []
+    self.stage_counts = []
+    self.variance_rejections = []
+    self.prepare_times = []
+    self.classification_times = []
+
+
+  def new_counts(self):
+    """new_counts() -> counts
+
+    Returns a new array of counters, which can be passed to the cascade evaluation functions.
+
+    **Returns:**
+
+    ``counts`` : array_like (1D, int64)
+      An array filled with zeros with one element for each stage of the cascade
+    """
+    return numpy.zeros(len(self.stage_sizes), numpy.int64)
+
+
+  def add(self, scale, stage_counts, prepare_time = 0., classification_time = 0., variance_rejections = 0):
+    """Adds the statistics of one scale of an image.
+
+    **Parameters:**
+
+    ``scale`` : float
+      The scale of the image
+
+    ``stage_counts`` : array_like (1D, int)
+      The number of windows that reached each stage of the cascade in this scale
+
+    ``prepare_time`` : float
+      The time in seconds spent in preparing the scaled image
+
+    ``classification_time`` : float
+      The time in seconds spent in classifying the windows of the scaled image
+
+    ``variance_rejections`` : int
+      The number of windows in this scale that were rejected by the variance pre-filter, i.e., that did not reach the first stage of the cascade
+    """
+    self.scales.append(scale)
+    self.stage_counts.append(numpy.array(stage_counts, numpy.int64))
+    self.variance_rejections.append(int(variance_rejections))
+    self.prepare_times.append(prepare_time)
+    self.classification_times.append(classification_time)
+
+
+  def __len__(self):
+    """Returns the number of scales, for which statistics were accumulated."""
+    return len(self.scales)
+
+
+  def arrays(self):
+    """arrays() -> statistics
+
+    Returns all statistics as :py:class:`numpy.ndarray`\s.
+
+    **Returns:**
+
+    ``statistics`` : dict
+      A dictionary containing the following entries, where ``N`` is the number of scales and ``S`` the number of cascade stages:
+
+      * ``scales`` : (N,) the scales
+      * ``windows`` : (N,) the number of windows sampled in each scale, including the ones rejected by the variance pre-filter
+      * ``variance_rejections`` : (N,) the number of windows rejected by the variance pre-filter in each scale
+      * ``stage_counts`` : (N,S) the number of windows that reached each stage in each scale
+      * ``rejections`` : (N,S) the number of windows that were rejected by each stage in each scale (the windows that pass the last stage are not counted)
+      * ``features`` : (N,) the number of features extracted in each scale
+      * ``features_per_window`` : (N,) the average number of features extracted per window in each scale
+      * ``prepare_times`` : (N,) the time in seconds spent in preparing each scale
+      * ``classification_times`` : (N,) the time in seconds spent in classifying the windows of each scale
+    """
+    stages = len(self.stage_sizes)
+    counts = numpy.array(self.stage_counts, numpy.int64).reshape((len(self), stages))
+    variance_rejections = numpy.array(self.variance_rejections, numpy.int64)
+    windows = (counts[:,0] if stages else numpy.zeros(len(self), numpy.int64)) + variance_rejections
+    rejections = numpy.zeros(counts.shape, numpy.int64)
+    rejections[:,:-1] = counts[:,:-1] - counts[:,1:]
+    features = numpy.dot(counts, self.stage_sizes)
+    return {
+      'scales' : numpy.array(self.scales, numpy.float64),
+      'windows' : windows,
+      'variance_rejections' : variance_rejections,
+      'stage_counts' : counts,
+      'rejections' : rejections,
+      'features' : features,
+      'features_per_window' : features / numpy.maximum(windows, 1).astype(numpy.float64),
+      'prepare_times' : numpy.array(self.prepare_times, numpy.float64),
+      'classification_times' : numpy.array(self.classification_times, numpy.float64),
+    }
+
+
+  def summary(self):
+    """summary() -> statistics
+
+    Returns the statistics summed over all scales.
+
+    **Returns:**
+
+    ``statistics`` : dict
+      A dictionary containing the following entries, where ``S`` is the number of cascade stages:
+
+      * ``windows`` : int, the total number of sampled windows
+      * ``variance_rejections`` : int, the number of windows rejected by the variance pre-filter
+      * ``stage_counts`` : (S,) the number of windows that reached each stage
+      * ``stage_rates`` : (S,) the fraction of windows that reached each stage
+      * ``features_per_window`` : float, the average number of features extracted per window
+      * ``prepare_time`` : float, the total time in seconds spent in preparing the scaled images
+      * ``classification_time`` : float, the total time in seconds spent in classifying the windows
+    """
+    arrays = self.arrays()
+    windows = int(arrays['windows'].sum())
+    counts = arrays['stage_counts'].sum(axis=0)
+    return {
+      'windows' : windows,
+      'variance_rejections' : int(arrays['variance_rejections'].sum()),
+      'stage_counts' : counts,
+      'stage_rates' : counts / float(max(windows, 1)),
+      'features_per_window' : arrays['features'].sum() / float(max(windows, 1)),
+      'prepare_time' : float(arrays['prepare_times'].sum()),
+      'classification_time' : float(arrays['classification_times'].sum()),
+    }
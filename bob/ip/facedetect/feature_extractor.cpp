@@ -9,6 +9,7 @@
 
 #include "main.h"
 #include <boost/format.hpp>
+#include <exception>
 
 /******************************************************************/
 /************ Constructor Section *********************************/
@@ -28,7 +29,7 @@ static auto FeatureExtractor_doc = bob::extension::ClassDoc(
     "Please use the :py:meth:`append` function to add LBP extractors.\n"
     "* In the second constructor, a given list of LBP extractors is specified.\n"
     "* The third constructor initializes a tight set of LBP extractors for different :py:attr:`bob.ip.base.LBP.radii`, by adding all possible combinations of x- and y- radii, until the ``patch_size`` is too small, or ``min_size`` (start) or ``max_size`` (end) is reached.\n"
-    "* The fourth constructor copies all LBP extractors from the given :py:class:`FeatureExtractor`\n"
+    "* The fourth constructor copies all LBP extractors from the given :py:class:`FeatureExtractor`; the LBP extractors are shared, but the copy has its own prepared images, so that both extractors can be used in different threads\n"
     "* The last constructor read the configuration from the given :py:class:`bob.io.base.HDF5File`.",
     true
   )
@@ -49,6 +50,16 @@ static auto FeatureExtractor_doc = bob::extension::ClassDoc(
 );
 
 
+// the evaluation functions read the prepared image without holding the global interpreter lock;
+// all functions that modify this extractor refuse to do so, while such an evaluation is running in another thread
+static bool _check_unused(PyBobIpFacedetectFeatureExtractorObject* self){
+  if (self->evaluations){
+    PyErr_Format(PyExc_RuntimeError, "%s : the feature extractor cannot be modified while it is evaluated in another thread; please use one context per thread, see Cascade.new_context", Py_TYPE(self)->tp_name);
+    return false;
+  }
+  return true;
+}
+
 static int PyBobIpFacedetectFeatureExtractor_init(PyBobIpFacedetectFeatureExtractorObject* self, PyObject* args, PyObject* kwargs) {
   BOB_TRY
 
@@ -150,11 +161,14 @@ PyObject* FeatureExtractor_Str(FeatureExtractorObject* self) {
 
 static auto image = bob::extension::VariableDoc(
   "image",
-  "array_like <2D, uint8>",
-  "The (prepared) image the next features will be extracted from, read access only"
+  "array_like <2D, float>",
+  "The (prepared) image the next features will be extracted from, read access only",
+  "When :py:attr:`single_precision` is enabled (and the LBP extractors are not multi-block), this is the single precision image of type :py:class:`numpy.float32`."
 );
 PyObject* PyBobIpFacedetectFeatureExtractor_image(PyBobIpFacedetectFeatureExtractorObject* self, void*){
   BOB_TRY
+  if (self->cxx->hasSinglePrecisionImage())
+    return PyBlitzArrayCxx_AsConstNumpy(self->cxx->getSinglePrecisionImage());
   return PyBlitzArrayCxx_AsConstNumpy(self->cxx->getImage());
   BOB_CATCH_MEMBER("image could not be read", 0)
 }
@@ -171,6 +185,7 @@ PyObject* PyBobIpFacedetectFeatureExtractor_get_model_indices(PyBobIpFacedetectF
 }
 int PyBobIpFacedetectFeatureExtractor_set_model_indices(PyBobIpFacedetectFeatureExtractorObject* self, PyObject* value, void*){
   BOB_TRY
+  if (!_check_unused(self)) return -1;
   PyBlitzArrayObject* data;
   if (!PyBlitzArray_Converter(value, &data)) return 0;
   auto data_ = make_safe(data);
@@ -226,6 +241,19 @@ PyObject* PyBobIpFacedetectFeatureExtractor_extractors(PyBobIpFacedetectFeatureE
   BOB_CATCH_MEMBER("extractors could not be read", 0)
 }
 
+static auto selected_offsets = bob::extension::VariableDoc(
+  "selected_offsets",
+  "array_like <2D, int32> or ``None``",
+  "The index of the LBP extractor and the offset of each feature, read access only",
+  "When the features are extracted only at selected offsets (see :py:meth:`append`), this is an array of shape ``(number_of_features, 3)``, which contains the extractor index and the ``(y, x)`` offset for each feature; otherwise it is ``None``."
+);
+PyObject* PyBobIpFacedetectFeatureExtractor_selected_offsets(PyBobIpFacedetectFeatureExtractorObject* self, void*){
+  BOB_TRY
+  if (!self->cxx->hasSelectedOffsets()) Py_RETURN_NONE;
+  return PyBlitzArrayCxx_AsConstNumpy(self->cxx->getSelectedOffsets());
+  BOB_CATCH_MEMBER("selected_offsets could not be read", 0)
+}
+
 static auto patch_size = bob::extension::VariableDoc(
   "patch_size",
   "(int, int)",
@@ -238,6 +266,57 @@ PyObject* PyBobIpFacedetectFeatureExtractor_patch_size(PyBobIpFacedetectFeatureE
 }
 
 
+static auto dense_codes = bob::extension::VariableDoc(
+  "dense_codes",
+  "bool",
+  "Compute dense LBP code images in :py:meth:`prepare`, read and write access",
+  "When enabled, :py:meth:`prepare` computes the LBP codes of all pixels of the prepared image at once, for each LBP extractor that is used by the :py:attr:`model_indices` (or for all extractors, when no model indices are set). "
+  "Afterwards, extracting a feature only reads the according code, instead of computing the LBP code for each patch separately, which speeds up the evaluation of overlapping patches. "
+  "The extracted features are identical to the ones extracted without dense code images. "
+  "This option has no effect for multi-block LBP extractors."
+);
+PyObject* PyBobIpFacedetectFeatureExtractor_get_dense_codes(PyBobIpFacedetectFeatureExtractorObject* self, void*){
+  BOB_TRY
+  if (self->cxx->getDenseCodes()) Py_RETURN_TRUE;
+  Py_RETURN_FALSE;
+  BOB_CATCH_MEMBER("dense_codes could not be read", 0)
+}
+int PyBobIpFacedetectFeatureExtractor_set_dense_codes(PyBobIpFacedetectFeatureExtractorObject* self, PyObject* value, void*){
+  BOB_TRY
+  if (!_check_unused(self)) return -1;
+  int dense = PyObject_IsTrue(value);
+  if (dense < 0) return -1;
+  self->cxx->setDenseCodes(dense > 0);
+  return 0;
+  BOB_CATCH_MEMBER("dense_codes could not be set", -1)
+}
+
+static auto single_precision = bob::extension::VariableDoc(
+  "single_precision",
+  "bool",
+  "Extract regular LBP features from a single precision image, read and write access",
+  "When enabled, :py:meth:`prepare` stores a copy of the scaled image in single precision (:py:class:`numpy.float32`), from which all features are extracted. "
+  "Compared to the double precision image, this halves the memory traffic of the feature extraction, so that larger parts of the image fit into the processor caches. "
+  "For :py:class:`numpy.uint8` images that do not need to be scaled (i.e., with scale ``1``), the image is converted directly, without computing the double precision image at all.\n\n"
+  "Since rounding to single precision keeps the order of the gray values, the extracted features only differ, when two gray values of the scaled image are closer than the single precision resolution, which happens very rarely. "
+  "The integral images (required by multi-block LBP extractors and for :py:meth:`mean_variance`) are always computed in double precision, since the scaled images are not integral; hence, this option has no effect for multi-block LBP extractors."
+);
+PyObject* PyBobIpFacedetectFeatureExtractor_get_single_precision(PyBobIpFacedetectFeatureExtractorObject* self, void*){
+  BOB_TRY
+  if (self->cxx->getSinglePrecision()) Py_RETURN_TRUE;
+  Py_RETURN_FALSE;
+  BOB_CATCH_MEMBER("single_precision could not be read", 0)
+}
+int PyBobIpFacedetectFeatureExtractor_set_single_precision(PyBobIpFacedetectFeatureExtractorObject* self, PyObject* value, void*){
+  BOB_TRY
+  if (!_check_unused(self)) return -1;
+  int single = PyObject_IsTrue(value);
+  if (single < 0) return -1;
+  self->cxx->setSinglePrecision(single > 0);
+  return 0;
+  BOB_CATCH_MEMBER("single_precision could not be set", -1)
+}
+
 static PyGetSetDef PyBobIpFacedetectFeatureExtractor_getseters[] = {
     {
       image.name(),
@@ -253,6 +332,20 @@ static PyGetSetDef PyBobIpFacedetectFeatureExtractor_getseters[] = {
       model_indices.doc(),
       0
     },
+    {
+      dense_codes.name(),
+      (getter)PyBobIpFacedetectFeatureExtractor_get_dense_codes,
+      (setter)PyBobIpFacedetectFeatureExtractor_set_dense_codes,
+      dense_codes.doc(),
+      0
+    },
+    {
+      single_precision.name(),
+      (getter)PyBobIpFacedetectFeatureExtractor_get_single_precision,
+      (setter)PyBobIpFacedetectFeatureExtractor_set_single_precision,
+      single_precision.doc(),
+      0
+    },
     {
       number_of_features.name(),
       (getter)PyBobIpFacedetectFeatureExtractor_number_of_features,
@@ -274,6 +367,13 @@ static PyGetSetDef PyBobIpFacedetectFeatureExtractor_getseters[] = {
       extractors.doc(),
       0
     },
+    {
+      selected_offsets.name(),
+      (getter)PyBobIpFacedetectFeatureExtractor_selected_offsets,
+      0,
+      selected_offsets.doc(),
+      0
+    },
     {
       patch_size.name(),
       (getter)PyBobIpFacedetectFeatureExtractor_patch_size,
@@ -303,6 +403,7 @@ static auto append = bob::extension::FunctionDoc(
 
 static PyObject* PyBobIpFacedetectFeatureExtractor_append(PyBobIpFacedetectFeatureExtractorObject* self, PyObject* args, PyObject* kwargs) {
   BOB_TRY
+  if (!_check_unused(self)) return 0;
   char** kwlist1 = append.kwlist(0);
   char** kwlist2 = append.kwlist(1);
 
@@ -355,6 +456,26 @@ static PyObject* PyBobIpFacedetectFeatureExtractor_extractor(PyBobIpFacedetectFe
   BOB_CATCH_MEMBER("cannot get extractor", 0)
 }
 
+static auto extractor_index = bob::extension::FunctionDoc(
+  "extractor_index",
+  "Get the index of the LBP feature extractor in :py:attr:`extractors` associated with the given feature index",
+  0,
+  true
+)
+.add_prototype("index", "extractor_index")
+.add_parameter("index", "int", "The feature index for which the extractor index should be retrieved")
+.add_return("extractor_index", "int", "The index of the feature extractor for the given feature index")
+;
+static PyObject* PyBobIpFacedetectFeatureExtractor_extractor_index(PyBobIpFacedetectFeatureExtractorObject* self, PyObject* args, PyObject* kwargs) {
+  BOB_TRY
+  char** kwlist = extractor_index.kwlist();
+
+  int index;
+  if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i", kwlist, &index)) return 0;
+  return Py_BuildValue("i", self->cxx->extractorIndex(index));
+  BOB_CATCH_MEMBER("cannot get extractor index", 0)
+}
+
 static auto offset = bob::extension::FunctionDoc(
   "offset",
   "Get the offset position associated with the given feature index",
@@ -381,17 +502,38 @@ static auto prepare = bob::extension::FunctionDoc(
   "prepare",
   "Take the given image to perform the next extraction steps for the given scale",
   "If ``compute_integral_square_image`` is enabled, the (internally stored) integral square image is computed as well. "
-  "This image is required to compute the variance of the pixels in a given patch, see :py:func:`mean_variance`",
+  "This image is required to compute the variance of the pixels in a given patch, see :py:func:`mean_variance`.\n\n"
+  "Instead of an image, an :py:class:`ImagePyramid` can be given, together with the ``level`` that should be used. "
+  "In this case, the scaled image and its integral images are not recomputed, but taken from the pyramid. "
+  "The pyramid must contain the integral images, when required by multi-block LBP features, or by ``compute_integral_square_image``.\n\n"
+  "This function cannot be called, while this extractor is evaluated in another thread (see :py:meth:`evaluate_cascade`); please use one extractor per thread instead.",
   true
 )
 .add_prototype("image, scale, [compute_integral_square_image]")
+.add_prototype("pyramid, level, [compute_integral_square_image]")
 .add_parameter("image", "array_like <2D, uint8 or float>", "The image that should be used in the next extraction step")
 .add_parameter("scale", "float", "The scale of the image to extract")
+.add_parameter("pyramid", ":py:class:`ImagePyramid`", "The image pyramid that contains the scaled image")
+.add_parameter("level", "int", "The level of the ``pyramid`` that should be used in the next extraction step")
 .add_parameter("compute_integral_square_image", "bool", "[Default: ``False``] : Enable the computation of the integral square image")
 ;
 static PyObject* PyBobIpFacedetectFeatureExtractor_prepare(PyBobIpFacedetectFeatureExtractorObject* self, PyObject* args, PyObject* kwargs) {
   BOB_TRY
-  char** kwlist = prepare.kwlist();
+  if (!_check_unused(self)) return 0;
+  char** kwlist = prepare.kwlist(0);
+  char** kwlist2 = prepare.kwlist(1);
+
+  PyObject* first = PyTuple_Size(args) ? PyTuple_GET_ITEM(args, 0) : (kwargs ? PyDict_GetItemString(kwargs, kwlist2[0]) : 0);
+  if (first && PyBobIpFacedetectImagePyramid_Check(first)){
+    PyBobIpFacedetectImagePyramidObject* pyramid;
+    int level;
+    PyObject* cisi = 0;
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O!i|O!", kwlist2, &PyBobIpFacedetectImagePyramid_Type, &pyramid, &level, &PyBool_Type, &cisi)){
+      return 0;
+    }
+    self->cxx->prepare(pyramid->cxx, level, f(cisi));
+    Py_RETURN_NONE;
+  }
 
   PyBlitzArrayObject* image;
   double scale;
@@ -404,13 +546,16 @@ static PyObject* PyBobIpFacedetectFeatureExtractor_prepare(PyBobIpFacedetectFeat
     PyErr_Format(PyExc_TypeError, "%s : The input image must be 2D, not %dD", Py_TYPE(self)->tp_name, (int)image->ndim);
     return 0;
   }
-  switch (image->type_num){
-    case NPY_UINT8: self->cxx->prepare(*PyBlitzArrayCxx_AsBlitz<uint8_t,2>(image), scale, f(cisi)); Py_RETURN_NONE;
-    case NPY_FLOAT64: self->cxx->prepare(*PyBlitzArrayCxx_AsBlitz<double,2>(image), scale, f(cisi)); Py_RETURN_NONE;
-    default:
-      PyErr_Format(PyExc_TypeError, "%s : The input image must be of type uint8 or float", Py_TYPE(self)->tp_name);
-      return 0;
+  if (image->type_num != NPY_UINT8 && image->type_num != NPY_FLOAT64){
+    PyErr_Format(PyExc_TypeError, "%s : The input image must be of type uint8 or float", Py_TYPE(self)->tp_name);
+    return 0;
   }
+  // the global interpreter lock is kept, since preparing the image modifies this extractor
+  if (image->type_num == NPY_UINT8)
+    self->cxx->prepare(*PyBlitzArrayCxx_AsBlitz<uint8_t,2>(image), scale, f(cisi));
+  else
+    self->cxx->prepare(*PyBlitzArrayCxx_AsBlitz<double,2>(image), scale, f(cisi));
+  Py_RETURN_NONE;
   BOB_CATCH_MEMBER("cannot prepare image", 0)
 }
 
@@ -428,6 +573,7 @@ static auto extract_all = bob::extension::FunctionDoc(
 ;
 static PyObject* PyBobIpFacedetectFeatureExtractor_extract_all(PyBobIpFacedetectFeatureExtractorObject* self, PyObject* args, PyObject* kwargs) {
   BOB_TRY
+  if (!_check_unused(self)) return 0;
   char** kwlist = extract_all.kwlist();
 
   PyBobIpFacedetectBoundingBoxObject* bb;
@@ -458,6 +604,7 @@ static auto extract_indexed = bob::extension::FunctionDoc(
 ;
 static PyObject* PyBobIpFacedetectFeatureExtractor_extract_indexed(PyBobIpFacedetectFeatureExtractorObject* self, PyObject* args, PyObject* kwargs) {
   BOB_TRY
+  if (!_check_unused(self)) return 0;
   char** kwlist = extract_indexed.kwlist();
 
   PyBobIpFacedetectBoundingBoxObject* bb;
@@ -482,15 +629,331 @@ static PyObject* PyBobIpFacedetectFeatureExtractor_extract_indexed(PyBobIpFacede
   BOB_CATCH_MEMBER("cannot extract indexed features", 0)
 }
 
+static auto extract_all_batch = bob::extension::FunctionDoc(
+  "extract_all_batch",
+  "Extracts all features for many bounding boxes into the given dataset of (training) features",
+  "This function computes the same features as calling :py:meth:`extract_all` for each of the given bounding boxes, where the features of the ``i``-th bounding box are written into the ``i``-th row of the ``dataset``. "
+  "All bounding boxes are processed in a single call. "
+  "The global interpreter lock is kept, since the extraction uses internal buffers of this extractor; hence, this function cannot be called while this extractor is evaluated in another thread (see :py:meth:`evaluate_cascade`).\n\n"
+  "Please call :py:meth:`prepare` before calling this function.",
+  true
+)
+.add_prototype("boxes, dataset")
+.add_parameter("boxes", "array_like <2D, float>", "The bounding boxes for which the features should be extracted, with one ``(top, left, height, width)`` row for each bounding box, e.g., :py:attr:`BoundingBoxArray.boxes`")
+.add_parameter("dataset", "array_like <2D, uint16>", "The (training) dataset, into which the features should be extracted; must be of shape (#boxes, :py:attr:`number_of_features`)")
+;
+static PyObject* PyBobIpFacedetectFeatureExtractor_extract_all_batch(PyBobIpFacedetectFeatureExtractorObject* self, PyObject* args, PyObject* kwargs) {
+  BOB_TRY
+  if (!_check_unused(self)) return 0;
+  char** kwlist = extract_all_batch.kwlist();
+
+  PyBlitzArrayObject* boxes,* dataset;
+  if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O&O&", kwlist, &PyBlitzArray_Converter, &boxes, &PyBlitzArray_OutputConverter, &dataset)){
+    return 0;
+  }
+  auto boxes_ = make_safe(boxes), dataset_ = make_safe(dataset);
+  auto b = PyBlitzArrayCxx_AsBlitz<double, 2>(boxes, "boxes");
+  auto ds = PyBlitzArrayCxx_AsBlitz<uint16_t, 2>(dataset, "dataset");
+  if (!b || !ds) return 0;
+
+  // the global interpreter lock is kept, since the extraction writes the feature images of this extractor
+  self->cxx->extractAllBatch(*b, *ds);
+  Py_RETURN_NONE;
+  BOB_CATCH_MEMBER("cannot extract all features for the batch", 0)
+}
+
+static auto extract_indexed_batch = bob::extension::FunctionDoc(
+  "extract_indexed_batch",
+  "Extracts the features only at the required locations, which defaults to :py:attr:`model_indices`, for many bounding boxes",
+  "This function computes the same features as calling :py:meth:`extract_indexed` for each of the given bounding boxes, where the features of the ``i``-th bounding box are written into the ``i``-th row of the ``dataset``; the features at other indices are not touched. "
+  "All bounding boxes are processed in a single call, keeping the global interpreter lock, see :py:meth:`extract_all_batch`.\n\n"
+  "Please call :py:meth:`prepare` before calling this function.",
+  true
+)
+.add_prototype("boxes, dataset, [indices]")
+.add_parameter("boxes", "array_like <2D, float>", "The bounding boxes for which the features should be extracted, with one ``(top, left, height, width)`` row for each bounding box, e.g., :py:attr:`BoundingBoxArray.boxes`")
+.add_parameter("dataset", "array_like <2D, uint16>", "The dataset, into which the features should be extracted; must be of shape (#boxes, :py:attr:`number_of_features`)")
+.add_parameter("indices", "array_like<1D,int32>", "The indices, for which the features should be extracted; if not given, :py:attr:`model_indices` is used (must be set beforehands)")
+;
+static PyObject* PyBobIpFacedetectFeatureExtractor_extract_indexed_batch(PyBobIpFacedetectFeatureExtractorObject* self, PyObject* args, PyObject* kwargs) {
+  BOB_TRY
+  if (!_check_unused(self)) return 0;
+  char** kwlist = extract_indexed_batch.kwlist();
+
+  PyBlitzArrayObject* boxes,* dataset,* indices = 0;
+  if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O&O&|O&", kwlist, &PyBlitzArray_Converter, &boxes, &PyBlitzArray_OutputConverter, &dataset, &PyBlitzArray_Converter, &indices)){
+    return 0;
+  }
+  auto boxes_ = make_safe(boxes), dataset_ = make_safe(dataset);
+  auto indices_ = make_xsafe(indices);
+  auto b = PyBlitzArrayCxx_AsBlitz<double, 2>(boxes, "boxes");
+  auto ds = PyBlitzArrayCxx_AsBlitz<uint16_t, 2>(dataset, "dataset");
+  if (!b || !ds) return 0;
+  blitz::Array<int32_t,1> none;
+  blitz::Array<int32_t,1>* i = &none;
+  if (indices){
+    i = PyBlitzArrayCxx_AsBlitz<int32_t, 1>(indices, "indices");
+    if (!i) return 0;
+    if (!i->extent(0)){
+      PyErr_Format(PyExc_ValueError, "%s : The given indices are empty", Py_TYPE(self)->tp_name);
+      return 0;
+    }
+  }
+
+  // the global interpreter lock is kept, since the extraction writes the feature images of this extractor
+  self->cxx->extractIndexedBatch(*b, *ds, *i);
+  Py_RETURN_NONE;
+  BOB_CATCH_MEMBER("cannot extract indexed features for the batch", 0)
+}
+
+template <typename T>
+static PyObject* _vector_to_numpy(const std::vector<T>& vector){
+  blitz::Array<T,1> array(vector.size());
+  std::copy(vector.begin(), vector.end(), array.begin());
+  return PyBlitzArrayCxx_AsNumpy(array);
+}
+
+static auto evaluate_cascade = bob::extension::FunctionDoc(
+  "evaluate_cascade",
+  "Evaluates a cascade of look-up-table classifiers for all patches of the prepared image",
+  "The patches are sampled in the same way as :py:meth:`Sampler.sample_scaled` does, i.e., with the given ``distance`` in both directions, using the :py:attr:`patch_size` of this extractor. "
+  "For each patch, the look-up-tables of the weak classifiers of one cascade stage are summed up, and the evaluation of the patch stops when the current sum is below the threshold of that stage. "
+  "Only those patches are returned, for which the final prediction is greater than the given ``threshold``.\n\n"
+  "If a positive ``minimum_variance`` is given, patches whose pixel gray values have a lower variance are rejected in constant time using the integral square image, before any feature is extracted; these patches are never returned. "
+  "In this case, the image needs to be prepared with ``compute_integral_square_image`` enabled, see :py:meth:`prepare`.\n\n"
+  "The global interpreter lock is released during the evaluation, so several python threads can evaluate their own feature extractors (see :py:meth:`Cascade.new_context`) in parallel. "
+  "Meanwhile, this extractor cannot be modified (e.g., by :py:meth:`prepare`) in other threads; such modifications raise a :py:class:`RuntimeError`.\n\n"
+  "Please call :py:meth:`prepare` before calling this function. "
+  "Usually, this function is not called directly, but through :py:meth:`Cascade.evaluate_scale`.",
+  true
+)
+.add_prototype("feature_indices, look_up_tables, stage_ends, stage_thresholds, distance, [threshold], [stage_counts], [minimum_variance], [variance_rejections]", "top, left, prediction")
+.add_parameter("feature_indices", "array_like <1D, int32>", "The feature index for each weak classifier")
+.add_parameter("look_up_tables", "array_like <2D, float>", "The look-up-tables of all weak classifiers (one row for each), already multiplied with the weak classifier weights")
+.add_parameter("stage_ends", "array_like <1D, int32>", "The index of the first weak classifier that does not belong to the cascade stage anymore")
+.add_parameter("stage_thresholds", "array_like <1D, float>", "The rejection thresholds of the cascade stages")
+.add_parameter("distance", "int", "The distance in both horizontal and vertical direction between two sampled patches")
+.add_parameter("threshold", "float", "[Default: ``-inf``] Only patches with predictions greater than this threshold are returned")
+.add_parameter("stage_counts", "array_like <1D, int64>", "[Default: ``None``] If given, the number of patches that reach each of the stages is added to this array, which must have the same length as ``stage_ends``")
+.add_parameter("minimum_variance", "float", "[Default: ``0``] If positive, patches with a lower variance of the pixel gray values are rejected before the cascade is evaluated")
+.add_parameter("variance_rejections", "array_like <1D, int64>", "[Default: ``None``] If given, the number of patches rejected by the ``minimum_variance`` is added to the single element of this array")
+.add_return("top", "array_like <1D, int32>", "The top positions of the returned patches in the prepared image")
+.add_return("left", "array_like <1D, int32>", "The left positions of the returned patches in the prepared image")
+.add_return("prediction", "array_like <1D, float>", "The predictions of the cascade for the returned patches")
+;
+static PyObject* PyBobIpFacedetectFeatureExtractor_evaluate_cascade(PyBobIpFacedetectFeatureExtractorObject* self, PyObject* args, PyObject* kwargs) {
+  BOB_TRY
+  char** kwlist = evaluate_cascade.kwlist();
+
+  PyBlitzArrayObject* indices,* luts,* ends,* thresholds,* counts = 0,* rejections = 0;
+  int distance;
+  double threshold = -std::numeric_limits<double>::infinity(), minimum_variance = 0.;
+  if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O&O&O&O&i|dO&dO&", kwlist, &PyBlitzArray_Converter, &indices, &PyBlitzArray_Converter, &luts, &PyBlitzArray_Converter, &ends, &PyBlitzArray_Converter, &thresholds, &distance, &threshold, &PyBlitzArray_OutputConverter, &counts, &minimum_variance, &PyBlitzArray_OutputConverter, &rejections)){
+    return 0;
+  }
+  auto indices_ = make_safe(indices), luts_ = make_safe(luts), ends_ = make_safe(ends), thresholds_ = make_safe(thresholds);
+  auto counts_ = make_xsafe(counts), rejections_ = make_xsafe(rejections);
+  auto i = PyBlitzArrayCxx_AsBlitz<int32_t, 1>(indices, "feature_indices");
+  auto l = PyBlitzArrayCxx_AsBlitz<double, 2>(luts, "look_up_tables");
+  auto e = PyBlitzArrayCxx_AsBlitz<int32_t, 1>(ends, "stage_ends");
+  auto t = PyBlitzArrayCxx_AsBlitz<double, 1>(thresholds, "stage_thresholds");
+  if (!i || !l || !e || !t) return 0;
+  blitz::Array<int64_t,1>* c = 0;
+  if (counts){
+    c = PyBlitzArrayCxx_AsBlitz<int64_t, 1>(counts, "stage_counts");
+    if (!c) return 0;
+  }
+  blitz::Array<int64_t,1>* r = 0;
+  if (rejections){
+    r = PyBlitzArrayCxx_AsBlitz<int64_t, 1>(rejections, "variance_rejections");
+    if (!r) return 0;
+    if (r->extent(0) != 1){
+      PyErr_Format(PyExc_ValueError, "%s : The variance_rejections must have exactly one element", Py_TYPE(self)->tp_name);
+      return 0;
+    }
+  }
+
+  std::vector<int32_t> tops, lefts;
+  std::vector<double> predictions;
+  int64_t rejected = 0;
+  std::exception_ptr error;
+  // the prepared image is only read, and this extractor cannot be modified by other python threads meanwhile
+  ++self->evaluations;
+  Py_BEGIN_ALLOW_THREADS
+  try {
+    self->cxx->evaluateCascade(*i, *l, *e, *t, distance, threshold, tops, lefts, predictions, c, minimum_variance, &rejected);
+  } catch (...) {
+    error = std::current_exception();
+  }
+  Py_END_ALLOW_THREADS
+  --self->evaluations;
+  if (error) std::rethrow_exception(error);
+  if (r) (*r)(0) += rejected;
+
+  return Py_BuildValue("NNN", _vector_to_numpy(tops), _vector_to_numpy(lefts), _vector_to_numpy(predictions));
+  BOB_CATCH_MEMBER("cannot evaluate cascade", 0)
+}
+
+static auto evaluate_cascade_positions = bob::extension::FunctionDoc(
+  "evaluate_cascade_positions",
+  "Evaluates a cascade of look-up-table classifiers for the patches of the prepared image at the given positions",
+  "This function computes the same predictions as :py:meth:`evaluate_cascade`, but only for the patches, whose top-left positions are given. "
+  "All patches need to lie inside the prepared image. "
+  "The patches are returned in the order of the given ``positions``.\n\n"
+  "Please call :py:meth:`prepare` before calling this function. "
+  "Usually, this function is not called directly, but through :py:meth:`Cascade.evaluate_scale_coarse_to_fine`.",
+  true
+)
+.add_prototype("feature_indices, look_up_tables, stage_ends, stage_thresholds, positions, [threshold], [stage_counts], [minimum_variance], [variance_rejections]", "top, left, prediction")
+.add_parameter("feature_indices", "array_like <1D, int32>", "The feature index for each weak classifier")
+.add_parameter("look_up_tables", "array_like <2D, float>", "The look-up-tables of all weak classifiers (one row for each), already multiplied with the weak classifier weights")
+.add_parameter("stage_ends", "array_like <1D, int32>", "The index of the first weak classifier that does not belong to the cascade stage anymore")
+.add_parameter("stage_thresholds", "array_like <1D, float>", "The rejection thresholds of the cascade stages")
+.add_parameter("positions", "array_like <2D, int32>", "The top-left positions of the patches to evaluate, with one ``(top, left)`` row for each patch")
+.add_parameter("threshold", "float", "[Default: ``-inf``] Only patches with predictions greater than this threshold are returned")
+.add_parameter("stage_counts", "array_like <1D, int64>", "[Default: ``None``] If given, the number of patches that reach each of the stages is added to this array, which must have the same length as ``stage_ends``")
+.add_parameter("minimum_variance", "float", "[Default: ``0``] If positive, patches with a lower variance of the pixel gray values are rejected before the cascade is evaluated")
+.add_parameter("variance_rejections", "array_like <1D, int64>", "[Default: ``None``] If given, the number of patches rejected by the ``minimum_variance`` is added to the single element of this array")
+.add_return("top", "array_like <1D, int32>", "The top positions of the returned patches in the prepared image")
+.add_return("left", "array_like <1D, int32>", "The left positions of the returned patches in the prepared image")
+.add_return("prediction", "array_like <1D, float>", "The predictions of the cascade for the returned patches")
+;
+static PyObject* PyBobIpFacedetectFeatureExtractor_evaluate_cascade_positions(PyBobIpFacedetectFeatureExtractorObject* self, PyObject* args, PyObject* kwargs) {
+  BOB_TRY
+  char** kwlist = evaluate_cascade_positions.kwlist();
+
+  PyBlitzArrayObject* indices,* luts,* ends,* thresholds,* positions,* counts = 0,* rejections = 0;
+  double threshold = -std::numeric_limits<double>::infinity(), minimum_variance = 0.;
+  if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O&O&O&O&O&|dO&dO&", kwlist, &PyBlitzArray_Converter, &indices, &PyBlitzArray_Converter, &luts, &PyBlitzArray_Converter, &ends, &PyBlitzArray_Converter, &thresholds, &PyBlitzArray_Converter, &positions, &threshold, &PyBlitzArray_OutputConverter, &counts, &minimum_variance, &PyBlitzArray_OutputConverter, &rejections)){
+    return 0;
+  }
+  auto indices_ = make_safe(indices), luts_ = make_safe(luts), ends_ = make_safe(ends), thresholds_ = make_safe(thresholds), positions_ = make_safe(positions);
+  auto counts_ = make_xsafe(counts), rejections_ = make_xsafe(rejections);
+  auto i = PyBlitzArrayCxx_AsBlitz<int32_t, 1>(indices, "feature_indices");
+  auto l = PyBlitzArrayCxx_AsBlitz<double, 2>(luts, "look_up_tables");
+  auto e = PyBlitzArrayCxx_AsBlitz<int32_t, 1>(ends, "stage_ends");
+  auto t = PyBlitzArrayCxx_AsBlitz<double, 1>(thresholds, "stage_thresholds");
+  auto p = PyBlitzArrayCxx_AsBlitz<int32_t, 2>(positions, "positions");
+  if (!i || !l || !e || !t || !p) return 0;
+  blitz::Array<int64_t,1>* c = 0;
+  if (counts){
+    c = PyBlitzArrayCxx_AsBlitz<int64_t, 1>(counts, "stage_counts");
+    if (!c) return 0;
+  }
+  blitz::Array<int64_t,1>* r = 0;
+  if (rejections){
+    r = PyBlitzArrayCxx_AsBlitz<int64_t, 1>(rejections, "variance_rejections");
+    if (!r) return 0;
+    if (r->extent(0) != 1){
+      PyErr_Format(PyExc_ValueError, "%s : The variance_rejections must have exactly one element", Py_TYPE(self)->tp_name);
+      return 0;
+    }
+  }
+
+  std::vector<int32_t> tops, lefts;
+  std::vector<double> predictions;
+  int64_t rejected = 0;
+  std::exception_ptr error;
+  // the prepared image is only read, and this extractor cannot be modified by other python threads meanwhile
+  ++self->evaluations;
+  Py_BEGIN_ALLOW_THREADS
+  try {
+    self->cxx->evaluateCascadePositions(*i, *l, *e, *t, *p, threshold, tops, lefts, predictions, c, minimum_variance, &rejected);
+  } catch (...) {
+    error = std::current_exception();
+  }
+  Py_END_ALLOW_THREADS
+  --self->evaluations;
+  if (error) std::rethrow_exception(error);
+  if (r) (*r)(0) += rejected;
+
+  return Py_BuildValue("NNN", _vector_to_numpy(tops), _vector_to_numpy(lefts), _vector_to_numpy(predictions));
+  BOB_CATCH_MEMBER("cannot evaluate cascade at positions", 0)
+}
+
+static auto evaluate_cascade_scales = bob::extension::FunctionDoc(
+  "evaluate_cascade_scales",
+  "Evaluates a cascade of look-up-table classifiers for all patches in all given scales of the image, using several threads",
+  "This function computes the same results as calling :py:meth:`prepare` and :py:meth:`evaluate_cascade` for each of the given ``scales``. "
+  "The scales are split into horizontal bands, which are distributed over ``num_threads`` threads, starting with the largest scales. "
+  "Each scale is prepared only once, and each thread evaluates the prepared scales with its own copy of this feature extractor. "
+  "The global interpreter lock is released during the evaluation, which neither uses nor modifies the image prepared in this extractor. "
+  "If a positive ``minimum_variance`` is given, the integral square images are computed for all scales, and flat patches are rejected as in :py:meth:`evaluate_cascade`. "
+  "The results are returned in the order of the given ``scales``, and in the order of :py:meth:`Sampler.sample_scaled` within each scale.\n\n"
+  "Usually, this function is not called directly, but through :py:meth:`Cascade.evaluate_scales`.",
+  true
+)
+.add_prototype("image, scales, feature_indices, look_up_tables, stage_ends, stage_thresholds, distance, [threshold], [num_threads], [minimum_variance]", "level, top, left, prediction")
+.add_parameter("image", "array_like <2D, uint8 or float>", "The image to evaluate the cascade for")
+.add_parameter("scales", "array_like <1D, float>", "The scales of the image to evaluate")
+.add_parameter("feature_indices", "array_like <1D, int32>", "The feature index for each weak classifier")
+.add_parameter("look_up_tables", "array_like <2D, float>", "The look-up-tables of all weak classifiers (one row for each), already multiplied with the weak classifier weights")
+.add_parameter("stage_ends", "array_like <1D, int32>", "The index of the first weak classifier that does not belong to the cascade stage anymore")
+.add_parameter("stage_thresholds", "array_like <1D, float>", "The rejection thresholds of the cascade stages")
+.add_parameter("distance", "int", "The distance in both horizontal and vertical direction between two sampled patches")
+.add_parameter("threshold", "float", "[Default: ``-inf``] Only patches with predictions greater than this threshold are returned")
+.add_parameter("num_threads", "int", "[Default: ``1``] The number of threads to use")
+.add_parameter("minimum_variance", "float", "[Default: ``0``] If positive, patches with a lower variance of the pixel gray values are rejected before the cascade is evaluated")
+.add_return("level", "array_like <1D, int32>", "The index into ``scales`` for each of the returned patches")
+.add_return("top", "array_like <1D, int32>", "The top positions of the returned patches in the scaled image")
+.add_return("left", "array_like <1D, int32>", "The left positions of the returned patches in the scaled image")
+.add_return("prediction", "array_like <1D, float>", "The predictions of the cascade for the returned patches")
+;
+static PyObject* PyBobIpFacedetectFeatureExtractor_evaluate_cascade_scales(PyBobIpFacedetectFeatureExtractorObject* self, PyObject* args, PyObject* kwargs) {
+  BOB_TRY
+  char** kwlist = evaluate_cascade_scales.kwlist();
+
+  PyBlitzArrayObject* image,* scales,* indices,* luts,* ends,* thresholds;
+  int distance, num_threads = 1;
+  double threshold = -std::numeric_limits<double>::infinity(), minimum_variance = 0.;
+  if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O&O&O&O&O&O&i|did", kwlist, &PyBlitzArray_Converter, &image, &PyBlitzArray_Converter, &scales, &PyBlitzArray_Converter, &indices, &PyBlitzArray_Converter, &luts, &PyBlitzArray_Converter, &ends, &PyBlitzArray_Converter, &thresholds, &distance, &threshold, &num_threads, &minimum_variance)){
+    return 0;
+  }
+  auto image_ = make_safe(image), scales_ = make_safe(scales), indices_ = make_safe(indices), luts_ = make_safe(luts), ends_ = make_safe(ends), thresholds_ = make_safe(thresholds);
+  if (image->ndim != 2 || (image->type_num != NPY_UINT8 && image->type_num != NPY_FLOAT64)){
+    PyErr_Format(PyExc_TypeError, "%s : The input image must be 2D and of type uint8 or float", Py_TYPE(self)->tp_name);
+    return 0;
+  }
+  auto s = PyBlitzArrayCxx_AsBlitz<double, 1>(scales, "scales");
+  auto i = PyBlitzArrayCxx_AsBlitz<int32_t, 1>(indices, "feature_indices");
+  auto l = PyBlitzArrayCxx_AsBlitz<double, 2>(luts, "look_up_tables");
+  auto e = PyBlitzArrayCxx_AsBlitz<int32_t, 1>(ends, "stage_ends");
+  auto t = PyBlitzArrayCxx_AsBlitz<double, 1>(thresholds, "stage_thresholds");
+  if (!s || !i || !l || !e || !t) return 0;
+  std::vector<double> scale_list(s->begin(), s->end());
+
+  std::vector<int32_t> levels, tops, lefts;
+  std::vector<double> predictions;
+  // the evaluation uses a private copy of this extractor (with its own LBP extractors), which is created while holding the global interpreter lock;
+  // hence, other python threads can use (and modify) this extractor meanwhile
+  bob::ip::facedetect::FeatureExtractor extractor(*self->cxx);
+  std::exception_ptr error;
+  Py_BEGIN_ALLOW_THREADS
+  try {
+    if (image->type_num == NPY_UINT8)
+      extractor.evaluateCascadeScales(*PyBlitzArrayCxx_AsBlitz<uint8_t,2>(image), scale_list, *i, *l, *e, *t, distance, threshold, num_threads, levels, tops, lefts, predictions, minimum_variance);
+    else
+      extractor.evaluateCascadeScales(*PyBlitzArrayCxx_AsBlitz<double,2>(image), scale_list, *i, *l, *e, *t, distance, threshold, num_threads, levels, tops, lefts, predictions, minimum_variance);
+  } catch (...) {
+    error = std::current_exception();
+  }
+  Py_END_ALLOW_THREADS
+  if (error) std::rethrow_exception(error);
+
+  return Py_BuildValue("NNNN", _vector_to_numpy(levels), _vector_to_numpy(tops), _vector_to_numpy(lefts), _vector_to_numpy(predictions));
+  BOB_CATCH_MEMBER("cannot evaluate cascade scales", 0)
+}
+
 static auto mean_variance = bob::extension::FunctionDoc(
   "mean_variance",
   "Computes the mean (and the variance) of the pixel gray values in the given bounding box",
-  0,
+  "The mean and the (unbiased) variance are computed over all pixels of the bounding box, using the integral images of the prepared image. "
+  "Previous versions ignored the last row and column of the bounding box, so that the returned values differ slightly from earlier results.",
   true
 )
 .add_prototype("bounding_box, [compute_variance]", "mv")
 .add_parameter("bounding_box", ":py:class:`BoundingBox`", "The bounding box for which the mean (and variance) shoulf be calculated")
-.add_parameter("compute_variance", "bool", "[Default: ``False``] If enabled, the variance is computed as well; requires the ``compute_integral_square_image`` enabled in the :py:func:`prepare` function")
+.add_parameter("compute_variance", "bool", "[Default: ``False``] If enabled, the variance is computed as well; requires the ``compute_integral_square_image`` enabled in the :py:func:`prepare` function, otherwise a :py:class:`RuntimeError` is raised")
 .add_return("mv", "float or (float, float)", "The mean (or the mean and the variance) of the pixel gray values for the given bounding box")
 ;
 static PyObject* PyBobIpFacedetectFeatureExtractor_mean_variance(PyBobIpFacedetectFeatureExtractorObject* self, PyObject* args, PyObject* kwargs) {
@@ -525,6 +988,7 @@ static auto load = bob::extension::FunctionDoc(
 ;
 static PyObject* PyBobIpFacedetectFeatureExtractor_load(PyBobIpFacedetectFeatureExtractorObject* self, PyObject* args, PyObject* kwargs) {
   BOB_TRY
+  if (!_check_unused(self)) return 0;
   char** kwlist = load.kwlist();
 
   PyBobIoHDF5FileObject* hdf5;
@@ -574,6 +1038,12 @@ static PyMethodDef PyBobIpFacedetectFeatureExtractor_methods[] = {
     METH_VARARGS|METH_KEYWORDS,
     extractor.doc()
   },
+  {
+    extractor_index.name(),
+    (PyCFunction)PyBobIpFacedetectFeatureExtractor_extractor_index,
+    METH_VARARGS|METH_KEYWORDS,
+    extractor_index.doc()
+  },
   {
     offset.name(),
     (PyCFunction)PyBobIpFacedetectFeatureExtractor_offset,
@@ -598,6 +1068,36 @@ static PyMethodDef PyBobIpFacedetectFeatureExtractor_methods[] = {
     METH_VARARGS|METH_KEYWORDS,
     extract_indexed.doc()
   },
+  {
+    extract_all_batch.name(),
+    (PyCFunction)PyBobIpFacedetectFeatureExtractor_extract_all_batch,
+    METH_VARARGS|METH_KEYWORDS,
+    extract_all_batch.doc()
+  },
+  {
+    extract_indexed_batch.name(),
+    (PyCFunction)PyBobIpFacedetectFeatureExtractor_extract_indexed_batch,
+    METH_VARARGS|METH_KEYWORDS,
+    extract_indexed_batch.doc()
+  },
+  {
+    evaluate_cascade.name(),
+    (PyCFunction)PyBobIpFacedetectFeatureExtractor_evaluate_cascade,
+    METH_VARARGS|METH_KEYWORDS,
+    evaluate_cascade.doc()
+  },
+  {
+    evaluate_cascade_positions.name(),
+    (PyCFunction)PyBobIpFacedetectFeatureExtractor_evaluate_cascade_positions,
+    METH_VARARGS|METH_KEYWORDS,
+    evaluate_cascade_positions.doc()
+  },
+  {
+    evaluate_cascade_scales.name(),
+    (PyCFunction)PyBobIpFacedetectFeatureExtractor_evaluate_cascade_scales,
+    METH_VARARGS|METH_KEYWORDS,
+    evaluate_cascade_scales.doc()
+  },
   {
     mean_variance.name(),
     (PyCFunction)PyBobIpFacedetectFeatureExtractor_mean_variance,
@@ -0,0 +1,244 @@
+/**
+ * @brief Binds the ImagePyramid class to python
+ *
+ * Copyright (C) 2011-2014 Idiap Research Institute, Martigny, Switzerland
+ */
+
+#include "main.h"
+#include <boost/format.hpp>
+
+/******************************************************************/
+/************ Constructor Section *********************************/
+/******************************************************************/
+
+static auto ImagePyramid_doc = bob::extension::ClassDoc(
+  BOB_EXT_MODULE_PREFIX ".ImagePyramid",
+  "This class computes and stores several scaled versions of an image",
+  "All levels of the pyramid (including their integral images, if requested) are stored in a single pre-allocated memory block. "
+  "Each level is scaled from the nearest level that is at least twice as large, or from the original image, so that smaller levels do not need to read the full-resolution image. "
+  "Hence, the levels might differ slightly from the images that :py:meth:`FeatureExtractor.prepare` computes directly from the original image.\n\n"
+  "A :py:class:`FeatureExtractor` can attach to a level of the pyramid using :py:meth:`FeatureExtractor.prepare`, without copying or recomputing it. "
+  "Usually, image pyramids are generated using :py:meth:`Sampler.image_pyramid`."
+).add_constructor(
+  bob::extension::FunctionDoc(
+    "__init__",
+    "Computes the image pyramid for the given image in the given scales",
+    ".. note:: Multi-block LBP features require the integral images to be computed.",
+    true
+  )
+  .add_prototype("image, scales, [compute_integral_image], [compute_integral_square_image]", "")
+  .add_parameter("image", "array_like <2D, uint8 or float>", "The image to compute the pyramid for")
+  .add_parameter("scales", "[float]", "The scales of the image, one for each level of the pyramid")
+  .add_parameter("compute_integral_image", "bool", "[Default: ``False``] : Compute the integral images of all levels as well")
+  .add_parameter("compute_integral_square_image", "bool", "[Default: ``False``] : Compute the integral images and the integral square images of all levels as well")
+);
+
+
+static int PyBobIpFacedetectImagePyramid_init(PyBobIpFacedetectImagePyramidObject* self, PyObject* args, PyObject* kwargs) {
+  BOB_TRY
+
+  char** kwlist = ImagePyramid_doc.kwlist();
+
+  PyBlitzArrayObject* image,* scales;
+  PyObject* cii = 0,* cisi = 0;
+  if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O&O&|O!O!", kwlist, &PyBlitzArray_Converter, &image, &PyBlitzArray_Converter, &scales, &PyBool_Type, &cii, &PyBool_Type, &cisi)) return -1;
+  auto image_ = make_safe(image), scales_ = make_safe(scales);
+
+  if (image->ndim != 2){
+    PyErr_Format(PyExc_TypeError, "%s : The input image must be 2D, not %dD", Py_TYPE(self)->tp_name, (int)image->ndim);
+    return -1;
+  }
+  auto s = PyBlitzArrayCxx_AsBlitz<double, 1>(scales, "scales");
+  if (!s) return -1;
+  std::vector<double> scale_list(s->begin(), s->end());
+
+  switch (image->type_num){
+    case NPY_UINT8: self->cxx.reset(new bob::ip::facedetect::ImagePyramid(*PyBlitzArrayCxx_AsBlitz<uint8_t,2>(image), scale_list, f(cii), f(cisi))); return 0;
+    case NPY_FLOAT64: self->cxx.reset(new bob::ip::facedetect::ImagePyramid(*PyBlitzArrayCxx_AsBlitz<double,2>(image), scale_list, f(cii), f(cisi))); return 0;
+    default:
+      PyErr_Format(PyExc_TypeError, "%s : The input image must be of type uint8 or float", Py_TYPE(self)->tp_name);
+      return -1;
+  }
+
+  BOB_CATCH_MEMBER("cannot create ImagePyramid", -1)
+}
+
+static void PyBobIpFacedetectImagePyramid_delete(PyBobIpFacedetectImagePyramidObject* self) {
+  self->cxx.reset();
+  Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+int PyBobIpFacedetectImagePyramid_Check(PyObject* o) {
+  return PyObject_IsInstance(o, reinterpret_cast<PyObject*>(&PyBobIpFacedetectImagePyramid_Type));
+}
+
+
+/******************************************************************/
+/************ Variables Section ***********************************/
+/******************************************************************/
+
+static auto number_of_levels = bob::extension::VariableDoc(
+  "number_of_levels",
+  "int",
+  "The number of levels (i.e., scales) in this pyramid, read access only"
+);
+PyObject* PyBobIpFacedetectImagePyramid_number_of_levels(PyBobIpFacedetectImagePyramidObject* self, void*){
+  BOB_TRY
+  return Py_BuildValue("i", self->cxx->numberOfLevels());
+  BOB_CATCH_MEMBER("number_of_levels could not be read", 0)
+}
+
+static auto scales = bob::extension::VariableDoc(
+  "scales",
+  "array_like <1D, float>",
+  "The scales of all levels of this pyramid, read access only"
+);
+PyObject* PyBobIpFacedetectImagePyramid_scales(PyBobIpFacedetectImagePyramidObject* self, void*){
+  BOB_TRY
+  const std::vector<double>& s = self->cxx->scales();
+  blitz::Array<double,1> array(s.size());
+  std::copy(s.begin(), s.end(), array.begin());
+  return PyBlitzArrayCxx_AsNumpy(array);
+  BOB_CATCH_MEMBER("scales could not be read", 0)
+}
+
+static PyGetSetDef PyBobIpFacedetectImagePyramid_getseters[] = {
+    {
+      number_of_levels.name(),
+      (getter)PyBobIpFacedetectImagePyramid_number_of_levels,
+      0,
+      number_of_levels.doc(),
+      0
+    },
+    {
+      scales.name(),
+      (getter)PyBobIpFacedetectImagePyramid_scales,
+      0,
+      scales.doc(),
+      0
+    },
+    {0}  /* Sentinel */
+};
+
+
+/******************************************************************/
+/************ Functions Section ***********************************/
+/******************************************************************/
+
+static auto shape = bob::extension::FunctionDoc(
+  "shape",
+  "Returns the shape of the scaled image in the given level",
+  0,
+  true
+)
+.add_prototype("level", "shape")
+.add_parameter("level", "int", "The level of the pyramid")
+.add_return("shape", "(int, int)", "The shape of the scaled image in the given level")
+;
+static PyObject* PyBobIpFacedetectImagePyramid_shape(PyBobIpFacedetectImagePyramidObject* self, PyObject* args, PyObject* kwargs) {
+  BOB_TRY
+  char** kwlist = shape.kwlist();
+
+  int level;
+  if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i", kwlist, &level)) return 0;
+  const blitz::Array<double,2>& image = self->cxx->image(level);
+  return Py_BuildValue("ii", image.extent(0), image.extent(1));
+  BOB_CATCH_MEMBER("cannot get shape", 0)
+}
+
+static auto image = bob::extension::FunctionDoc(
+  "image",
+  "Returns a copy of the scaled image in the given level",
+  0,
+  true
+)
+.add_prototype("level", "image")
+.add_parameter("level", "int", "The level of the pyramid")
+.add_return("image", "array_like <2D, float>", "The scaled image in the given level")
+;
+static PyObject* PyBobIpFacedetectImagePyramid_image(PyBobIpFacedetectImagePyramidObject* self, PyObject* args, PyObject* kwargs) {
+  BOB_TRY
+  char** kwlist = image.kwlist();
+
+  int level;
+  if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i", kwlist, &level)) return 0;
+  return PyBlitzArrayCxx_AsNumpy(self->cxx->image(level).copy());
+  BOB_CATCH_MEMBER("cannot get image", 0)
+}
+
+static auto integral_image = bob::extension::FunctionDoc(
+  "integral_image",
+  "Returns a copy of the integral image of the given level",
+  "The integral image is only available, when the pyramid was created with ``compute_integral_image`` enabled.",
+  true
+)
+.add_prototype("level", "integral_image")
+.add_parameter("level", "int", "The level of the pyramid")
+.add_return("integral_image", "array_like <2D, float>", "The integral image of the given level, including a zero border")
+;
+static PyObject* PyBobIpFacedetectImagePyramid_integral_image(PyBobIpFacedetectImagePyramidObject* self, PyObject* args, PyObject* kwargs) {
+  BOB_TRY
+  char** kwlist = integral_image.kwlist();
+
+  int level;
+  if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i", kwlist, &level)) return 0;
+  return PyBlitzArrayCxx_AsNumpy(self->cxx->integralImage(level).copy());
+  BOB_CATCH_MEMBER("cannot get integral image", 0)
+}
+
+
+static PyMethodDef PyBobIpFacedetectImagePyramid_methods[] = {
+  {
+    shape.name(),
+    (PyCFunction)PyBobIpFacedetectImagePyramid_shape,
+    METH_VARARGS|METH_KEYWORDS,
+    shape.doc()
+  },
+  {
+    image.name(),
+    (PyCFunction)PyBobIpFacedetectImagePyramid_image,
+    METH_VARARGS|METH_KEYWORDS,
+    image.doc()
+  },
+  {
+    integral_image.name(),
+    (PyCFunction)PyBobIpFacedetectImagePyramid_integral_image,
+    METH_VARARGS|METH_KEYWORDS,
+    integral_image.doc()
+  },
+  {0} /* Sentinel */
+};
+
+
+/******************************************************************/
+/************ Module Section **************************************/
+/******************************************************************/
+
+// Define the ImagePyramid type struct; will be initialized later
+PyTypeObject PyBobIpFacedetectImagePyramid_Type = {
+  PyVarObject_HEAD_INIT(0,0)
+  0
+};
+
+bool init_BobIpFacedetectImagePyramid(PyObject* module)
+{
+  // initialize the type struct
+  PyBobIpFacedetectImagePyramid_Type.tp_name = ImagePyramid_doc.name();
+  PyBobIpFacedetectImagePyramid_Type.tp_basicsize = sizeof(PyBobIpFacedetectImagePyramidObject);
+  PyBobIpFacedetectImagePyramid_Type.tp_flags = Py_TPFLAGS_DEFAULT;
+  PyBobIpFacedetectImagePyramid_Type.tp_doc = ImagePyramid_doc.doc();
+
+  // set the functions
+  PyBobIpFacedetectImagePyramid_Type.tp_new = PyType_GenericNew;
+  PyBobIpFacedetectImagePyramid_Type.tp_init = reinterpret_cast<initproc>(PyBobIpFacedetectImagePyramid_init);
+  PyBobIpFacedetectImagePyramid_Type.tp_dealloc = reinterpret_cast<destructor>(PyBobIpFacedetectImagePyramid_delete);
+  PyBobIpFacedetectImagePyramid_Type.tp_methods = PyBobIpFacedetectImagePyramid_methods;
+  PyBobIpFacedetectImagePyramid_Type.tp_getset = PyBobIpFacedetectImagePyramid_getseters;
+
+  // check that everything is fine
+  if (PyType_Ready(&PyBobIpFacedetectImagePyramid_Type) < 0) return false;
+
+  // add the type to the module
+  Py_INCREF(&PyBobIpFacedetectImagePyramid_Type);
+  return PyModule_AddObject(module, "ImagePyramid", (PyObject*)&PyBobIpFacedetectImagePyramid_Type) >= 0;
+}
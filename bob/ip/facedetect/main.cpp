@@ -10,56 +10,106 @@
 #endif
 #include "main.h"
 
+// converts the given list of BoundingBox objects or the given (N,4) array of (top, left, height, width) into a vector of bounding boxes
+static bool _to_boxes(PyObject* detections, const char* function, std::vector<boost::shared_ptr<bob::ip::facedetect::BoundingBox>>& boxes){
+  if (PyList_Check(detections)){
+    boxes.resize(PyList_GET_SIZE(detections));
+    for (Py_ssize_t i = 0; i < PyList_GET_SIZE(detections); ++i){
+      PyObject* v = PyList_GET_ITEM(detections, i);
+      if (!PyBobIpFacedetectBoundingBox_Check(v)){
+        PyErr_Format(PyExc_TypeError, "%s : expected a list of BoundingBox objects, but object number %d is of type `%s'", function, (int)i, Py_TYPE(v)->tp_name);
+        return false;
+      }
+      boxes[i] = ((PyBobIpFacedetectBoundingBoxObject*)v)->cxx;
+    }
+    return true;
+  }
+
+  // any other object is converted to an array, e.g., a numpy.ndarray or a BoundingBoxArray
+  PyBlitzArrayObject* array;
+  if (!PyBlitzArray_Converter(detections, &array)) return false;
+  auto array_ = make_safe(array);
+  auto a = PyBlitzArrayCxx_AsBlitz<double,2>(array, "detections");
+  if (!a) return false;
+  if (a->extent(1) != 4){
+    PyErr_Format(PyExc_TypeError, "%s : detections must be a list of BoundingBox objects or an array of shape (N, 4), but the array has shape (%d, %d)", function, a->extent(0), a->extent(1));
+    return false;
+  }
+  boxes.resize(a->extent(0));
+  for (int i = 0; i < a->extent(0); ++i){
+    boxes[i].reset(new bob::ip::facedetect::BoundingBox((*a)(i,0), (*a)(i,1), (*a)(i,2), (*a)(i,3)));
+  }
+  return true;
+}
+
+// converts the given bounding boxes into the same type that the detections were given in
+static PyObject* _from_boxes(PyObject* detections, const std::vector<boost::shared_ptr<bob::ip::facedetect::BoundingBox>>& boxes){
+  if (PyList_Check(detections)){
+    PyObject* list = PyList_New(boxes.size());
+    for (Py_ssize_t i = 0; i < PyList_GET_SIZE(list); ++i){
+      PyBobIpFacedetectBoundingBoxObject* bb = reinterpret_cast<PyBobIpFacedetectBoundingBoxObject*>(PyBobIpFacedetectBoundingBox_Type.tp_alloc(&PyBobIpFacedetectBoundingBox_Type, 0));
+      bb->cxx = boxes[i];
+      PyList_SET_ITEM(list, i, Py_BuildValue("N", bb));
+    }
+    return list;
+  }
+
+  blitz::Array<double,2> array(boxes.size(), 4);
+  for (int i = 0; i < array.extent(0); ++i){
+    array(i,0) = boxes[i]->top();
+    array(i,1) = boxes[i]->left();
+    array(i,2) = boxes[i]->height();
+    array(i,3) = boxes[i]->width();
+  }
+  PyObject* result = PyBlitzArrayCxx_AsNumpy(array);
+  if (!result || PyArray_Check(detections)) return result;
+  // other array-like types (such as BoundingBoxArray) are constructed from the array
+  auto result_ = make_safe(result);
+  return PyObject_CallFunctionObjArgs((PyObject*)Py_TYPE(detections), result, NULL);
+}
+
+
 bob::extension::FunctionDoc prune_detections_doc = bob::extension::FunctionDoc(
   "prune_detections",
   "Prunes the given detected bounding boxes according to their predictions and returns the pruned bounding boxes and their predictions",
-  "For threshold >= 1., all detections will be returned (i.e., no pruning is performed), but the list will be sorted with descendingly predictions."
+  "For threshold >= 1., all detections will be returned (i.e., no pruning is performed), but the list will be sorted with descendingly predictions.\n\n"
+  "The ``detections`` can either be given as a list of :py:class:`BoundingBox` objects, or as a :py:class:`BoundingBoxArray` (or any other array of shape ``(N, 4)`` containing ``(top, left, height, width)`` rows). "
+  "The ``pruned_detections`` are returned in the same type as the ``detections``."
 )
 .add_prototype("detections, predictions, threshold, [number_of_detections]", "pruned_detections, pruned_predictions")
-.add_parameter("detections", "[:py:class:`BoundingBox`]", "A list of detected bouding boxes")
+.add_parameter("detections", "[:py:class:`BoundingBox`] or :py:class:`BoundingBoxArray`", "A list of detected bouding boxes")
 .add_parameter("predictions", "array_like <1D, float>", "The prediction (quality, weight, ...) values for the detections")
 .add_parameter("threshold", "float", "The overlap threshold (Jaccard similarity), for which detections should be pruned")
 .add_parameter("number_of_detections", "int", "[default: MAX_INT] The number of detections that should be returned")
-.add_return("pruned_detections", "[:py:class:`BoundingBox`]", "The list of pruned bounding boxes")
+.add_return("pruned_detections", "[:py:class:`BoundingBox`] or :py:class:`BoundingBoxArray`", "The list of pruned bounding boxes")
 .add_return("pruned_predictions", "array_like <float, 1D>", "The according predictions (qualities, weights, ...)")
 ;
 PyObject* PyBobIpFacedetect_PruneDetections(PyObject*, PyObject* args, PyObject* kwargs) {
   BOB_TRY
   char** kwlist = prune_detections_doc.kwlist();
 
-  PyObject* list;
+  PyObject* detections;
   PyBlitzArrayObject* predictions;
   double threshold;
   int number_of_detections = std::numeric_limits<int>::max();
 
-  if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O!O&d|i", kwlist, &PyList_Type, &list, &PyBlitzArray_Converter, &predictions, &threshold, &number_of_detections)) return 0;
+  if (!PyArg_ParseTupleAndKeywords(args, kwargs, "OO&d|i", kwlist, &detections, &PyBlitzArray_Converter, &predictions, &threshold, &number_of_detections)) return 0;
   auto predictions_ = make_safe(predictions);
   auto p = PyBlitzArrayCxx_AsBlitz<double,1>(predictions, "predictions");
   if (!p) return 0;
 
-  // get bounding box list
-  std::vector<boost::shared_ptr<bob::ip::facedetect::BoundingBox>> boxes(PyList_GET_SIZE(list)), pruned_boxes;
-  for (Py_ssize_t i = 0; i < PyList_GET_SIZE(list); ++i){
-    PyObject* v = PyList_GET_ITEM(list, i);
-    if (!PyBobIpFacedetectBoundingBox_Check(v)){
-      PyErr_Format(PyExc_TypeError, "prune_detections : expected a list of BoundingBox objects, but object number %d is of type `%s'", (int)i, Py_TYPE(v)->tp_name);
-      return 0;
-    }
-    boxes[i] = ((PyBobIpFacedetectBoundingBoxObject*)v)->cxx;
-  }
+  // get bounding boxes
+  std::vector<boost::shared_ptr<bob::ip::facedetect::BoundingBox>> boxes, pruned_boxes;
+  if (!_to_boxes(detections, "prune_detections", boxes)) return 0;
 
   blitz::Array<double,1> pruned_predictions;
 
   // perform pruning
   bob::ip::facedetect::pruneDetections(boxes, *p, threshold, pruned_boxes, pruned_predictions, number_of_detections);
 
-  // re-transform boxes into python list
-  PyObject* pruned = PyList_New(pruned_boxes.size());
-  for (Py_ssize_t i = 0; i < PyList_GET_SIZE(pruned); ++i){
-    PyBobIpFacedetectBoundingBoxObject* bb = reinterpret_cast<PyBobIpFacedetectBoundingBoxObject*>(PyBobIpFacedetectBoundingBox_Type.tp_alloc(&PyBobIpFacedetectBoundingBox_Type, 0));
-    bb->cxx = pruned_boxes[i];
-    PyList_SET_ITEM(pruned, i, Py_BuildValue("N", bb));
-  }
+  // re-transform boxes into python list or array
+  PyObject* pruned = _from_boxes(detections, pruned_boxes);
+  if (!pruned) return 0;
 
   // return tuple: detections, predictions
   return Py_BuildValue("NN", pruned, PyBlitzArrayCxx_AsNumpy(pruned_predictions));
@@ -71,51 +121,42 @@ PyObject* PyBobIpFacedetect_PruneDetections(PyObject*, PyObject* args, PyObject*
 bob::extension::FunctionDoc overlapping_detections_doc = bob::extension::FunctionDoc(
   "overlapping_detections",
   "Returns the detections and predictions that overlap with the best detection",
-  "For threshold >= 1., all detections will be returned (i.e., no pruning is performed), but the list will be sorted with descendingly predictions."
+  "For threshold >= 1., all detections will be returned (i.e., no pruning is performed), but the list will be sorted with descendingly predictions.\n\n"
+  "The ``detections`` can either be given as a list of :py:class:`BoundingBox` objects, or as a :py:class:`BoundingBoxArray` (or any other array of shape ``(N, 4)`` containing ``(top, left, height, width)`` rows). "
+  "The ``overlapped_detections`` are returned in the same type as the ``detections``."
 )
 .add_prototype("detections, predictions, threshold", "overlapped_detections, overlapped_predictions")
-.add_parameter("detections", "[:py:class:`BoundingBox`]", "A list of detected bouding boxes")
+.add_parameter("detections", "[:py:class:`BoundingBox`] or :py:class:`BoundingBoxArray`", "A list of detected bouding boxes")
 .add_parameter("predictions", "array_like <1D, float>", "The prediction (quality, weight, ...) values for the detections")
 .add_parameter("threshold", "float", "The overlap threshold (Jaccard similarity) which should be considered")
-.add_return("overlapped_detections", "[:py:class:`BoundingBox`]", "The list of overlapping bounding boxes")
+.add_return("overlapped_detections", "[:py:class:`BoundingBox`] or :py:class:`BoundingBoxArray`", "The list of overlapping bounding boxes")
 .add_return("overlapped_predictions", "array_like <float, 1D>", "The according predictions (qualities, weights, ...)")
 ;
 PyObject* PyBobIpFacedetect_OverlappingDetections(PyObject*, PyObject* args, PyObject* kwargs) {
   BOB_TRY
   char** kwlist = overlapping_detections_doc.kwlist();
 
-  PyObject* list;
+  PyObject* detections;
   PyBlitzArrayObject* predictions;
   double threshold;
 
-  if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O!O&d", kwlist, &PyList_Type, &list, &PyBlitzArray_Converter, &predictions, &threshold)) return 0;
+  if (!PyArg_ParseTupleAndKeywords(args, kwargs, "OO&d", kwlist, &detections, &PyBlitzArray_Converter, &predictions, &threshold)) return 0;
   auto predictions_ = make_safe(predictions);
   auto p = PyBlitzArrayCxx_AsBlitz<double,1>(predictions, "predictions");
   if (!p) return 0;
 
-  // get bounding box list
-  std::vector<boost::shared_ptr<bob::ip::facedetect::BoundingBox>> boxes(PyList_GET_SIZE(list)), overlapped_boxes;
-  for (Py_ssize_t i = 0; i < PyList_GET_SIZE(list); ++i){
-    PyObject* v = PyList_GET_ITEM(list, i);
-    if (!PyBobIpFacedetectBoundingBox_Check(v)){
-      PyErr_Format(PyExc_TypeError, "overlapping_detections : expected a list of BoundingBox objects, but object number %d is of type `%s'", (int)i, Py_TYPE(v)->tp_name);
-      return 0;
-    }
-    boxes[i] = ((PyBobIpFacedetectBoundingBoxObject*)v)->cxx;
-  }
+  // get bounding boxes
+  std::vector<boost::shared_ptr<bob::ip::facedetect::BoundingBox>> boxes, overlapped_boxes;
+  if (!_to_boxes(detections, "overlapping_detections", boxes)) return 0;
 
   blitz::Array<double,1> overlapped_predictions;
 
   // perform pruning
   bob::ip::facedetect::bestOverlap(boxes, *p, threshold, overlapped_boxes, overlapped_predictions);
 
-  // re-transform boxes into python list
-  PyObject* overlapped = PyList_New(overlapped_boxes.size());
-  for (Py_ssize_t i = 0; i < PyList_GET_SIZE(overlapped); ++i){
-    PyBobIpFacedetectBoundingBoxObject* bb = reinterpret_cast<PyBobIpFacedetectBoundingBoxObject*>(PyBobIpFacedetectBoundingBox_Type.tp_alloc(&PyBobIpFacedetectBoundingBox_Type, 0));
-    bb->cxx = overlapped_boxes[i];
-    PyList_SET_ITEM(overlapped, i, Py_BuildValue("N", bb));
-  }
+  // re-transform boxes into python list or array
+  PyObject* overlapped = _from_boxes(detections, overlapped_boxes);
+  if (!overlapped) return 0;
 
   // return tuple: detections, predictions
   return Py_BuildValue("NN", overlapped, PyBlitzArrayCxx_AsNumpy(overlapped_predictions));
@@ -167,6 +208,7 @@ static PyObject* create_module (void) {
   if (!module) return 0;
 
   if (!init_BobIpFacedetectBoundingBox(module)) return 0;
+  if (!init_BobIpFacedetectImagePyramid(module)) return 0;
   if (!init_BobIpFacedetectFeatureExtractor(module)) return 0;
 
   /* imports bob.blitz C-API + dependencies */
@@ -29,10 +29,22 @@ extern PyTypeObject PyBobIpFacedetectBoundingBox_Type;
 bool init_BobIpFacedetectBoundingBox(PyObject* module);
 int PyBobIpFacedetectBoundingBox_Check(PyObject* o);
 
+// Image pyramid
+typedef struct {
+  PyObject_HEAD
+  boost::shared_ptr<bob::ip::facedetect::ImagePyramid> cxx;
+} PyBobIpFacedetectImagePyramidObject;
+
+extern PyTypeObject PyBobIpFacedetectImagePyramid_Type;
+bool init_BobIpFacedetectImagePyramid(PyObject* module);
+int PyBobIpFacedetectImagePyramid_Check(PyObject* o);
+
 // Feature extractor
 typedef struct {
   PyObject_HEAD
   boost::shared_ptr<bob::ip::facedetect::FeatureExtractor> cxx;
+  // the number of evaluations, which currently read the prepared image without holding the global interpreter lock
+  int evaluations;
 } PyBobIpFacedetectFeatureExtractorObject;
 
 extern PyTypeObject PyBobIpFacedetectFeatureExtractor_Type;
@@ -0,0 +1,185 @@
+"""Measures the speed of the face detection.
+
+The loading of the cascade (from HDF5 and from the binary format), the computation of the scales, the preparation of the scaled images, the classification of the sampled patches, the pruning of the detections and the complete face detection are timed separately.
+The timings are measured for the bundled test image, for procedurally generated images of the given sizes, and for all combinations of the given distances and scale factors.
+All results are written in JSON format, as milliseconds per image and as sampled patches (windows) per second.
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+
+import numpy
+import pkg_resources
+
+import bob.io.base
+import bob.io.image
+import bob.ip.base
+import bob.ip.color
+import bob.ip.facedetect
+import bob.core
+logger = bob.core.log.setup("bob.ip.facedetect")
+
+
+def command_line_options(command_line_arguments):
+
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+  parser.add_argument('--images', '-i', nargs='*', default = [pkg_resources.resource_filename('bob.ip.facedetect', 'data/testimage.jpg')], help = "The image files to run the benchmark on.")
+  parser.add_argument('--synthetic-sizes', '-y', nargs='*', default = ['240x320', '480x640', '960x1280'], help = "The sizes (HEIGHTxWIDTH) of the procedurally generated images to run the benchmark on.")
+  parser.add_argument('--distances', '-s', type=int, nargs='+', default = [2, 4], help = "The distances with which the images should be scanned.")
+  parser.add_argument('--scale-factors', '-S', type=float, nargs='+', default = [math.pow(2.,-1./16.), math.pow(2.,-1./4.)], help = "The logarithmic distances between two scales (should be between 0 and 1).")
+  parser.add_argument('--lowest-scale', '-f', type=float, default = 0.125, help = "Faces which will be lower than the given scale times the image resolution will not be found.")
+  parser.add_argument('--cascade-file', '-r', default = pkg_resources.resource_filename('bob.ip.facedetect', 'MCT_cascade.hdf5'), help = "The file to read the cascade from.")
+  parser.add_argument('--prediction-threshold', '-t', type=float, default = 0., help = "The threshold for the detections that are pruned.")
+  parser.add_argument('--repetitions', '-R', type=int, default = 3, help = "The number of times each measurement is repeated; the fastest repetition is reported.")
+  parser.add_argument('--max-windows', '-W', type=int, default = 10000, help = "The maximum number of windows that are classified one by one.")
+  parser.add_argument('--output-file', '-w', help = "If given, the results are written into this file instead of to the console.")
+
+  bob.core.log.add_command_line_option(parser)
+  args = parser.parse_args(command_line_arguments)
+  bob.core.log.set_verbosity_level(logger, args.verbose)
+
+  return args
+
+
+def synthetic_image(shape, seed = 42):
+  """Generates a gray-scale image of the given shape with smooth random structures and noise, which is reproducible for the same ``seed``."""
+  generator = numpy.random.RandomState(seed)
+  image = numpy.zeros(shape)
+  # overlay several levels of smooth random structures
+  for cells in (4, 16, 64):
+    coarse = generator.uniform(0., 255., (cells, cells * shape[1] // shape[0] + 1))
+    scaled = numpy.ndarray(shape)
+    bob.ip.base.scale(coarse, scaled)
+    image += scaled / 3.
+  image += generator.normal(0., 8., shape)
+  return numpy.clip(image, 0., 255.).astype(numpy.uint8)
+
+
+def measure(function, repetitions):
+  """Calls the given function the given number of times, and returns the fastest time in seconds together with the result of the last call."""
+  best = float('inf')
+  for _ in range(repetitions):
+    start = time.time()
+    result = function()
+    best = min(best, time.time() - start)
+  return best, result
+
+
+def benchmark(name, image, cascade, sampler, args):
+  """Runs all measurements for the given image and sampler, and returns them in a dictionary."""
+  # compute the scales
+  scales_time, scales = measure(lambda: list(sampler.scales(image)), args.repetitions)
+  windows = sum(len(sampler.sample_scaled_array(shape)) for _, shape in scales)
+
+  # prepare the cascade for all scales
+  def prepare():
+    for scale, _ in scales:
+      cascade.prepare(image, scale)
+  prepare_time, _ = measure(prepare, args.repetitions)
+
+  # classify single windows in the largest scale
+  classify_time, classified = 0., 0
+  if scales:
+    scale, shape = scales[-1]
+    cascade.prepare(image, scale)
+    boxes = list(sampler.sample_scaled(shape))[:args.max_windows]
+    def classify():
+      for bb in boxes:
+        cascade(bb)
+    classify_time, _ = measure(classify, args.repetitions)
+    classified = len(boxes)
+
+  # prune the detections
+  detections, predictions = [], []
+  for prediction, bb in sampler.iterate_cascade(cascade, image, args.prediction_threshold):
+    detections.append(bb)
+    predictions.append(prediction)
+  prune_time = 0.
+  if detections:
+    prune_time, _ = measure(lambda: bob.ip.facedetect.prune_detections(detections, numpy.array(predictions), 0.2), args.repetitions)
+
+  # detect all faces
+  detect_time, _ = measure(lambda: bob.ip.facedetect.detect_all_faces(image, cascade, sampler, args.prediction_threshold), args.repetitions)
+
+  return {
+    'image' : name,
+    'shape' : list(image.shape),
+    'distance' : sampler.m_distance,
+    'scale_factor' : sampler.m_scale_factor,
+    'scales' : len(scales),
+    'windows' : windows,
+    'detections' : len(detections),
+    'scales_ms' : scales_time * 1000.,
+    'prepare_ms' : prepare_time * 1000.,
+    'classify_windows_per_second' : classified / classify_time if classify_time > 0. else None,
+    'prune_ms' : prune_time * 1000.,
+    'detect_ms' : detect_time * 1000.,
+    'detect_windows_per_second' : windows / detect_time if detect_time > 0. else None,
+  }
+
+
+def main(command_line_arguments = None):
+  args = command_line_options(command_line_arguments)
+
+  # load the cascade
+  logger.info("Loading cascade from file %s", args.cascade_file)
+  load_time, cascade = measure(lambda: bob.ip.facedetect.detector.Cascade(bob.io.base.HDF5File(args.cascade_file)), args.repetitions)
+  default_time, _ = measure(lambda: bob.ip.facedetect.default_cascade(cached = False), args.repetitions)
+  binary_time = None
+  if cascade.has_native_evaluation():
+    # measure the loading of the same cascade in the binary format
+    handle, binary_file = tempfile.mkstemp(suffix = ".bin", prefix = "cascade_")
+    os.close(handle)
+    try:
+      bob.ip.facedetect.save_binary_cascade(cascade, binary_file)
+      binary_time, _ = measure(lambda: bob.ip.facedetect.load_binary_cascade(binary_file), args.repetitions)
+    finally:
+      os.remove(binary_file)
+
+  # collect the images
+  images = []
+  for image_file in args.images:
+    image = bob.io.base.load(image_file)
+    if image.ndim == 3:
+      image = bob.ip.color.rgb_to_gray(image)
+    images.append((image_file, image))
+  for size in args.synthetic_sizes:
+    shape = tuple(int(s) for s in size.split('x'))
+    images.append(("synthetic-%s" % size, synthetic_image(shape)))
+
+  results = []
+  for name, image in images:
+    for distance in args.distances:
+      for scale_factor in args.scale_factors:
+        logger.info("Benchmarking image %s with distance %d and scale factor %f", name, distance, scale_factor)
+        sampler = bob.ip.facedetect.detector.Sampler(patch_size = cascade.extractor.patch_size, distance = distance, scale_factor = scale_factor, lowest_scale = args.lowest_scale)
+        result = benchmark(name, image, cascade, sampler, args)
+        logger.info("Detected faces in %3.2f ms (%d windows per second)", result['detect_ms'], result['detect_windows_per_second'] or 0)
+        results.append(result)
+
+  report = {
+    'configuration' : {
+      'cascade_file' : args.cascade_file,
+      'lowest_scale' : args.lowest_scale,
+      'prediction_threshold' : args.prediction_threshold,
+      'repetitions' : args.repetitions,
+    },
+    'cascade_load_ms' : load_time * 1000.,
+    'default_cascade_ms' : default_time * 1000.,
+    'binary_cascade_load_ms' : None if binary_time is None else binary_time * 1000.,
+    'results' : results,
+  }
+
+  if args.output_file is not None:
+    with open(args.output_file, 'w') as f:
+      json.dump(report, f, indent=2)
+    logger.info("Wrote results to file %s", args.output_file)
+  else:
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
@@ -25,6 +25,10 @@ def command_line_options(command_line_arguments):
 
   parser.add_argument('test_image', help = "Select the image to detect the face in.")
   parser.add_argument('--distance', '-s', type=int, default=2, help = "The distance with which the image should be scanned.")
+  parser.add_argument('--coarse-distance', '-c', type=int, help = "If given, the image is scanned coarse-to-fine, first with this distance, and then with --distance only around the accepted patches.")
+  parser.add_argument('--coarse-stages', type=int, default=1, help = "The number of cascade stages that are evaluated in the coarse scan; only used with --coarse-distance.")
+  parser.add_argument('--coarse-margin', type=float, default=0., help = "The value by which the cascade thresholds are lowered in the coarse scan; only used with --coarse-distance.")
+  parser.add_argument('--minimum-variance', type=float, help = "If given, patches with a lower variance of their gray values are rejected before the cascade is evaluated.")
   parser.add_argument('--scale-factor', '-S', type=float, default = math.pow(2.,-1./16.), help = "The logarithmic distance between two scales (should be between 0 and 1).")
   parser.add_argument('--lowest-scale', '-f', type=float, default = 0.125, help = "Faces which will be lower than the given scale times the image resolution will not be found.")
   parser.add_argument('--cascade-file', '-r', default = pkg_resources.resource_filename('bob.ip.facedetect', 'MCT_cascade.hdf5'), help = "The file to read the resulting cascade from; If left empty, the default cascade will be loaded")
@@ -33,6 +37,7 @@ def command_line_options(command_line_arguments):
   parser.add_argument('--best-detection-overlap', '-b', type=float, help = "If given, the average of the overlapping detections with this minimum overlap will be considered.")
   parser.add_argument('--write-detection', '-w', help = "If given, the resulting image will be written to the given file.")
   parser.add_argument('--no-display', '-x', action = 'store_true', help = "Disables the display of the detected faces.")
+  parser.add_argument('--threads', '-T', type=int, help = "If given, the scales of the image are searched in parallel using the given number of threads.")
 
   bob.core.log.add_command_line_option(parser)
   args = parser.parse_args(command_line_arguments)
@@ -48,7 +53,7 @@ def main(command_line_arguments = None):
   # load classifier and feature extractor
   cascade = bob.ip.facedetect.detector.Cascade(bob.io.base.HDF5File(args.cascade_file))
 
-  sampler = bob.ip.facedetect.detector.Sampler(distance=args.distance, scale_factor=args.scale_factor, lowest_scale=args.lowest_scale)
+  sampler = bob.ip.facedetect.detector.Sampler(distance=args.distance, scale_factor=args.scale_factor, lowest_scale=args.lowest_scale, coarse_distance=args.coarse_distance, coarse_stages=args.coarse_stages, coarse_margin=args.coarse_margin, minimum_variance=args.minimum_variance)
 
   # load test file
   test_image = bob.io.base.load(args.test_image)
@@ -58,7 +63,7 @@ def main(command_line_arguments = None):
   detections = []
   predictions = []
   # get the detection scores for the image
-  for prediction, bounding_box in sampler.iterate_cascade(cascade, test_image, args.prediction_threshold):
+  for prediction, bounding_box in sampler.iterate_cascade(cascade, test_image, args.prediction_threshold, args.threads):
     detections.append(bounding_box)
     predictions.append(prediction)
     logger.debug("Found bounding box %s with value %f", str(bounding_box), prediction)
@@ -6,6 +6,7 @@ import os
 
 import bob.io.base
 import bob.ip.facedetect
+import bob.learn.boosting
 import bob.blitz
 
 import bob.core
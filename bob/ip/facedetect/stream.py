@@ -0,0 +1,180 @@
+import math
+import numpy
+
+from .detector import Sampler
+from .detect import default_cascade, _load_cascade
+from ._library import BoundingBox, prune_detections
+
+import bob.ip.color
+
+
+class FaceStream:
+  """This class detects faces in a sequence of frames, e.g., of a video or a camera feed.
+
+  In opposition to calling :py:func:`detect_all_faces` for each frame, the faces detected in the previous frame (the :py:attr:`tracks`) are used to limit the search in the current frame.
+  For each track, only a region of interest around the previous face is searched, and only in scales close to the scale of the previous face.
+  The full frame is scanned only for the first frame, every ``full_scan_interval`` frames, and whenever a track is lost, i.e., when no face was found in the region of interest of a track.
+
+  .. note::
+     Faces that newly appear in the stream are only found in the next full scan of the frame.
+
+  **Constructor Documentation:**
+
+    Creates a face stream, which searches faces with the given ``cascade`` and ``sampler``.
+
+    **Parameters:**
+
+    ``cascade`` : str or :py:class:`Cascade` or ``None``
+      If given, the cascade file name (in HDF5 or binary format, see :py:func:`save_binary_cascade`) or the loaded cascade to be used to classify image patches.
+      If not given, the :py:func:`default_cascade` is used.
+
+    ``sampler`` : :py:class:`Sampler` or ``None``
+      The sampler that defines the sampling of bounding boxes for the full scans of the frames.
+      If not specified, the same default sampler as in :py:func:`detect_all_faces` is used.
+
+    ``threshold`` : float
+      The threshold of the quality of detected faces, see :py:func:`detect_all_faces`
+
+    ``minimum_overlap`` : float between 0 and 1
+      Detections that overlap more than the given value are pruned, see :py:func:`prune_detections`
+
+    ``full_scan_interval`` : int
+      The full frame is scanned (at least) every ``full_scan_interval`` frames
+
+    ``roi_expansion`` : float
+      The region of interest of each track is the bounding box of the previous face, scaled by this factor around its center.
+      In the region of interest, faces between the size of the region and this factor smaller than the previous face are searched.
+
+    ``num_threads`` : int or ``None``
+      If given, the scales of the frames are searched in parallel in the full scans, see :py:meth:`Sampler.iterate_cascade`
+  """
+
+  def __init__(self, cascade = None, sampler = None, threshold = 0, minimum_overlap = 0.2, full_scan_interval = 10, roi_expansion = 2., num_threads = None):
+    if cascade is None:
+      cascade = default_cascade()
+    elif isinstance(cascade, str):
+      cascade = _load_cascade(cascade)
+
+    if sampler is None:
+      sampler = Sampler(patch_size = cascade.extractor.patch_size, distance=2, scale_factor=math.pow(2.,-1./16.), lowest_scale=0.125)
+    if roi_expansion <= 1.:
+      raise ValueError("The region of interest expansion must be greater than 1")
+
+    self.cascade = cascade
+    self.sampler = sampler
+    self.threshold = threshold
+    self.minimum_overlap = minimum_overlap
+    self.full_scan_interval = full_scan_interval
+    self.roi_expansion = roi_expansion
+    self.num_threads = num_threads
+
+    # the sampler that searches the regions of interest in scales close to the previous faces
+    self.roi_sampler = Sampler(patch_size = sampler.m_patch_box.size, scale_factor = sampler.m_scale_factor, lowest_scale = 1. / (roi_expansion * roi_expansion), distance = sampler.m_distance)
+    self.reset()
+
+
+  def reset(self):
+    """Removes all tracks, so that the next frame is scanned completely."""
+    self.tracks = []
+    self.frames_since_full_scan = 0
+    self.full_scan = False
+
+
+  def _detect(self, image, sampler, roi = None, num_threads = None):
+    # detects all faces in the given image (or in the given region of interest only) using the given sampler
+    detections = []
+    predictions = []
+    for prediction, bounding_box in sampler.iterate_cascade(self.cascade, image, self.threshold, num_threads, roi = roi):
+      detections.append(bounding_box)
+      predictions.append(prediction)
+    return detections, predictions
+
+
+  def _region_of_interest(self, bounding_box):
+    # computes the expanded region of interest of the given bounding box
+    center = bounding_box.center
+    height, width = bounding_box.size_f[0] * self.roi_expansion, bounding_box.size_f[1] * self.roi_expansion
+    top, left = int(math.floor(center[0] - height / 2.)), int(math.floor(center[1] - width / 2.))
+    bottom, right = int(math.ceil(center[0] + height / 2.)), int(math.ceil(center[1] + width / 2.))
+    return BoundingBox((top, left), (bottom - top, right - left))
+
+
+  def __call__(self, frame):
+    """__call__(frame) -> bounding_boxes, qualities
+
+    Detects all faces in the given frame, and updates the :py:attr:`tracks`.
+
+    After this function returns, :py:attr:`full_scan` states whether the full frame was scanned.
+
+    **Parameters:**
+
+    ``frame`` : array_like (2D aka gray or 3D aka RGB)
+      The next frame of the stream
+
+    **Returns:**
+
+    ``bounding_boxes`` : [:py:class:`BoundingBox`]
+      The bounding boxes of the detected faces, sorted by their qualities; might be empty
+
+    ``qualities`` : array_like (1D, float)
+      The qualities of the ``bounding_boxes``
+    """
+    if len(frame.shape) == 3:
+      frame = bob.ip.color.rgb_to_gray(frame)
+
+    self.full_scan = not self.tracks or self.frames_since_full_scan + 1 >= self.full_scan_interval
+    if not self.full_scan:
+      # search each track in its region of interest only
+      detections, predictions = [], []
+      lost = False
+      for bounding_box, _ in self.tracks:
+        roi_detections, roi_predictions = self._detect(frame, self.roi_sampler, self._region_of_interest(bounding_box))
+        lost = lost or not roi_detections
+        detections.extend(roi_detections)
+        predictions.extend(roi_predictions)
+      # re-scan the full frame, when any of the tracks is lost
+      self.full_scan = lost
+
+    if self.full_scan:
+      detections, predictions = self._detect(frame, self.sampler, num_threads = self.num_threads)
+      self.frames_since_full_scan = 0
+    else:
+      self.frames_since_full_scan += 1
+
+    if not detections:
+      self.tracks = []
+      return [], numpy.zeros((0,))
+
+    # prune overlapping detections, which are the new tracks
+    bounding_boxes, qualities = prune_detections(detections, numpy.array(predictions), self.minimum_overlap)
+    self.tracks = list(zip(bounding_boxes, qualities))
+    return bounding_boxes, qualities
+
+
+def detect_stream(frames, cascade = None, sampler = None, threshold = 0, minimum_overlap = 0.2, full_scan_interval = 10, roi_expansion = 2., num_threads = None):
+  """detect_stream(frames, [cascade], [sampler], [threshold], [minimum_overlap], [full_scan_interval], [roi_expansion], [num_threads]) -> bounding_boxes, qualities
+
+  Detects all faces in the given sequence of frames, using a :py:class:`FaceStream`.
+
+  Most frames are only searched around the faces that were detected in the previous frame, which is much faster than calling :py:func:`detect_all_faces` for each frame.
+  The frames are processed lazily, so ``frames`` can be a generator, e.g., reading frames from a camera.
+
+  **Parameters:**
+
+  ``frames`` : iterable of array_like (2D aka gray or 3D aka RGB)
+    The frames to detect the faces in
+
+  ``cascade, sampler, threshold, minimum_overlap, full_scan_interval, roi_expansion, num_threads``
+    See :py:class:`FaceStream`
+
+  **Yields:**
+
+  ``bounding_boxes`` : [:py:class:`BoundingBox`]
+    The bounding boxes of the faces detected in the current frame, sorted by their qualities; might be empty
+
+  ``qualities`` : array_like (1D, float)
+    The qualities of the ``bounding_boxes``
+  """
+  stream = FaceStream(cascade, sampler, threshold, minimum_overlap, full_scan_interval, roi_expansion, num_threads)
+  for frame in frames:
+    yield stream(frame)
@@ -93,3 +93,92 @@ def test_pruning():
 
   assert len(bb) == 145
   assert len(val) == 145
+
+
+def test_bounding_box_array():
+  # tests that the vectorized geometry gives the same results as the single bounding boxes
+  boxes = bob.io.base.load(bob.io.base.test_utils.datafile("boxes.hdf5", 'bob.ip.facedetect'))[:50]
+  detections = [fd.BoundingBox(boxes[i,0:2], boxes[i,2:4]) for i in range(boxes.shape[0])]
+  array = fd.BoundingBoxArray(detections)
+  assert len(array) == len(detections)
+  assert numpy.asarray(array) is array.boxes
+  assert fd.BoundingBoxArray(numpy.asarray(array)).boxes is array.boxes
+  # the copy keyword of numpy 2 is honoured
+  copied = array.__array__(copy = True)
+  assert copied is not array.boxes and (copied == array.boxes).all()
+  assert array.__array__(array.boxes.dtype, copy = False) is array.boxes
+  assert (array.__array__(numpy.int32) == array.boxes.astype(numpy.int32)).all()
+  try:
+    array.__array__(numpy.int32, copy = False)
+    assert False, "ValueError expected"
+  except ValueError:
+    pass
+  assert all(a == d for a, d in zip(array, detections))
+
+  def check(result, expected):
+    assert all(r.topleft_f == e.topleft_f and r.size_f == e.size_f for r, e in zip(result, expected))
+
+  check(array.shift((3.5, -2)), [d.shift((3.5, -2)) for d in detections])
+  check(array.scale(0.84), [d.scale(0.84) for d in detections])
+  check(array.scale(1.5, centered=True), [d.scale(1.5, centered=True) for d in detections])
+  check(array.mirror_x(640), [d.mirror_x(640) for d in detections])
+
+  similarity = array.similarity(array)
+  assert similarity.shape == (50, 50)
+  assert all(similarity[i,j] == detections[i].similarity(detections[j]) for i in range(50) for j in range(50))
+  assert (array.similarity(detections[7]) == similarity[:,7]).all()
+
+  points = numpy.array([d.center for d in detections[:10]] + [(-100., -100.)])
+  contained = array.contains(points)
+  assert all(contained[i,j] == detections[i].contains(points[j]) for i in range(50) for j in range(11))
+
+  # pruning keeps the type of the detections
+  predictions = numpy.linspace(1., 0., 50)
+  pruned, values = fd.prune_detections(detections, predictions, 0.3)
+  pruned_array, values_array = fd.prune_detections(array, predictions, 0.3)
+  assert isinstance(pruned_array, fd.BoundingBoxArray)
+  check(pruned_array, pruned)
+  assert (values == values_array).all()
+  pruned_numpy, _ = fd.prune_detections(array.boxes, predictions, 0.3)
+  assert isinstance(pruned_numpy, numpy.ndarray)
+  assert (pruned_numpy == pruned_array.boxes).all()
+
+  overlapped, _ = fd.overlapping_detections(detections, predictions, 0.3)
+  check(fd.overlapping_detections(array, predictions, 0.3)[0], overlapped)
+
+
+def test_pruning_reference():
+  # tests that the pruning gives the same results as the exhaustive comparison of all bounding boxes
+  predictions = bob.io.base.load(bob.io.base.test_utils.datafile("detections.hdf5", 'bob.ip.facedetect'))
+  boxes = bob.io.base.load(bob.io.base.test_utils.datafile("boxes.hdf5", 'bob.ip.facedetect'))
+  detections = [fd.BoundingBox(boxes[i,0:2], boxes[i,2:4]) for i in range(boxes.shape[0])]
+  order = sorted(range(len(detections)), key=lambda i: -predictions[i])
+
+  for threshold in (-0.1, 0., 0.3, 0.8, 1.):
+    for number_of_detections in (0, 1, 10):
+      # exhaustive pruning
+      kept = []
+      for i in order:
+        if threshold >= 1. or not any(detections[k].similarity(detections[i]) > threshold for k in kept):
+          kept.append(i)
+        if threshold < 1. and number_of_detections and len(kept) == number_of_detections:
+          break
+      pruned, values = fd.prune_detections(detections, predictions, threshold, number_of_detections)
+      assert len(pruned) == len(kept)
+      assert all(pruned[j] == detections[k] for j, k in enumerate(kept))
+      assert (values == predictions[kept]).all()
+
+    # exhaustive clustering
+    clusters = []
+    for i in order:
+      for cluster in clusters:
+        if detections[i].similarity(detections[cluster[0]]) > threshold:
+          cluster.append(i)
+          break
+      else:
+        clusters.append([i])
+    totals = [sum(predictions[i] for i in c) for c in clusters]
+    best = clusters[totals.index(max(totals))] if max(totals) > 0 else []
+    overlapped, values = fd.overlapping_detections(detections, predictions, threshold)
+    assert len(overlapped) == len(best)
+    assert all(overlapped[j] == detections[k] for j, k in enumerate(best))
@@ -82,3 +82,80 @@ def test02_multiple_LBP():
         extractor.extract_indexed(bb, some, numpy.array(indices, numpy.int32))
         for i in indices:
           assert some[i] == feature[0,i]
+
+
+def test03_batch():
+  # checks that the batch extraction gives the same results as extracting the features for each bounding box
+  boxes = bob.ip.facedetect.BoundingBoxArray([bob.ip.facedetect.BoundingBox((y, x), (24, 20)) for y in (0, 10, 33) for x in (5, 17, 40)])
+  test_image = bob.ip.color.rgb_to_gray(bob.io.base.load(bob.io.base.test_utils.datafile("testimage.jpg", 'bob.ip.facedetect')))
+  indices = numpy.array([20, 53, 66], numpy.int32)
+
+  for lbp in (bob.ip.base.LBP(8, 2.), bob.ip.base.LBP(8, (3,3))):
+    for extractor in (bob.ip.facedetect.FeatureExtractor(patch_size = (24,20), extractors = [lbp]), bob.ip.facedetect.FeatureExtractor(patch_size = (24,20), template = lbp)):
+      extractor.prepare(test_image, 0.5)
+
+      features = numpy.zeros((len(boxes), extractor.number_of_features), numpy.uint16)
+      extractor.extract_all_batch(boxes.boxes, features)
+      some = numpy.zeros((len(boxes), extractor.number_of_features), numpy.uint16)
+      extractor.extract_indexed_batch(boxes.boxes, some, indices)
+
+      feature = numpy.zeros((1, extractor.number_of_features), numpy.uint16)
+      for i, bb in enumerate(boxes):
+        extractor.extract_all(bb, feature, 0)
+        assert (features[i] == feature[0]).all()
+        assert (some[i,indices] == feature[0,indices]).all()
+      # only the requested features are extracted
+      assert numpy.count_nonzero(numpy.delete(some, indices, axis=1)) == 0
+
+      # the dataset must have one row for each bounding box
+      try:
+        extractor.extract_all_batch(boxes.boxes, features[:-1])
+        assert False, "RuntimeError was not raised"
+      except RuntimeError:
+        pass
+
+
+def test04_mean_variance():
+  # checks that the mean and the variance are computed over all pixels of the bounding box
+  test_image = bob.ip.color.rgb_to_gray(bob.io.base.load(bob.io.base.test_utils.datafile("testimage.jpg", 'bob.ip.facedetect')))
+  extractor = bob.ip.facedetect.FeatureExtractor(patch_size = (24,20), extractors = [bob.ip.base.LBP(8)])
+
+  for scale in (1., 0.5):
+    extractor.prepare(test_image, scale, True)
+    image = extractor.image
+    for top, left, height, width in ((0, 0, 24, 20), (10, 17, 24, 20), (33, 5, 7, 13), (image.shape[0] - 24, image.shape[1] - 20, 24, 20)):
+      bb = bob.ip.facedetect.BoundingBox((top, left), (height, width))
+      patch = image[top:top+height, left:left+width]
+      assert numpy.allclose(extractor.mean_variance(bb, True), (numpy.mean(patch), numpy.var(patch, ddof=1)))
+      assert numpy.allclose(extractor.mean_variance(bb), numpy.mean(patch))
+
+
+def test05_pyramid_integral_images():
+  # checks that the integral images of a previously prepared pyramid are not used
+  test_image = bob.ip.color.rgb_to_gray(bob.io.base.load(bob.io.base.test_utils.datafile("testimage.jpg", 'bob.ip.facedetect')))
+  extractor = bob.ip.facedetect.FeatureExtractor(patch_size = (24,20), extractors = [bob.ip.base.LBP(8)])
+  bb = bob.ip.facedetect.BoundingBox((10, 17), (24, 20))
+
+  pyramid = bob.ip.facedetect.ImagePyramid(test_image, numpy.array([1., 0.5]), True, True)
+  extractor.prepare(pyramid, 1, True)
+  patch = extractor.image[10:34, 17:37]
+  assert numpy.allclose(extractor.mean_variance(bb, True), (numpy.mean(patch), numpy.var(patch, ddof=1)))
+
+  # a pyramid without integral images
+  pyramid = bob.ip.facedetect.ImagePyramid(test_image, numpy.array([1., 0.5]))
+  extractor.prepare(pyramid, 1)
+  for compute_variance in (False, True):
+    try:
+      extractor.mean_variance(bb, compute_variance)
+      assert False, "RuntimeError was not raised"
+    except RuntimeError:
+      pass
+
+  # the same holds for images that are prepared without integral images
+  extractor.prepare(test_image, 0.5, True)
+  extractor.prepare(test_image, 0.5)
+  try:
+    extractor.mean_variance(bb)
+    assert False, "RuntimeError was not raised"
+  except RuntimeError:
+    pass
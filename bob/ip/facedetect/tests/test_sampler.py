@@ -1,5 +1,6 @@
 import unittest
 import math
+import os
 from nose.plugins.skip import SkipTest
 
 import numpy
@@ -86,3 +87,657 @@ def test_cascade():
   reference_file = bob.io.base.test_utils.datafile("boxes.hdf5", 'bob.ip.facedetect')
   reference = bob.io.base.load(reference_file)
   assert numpy.count_nonzero(boxes != reference) == 0
+
+
+def test_evaluate_scale():
+  # test that the native evaluation of a whole scale gives the same results as evaluating each patch
+  test_image = bob.ip.color.rgb_to_gray(bob.io.base.load(bob.io.base.test_utils.datafile("testimage.jpg", 'bob.ip.facedetect')))
+
+  cascade = fd.default_cascade()
+  assert cascade.has_native_evaluation()
+  sampler = fd.detector.Sampler(distance=2, scale_factor=math.pow(2.,-1./4.), lowest_scale=0.125)
+
+  scale, shape = list(sampler.scales(test_image))[2]
+  tops, lefts, predictions = cascade.evaluate_scale(test_image, scale, 2)
+
+  cascade.prepare(test_image, scale)
+  boxes = list(sampler.sample_scaled(shape))
+  assert len(boxes) == len(predictions)
+  for i, bb in enumerate(boxes):
+    assert bb.topleft == (tops[i], lefts[i])
+    assert abs(cascade(bb) - predictions[i]) < 1e-8
+
+  # check that thresholding works
+  tops, lefts, thresholded = cascade.evaluate_scale(test_image, scale, 2, threshold=0)
+  assert len(thresholded) == numpy.count_nonzero(predictions > 0)
+  assert (thresholded > 0).all()
+
+
+def test_sample_array():
+  # test that the array sampling generates the same bounding boxes as the iterator
+  test_image = bob.ip.color.rgb_to_gray(bob.io.base.load(bob.io.base.test_utils.datafile("testimage.jpg", 'bob.ip.facedetect')))
+  sampler = fd.detector.Sampler(distance=2, scale_factor=math.pow(2.,-1./4.), lowest_scale=0.125)
+
+  windows = sampler.sample_array(test_image)
+  boxes = list(sampler.sample(test_image))
+  assert windows.shape == (14493, 5)
+  assert len(boxes) == windows.shape[0]
+  for i in (0, 1, 1000, len(boxes)-1):
+    assert numpy.allclose(windows[i,1:3], boxes[i].topleft_f)
+    assert numpy.allclose(windows[i,3:5], boxes[i].size_f)
+
+  # check the positions of a single scale
+  scale, shape = next(sampler.scales(test_image))
+  positions = sampler.sample_scaled_array(shape)
+  assert positions.dtype == numpy.int32
+  assert [tuple(p) for p in positions] == [bb.topleft for bb in sampler.sample_scaled(shape)]
+  assert (windows[:len(positions),0] == scale).all()
+
+
+def test_image_pyramid():
+  # test that the image pyramid contains the same scales as the sampler
+  test_image = bob.ip.color.rgb_to_gray(bob.io.base.load(bob.io.base.test_utils.datafile("testimage.jpg", 'bob.ip.facedetect')))
+  sampler = fd.detector.Sampler(distance=2, scale_factor=math.pow(2.,-1./4.), lowest_scale=0.125)
+
+  pyramid = sampler.image_pyramid(test_image, compute_integral_image=True)
+  scales = list(sampler.scales(test_image))
+  assert pyramid.number_of_levels == len(scales)
+  for level, (scale, shape) in enumerate(scales):
+    assert abs(pyramid.scales[level] - scale) < 1e-8
+    assert pyramid.shape(level) == tuple(shape)
+    assert pyramid.image(level).shape == tuple(shape)
+    assert pyramid.integral_image(level).shape == (shape[0]+1, shape[1]+1)
+
+  # the largest level is scaled directly from the original image
+  cascade = fd.default_cascade()
+  level = pyramid.number_of_levels - 1
+  cascade.prepare(test_image, scales[level][0])
+  reference = cascade.extractor.image.copy()
+  cascade.prepare(pyramid, level)
+  assert numpy.allclose(cascade.extractor.image, reference)
+
+  # the sampled bounding boxes are identical, and the predictions are similar
+  detections = list(sampler.iterate_cascade(cascade, pyramid))
+  reference = list(sampler.iterate_cascade(cascade, test_image))
+  assert len(detections) == len(reference)
+  assert all(bb1 == bb2 for (_, bb1), (_, bb2) in zip(detections, reference))
+  assert numpy.corrcoef([p for p, _ in detections], [p for p, _ in reference])[0,1] > 0.9
+
+
+def test_threads():
+  # test that the multi-threaded evaluation gives the same results as the sequential one
+  test_image = bob.ip.color.rgb_to_gray(bob.io.base.load(bob.io.base.test_utils.datafile("testimage.jpg", 'bob.ip.facedetect')))
+  cascade = fd.default_cascade()
+  sampler = fd.detector.Sampler(distance=2, scale_factor=math.pow(2.,-1./4.), lowest_scale=0.125)
+
+  reference = list(sampler.iterate_cascade(cascade, test_image, 0))
+  for num_threads in (1, 2, 5):
+    detections = list(sampler.iterate_cascade(cascade, test_image, 0, num_threads))
+    assert len(detections) == len(reference)
+    for (p1, bb1), (p2, bb2) in zip(detections, reference):
+      assert abs(p1 - p2) < 1e-8
+      assert bb1 == bb2
+
+  # several threads evaluate the bands of a single scale
+  scale = list(sampler.scales(test_image))[0][0]
+  tops, lefts, predictions = cascade.evaluate_scale(test_image, scale, 2)
+  for num_threads in (2, 4):
+    levels, threaded_tops, threaded_lefts, threaded_predictions = cascade.evaluate_scales(test_image, [scale], 2, num_threads=num_threads)
+    assert (levels == 0).all()
+    assert (threaded_tops == tops).all()
+    assert (threaded_lefts == lefts).all()
+    assert numpy.allclose(threaded_predictions, predictions)
+
+  bbs, qualities = fd.detect_all_faces(test_image, cascade, num_threads=4)
+  reference_bbs, reference_qualities = fd.detect_all_faces(test_image, cascade)
+  assert len(bbs) == len(reference_bbs)
+  assert numpy.allclose(qualities, reference_qualities)
+
+
+def test_batch():
+  # test that the batch detection gives the same results as the single image detection
+  image_file = bob.io.base.test_utils.datafile("testimage.jpg", 'bob.ip.facedetect')
+  test_image = bob.io.base.load(image_file)
+  reference = fd.detect_single_face(test_image)
+
+  for processes in (1, 2):
+    results = list(fd.detect_faces_batch([image_file, test_image, image_file], processes=processes))
+    assert len(results) == 3
+    for bounding_box, quality, seconds in results:
+      assert bounding_box.topleft_f == reference[0].topleft_f
+      assert bounding_box.size_f == reference[0].size_f
+      assert abs(quality - reference[1]) < 1e-8
+      assert seconds > 0
+
+  # detect all faces with a given cascade and sampler
+  cascade = fd.default_cascade()
+  sampler = fd.detector.Sampler(distance=2, scale_factor=math.pow(2.,-1./4.), lowest_scale=0.125)
+  reference = fd.detect_all_faces(test_image, cascade, sampler, threshold=20)
+  results = list(fd.detect_faces_batch([image_file], cascade, sampler, threshold=20, processes=2))
+  assert len(results) == 1
+  bounding_boxes, qualities, _ = results[0]
+  assert len(bounding_boxes) == len(reference[0])
+  assert all(bb1 == bb2 for bb1, bb2 in zip(bounding_boxes, reference[0]))
+  assert numpy.allclose(qualities, reference[1])
+
+
+def test_dense_codes():
+  # test that the dense LBP code images result in the same features and predictions
+  test_image = bob.ip.color.rgb_to_gray(bob.io.base.load(bob.io.base.test_utils.datafile("testimage.jpg", 'bob.ip.facedetect')))
+  cascade = fd.default_cascade(cached = False)
+  sampler = fd.detector.Sampler(distance=2, scale_factor=math.pow(2.,-1./4.), lowest_scale=0.125)
+  scale, shape = list(sampler.scales(test_image))[2]
+
+  assert not cascade.extractor.dense_codes
+  reference = cascade.evaluate_scale(test_image, scale, 2)
+  cascade.prepare(test_image, scale)
+  boxes = list(sampler.sample_scaled(shape))[::50]
+  reference_features = []
+  for bb in boxes:
+    cascade.extractor.extract_indexed(bb, cascade.feature, cascade.extractor.model_indices)
+    reference_features.append(cascade.feature[cascade.extractor.model_indices].copy())
+
+  cascade.extractor.dense_codes = True
+  assert cascade.extractor.dense_codes
+  results = cascade.evaluate_scale(test_image, scale, 2)
+  for r1, r2 in zip(results, reference):
+    assert numpy.allclose(r1, r2)
+  for bb, reference_feature in zip(boxes, reference_features):
+    cascade.extractor.extract_indexed(bb, cascade.feature, cascade.extractor.model_indices)
+    assert (cascade.feature[cascade.extractor.model_indices] == reference_feature).all()
+
+
+def test_compiled_cascade():
+  # test that the compiled cascade gives the same results as the original cascade
+  test_image = bob.ip.color.rgb_to_gray(bob.io.base.load(bob.io.base.test_utils.datafile("testimage.jpg", 'bob.ip.facedetect')))
+  cascade = fd.default_cascade()
+  compiled = cascade.compile()
+  assert isinstance(compiled, fd.CompiledCascade)
+  assert compiled.extractor is cascade.extractor
+  assert len(compiled.thresholds) == len(cascade.thresholds)
+  assert compiled.stage_ends[-1] == len(compiled.feature_indices) == len(compiled.weights) == len(compiled.look_up_tables)
+  for i in (0, len(compiled.feature_indices)-1):
+    assert tuple(compiled.offsets[i]) == cascade.extractor.offset(int(compiled.feature_indices[i]))
+
+  sampler = fd.detector.Sampler(distance=2, scale_factor=math.pow(2.,-1./4.), lowest_scale=0.125)
+  scale, shape = list(sampler.scales(test_image))[2]
+  cascade.prepare(test_image, scale)
+  for bb in list(sampler.sample_scaled(shape))[::100]:
+    assert abs(compiled(bb) - cascade(bb)) < 1e-8
+
+  # write and read the compiled cascade
+  temp_file = bob.io.base.test_utils.temporary_filename()
+  compiled.save(bob.io.base.HDF5File(temp_file, 'w'))
+  loaded = fd.CompiledCascade(bob.io.base.HDF5File(temp_file))
+  os.remove(temp_file)
+  assert (loaded.feature_indices == compiled.feature_indices).all()
+  assert numpy.allclose(loaded.look_up_tables, compiled.look_up_tables)
+  reference = list(sampler.iterate_cascade(cascade, test_image, 0))
+  detections = list(sampler.iterate_cascade(loaded, test_image, 0))
+  assert len(detections) == len(reference)
+  for (p1, bb1), (p2, bb2) in zip(detections, reference):
+    assert abs(p1 - p2) < 1e-8
+    assert bb1 == bb2
+
+  # modified thresholds are used by the native evaluation as well
+  cascade = fd.Cascade(bob.io.base.HDF5File(pkg_resources.resource_filename("bob.ip.facedetect", "MCT_cascade.hdf5")))
+  for thresholds in (numpy.array(cascade.thresholds) + 1., [float('inf')] * len(cascade.thresholds)):
+    cascade.evaluate_scale(test_image, scale, 2)
+    if isinstance(thresholds, list):
+      # modify the thresholds in place
+      for i, threshold in enumerate(thresholds):
+        cascade.thresholds[i] = threshold
+    else:
+      cascade.thresholds = thresholds
+    tops, lefts, predictions = cascade.evaluate_scale(test_image, scale, 2)
+    cascade.prepare(test_image, scale)
+    boxes = list(sampler.sample_scaled(shape))
+    for i in range(0, len(boxes), 100):
+      assert abs(cascade(boxes[i]) - predictions[i]) < 1e-8
+
+  # the extractor given to the cascades is not modified
+  extractor = fd.FeatureExtractor(cascade.extractor)
+  extractor.model_indices = numpy.array([0], numpy.int32)
+  created = fd.Cascade(feature_extractor = extractor)
+  created.add(cascade.cascade[0], cascade.thresholds[0])
+  assert created.extractor is not extractor
+  assert len(created.extractor.model_indices) > 1
+  recompiled = fd.CompiledCascade(extractor = extractor, feature_indices = compiled.feature_indices, look_up_tables = compiled.look_up_tables, weights = compiled.weights, stage_ends = compiled.stage_ends, thresholds = compiled.thresholds)
+  assert recompiled.extractor is not extractor
+  assert (extractor.model_indices == [0]).all()
+
+
+def test_statistics():
+  # test that the statistics are collected equally for the native and the python evaluation
+  test_image = bob.ip.color.rgb_to_gray(bob.io.base.load(bob.io.base.test_utils.datafile("testimage.jpg", 'bob.ip.facedetect')))
+  cascade = fd.default_cascade()
+  sampler = fd.detector.Sampler(distance=2, scale_factor=math.pow(2.,-1./4.), lowest_scale=0.125)
+
+  statistics = cascade.new_statistics()
+  detections = list(sampler.iterate_cascade(cascade, test_image, statistics=statistics))
+  arrays = statistics.arrays()
+  scales = [scale for scale, _ in sampler.scales(test_image)]
+  assert len(statistics) == len(scales)
+  assert numpy.allclose(arrays['scales'], scales)
+  assert arrays['windows'].sum() == len(detections) == 14493
+  assert arrays['stage_counts'].shape == (len(scales), len(cascade.thresholds))
+  # the number of windows can only decrease from stage to stage
+  assert (numpy.diff(arrays['stage_counts'], axis=1) <= 0).all()
+  assert (arrays['rejections'] >= 0).all()
+  assert (arrays['features_per_window'] >= len(cascade.cascade[0].weak_machines)).all()
+  assert (arrays['prepare_times'] >= 0).all() and (arrays['classification_times'] >= 0).all()
+
+  # the per-window evaluation counts the same stages
+  scale, shape = list(sampler.scales(test_image))[2]
+  cascade.prepare(test_image, scale)
+  counts = statistics.new_counts()
+  for bb in sampler.sample_scaled(shape):
+    cascade(bb, counts)
+  assert (counts == arrays['stage_counts'][2]).all()
+
+  summary = statistics.summary()
+  assert summary['windows'] == 14493
+  assert summary['stage_rates'][0] == 1.
+
+
+def test_coarse_to_fine():
+  # test that the coarse-to-fine scan finds a subset of the detections of the full scan
+  test_image = bob.ip.color.rgb_to_gray(bob.io.base.load(bob.io.base.test_utils.datafile("testimage.jpg", 'bob.ip.facedetect')))
+  cascade = fd.default_cascade()
+  sampler = fd.detector.Sampler(distance=2, scale_factor=math.pow(2.,-1./4.), lowest_scale=0.125)
+  reference = dict(((bb.topleft_f, bb.size_f), p) for p, bb in sampler.iterate_cascade(cascade, test_image, 0))
+
+  coarse_sampler = fd.detector.Sampler(distance=2, scale_factor=math.pow(2.,-1./4.), lowest_scale=0.125, coarse_distance=6)
+  detections = list(coarse_sampler.iterate_cascade(cascade, test_image, 0))
+  assert 0 < len(detections) <= len(reference)
+  for prediction, bb in detections:
+    assert abs(reference[(bb.topleft_f, bb.size_f)] - prediction) < 1e-8
+
+  # the best detection is still found
+  assert max(p for p, _ in detections) == max(reference.values())
+
+  # far fewer patches are classified
+  full, coarse = cascade.new_statistics(), cascade.new_statistics()
+  list(sampler.iterate_cascade(cascade, test_image, 0, statistics=full))
+  list(coarse_sampler.iterate_cascade(cascade, test_image, 0, statistics=coarse))
+  assert coarse.summary()['windows'] < full.summary()['windows']
+
+  # with a huge margin, all patches are classified, and the results are identical
+  all_sampler = fd.detector.Sampler(distance=2, scale_factor=math.pow(2.,-1./4.), lowest_scale=0.125, coarse_distance=6, coarse_margin=1e10)
+  detections = list(all_sampler.iterate_cascade(cascade, test_image, 0))
+  assert len(detections) == len(reference)
+
+
+def test_minimum_variance():
+  # test that the variance pre-filter rejects only flat patches
+  test_image = bob.ip.color.rgb_to_gray(bob.io.base.load(bob.io.base.test_utils.datafile("testimage.jpg", 'bob.ip.facedetect')))
+  cascade = fd.default_cascade()
+  sampler = fd.detector.Sampler(distance=2, scale_factor=math.pow(2.,-1./4.), lowest_scale=0.125)
+  reference = dict(((bb.topleft_f, bb.size_f), p) for p, bb in sampler.iterate_cascade(cascade, test_image))
+
+  variance_sampler = fd.detector.Sampler(distance=2, scale_factor=math.pow(2.,-1./4.), lowest_scale=0.125, minimum_variance=100.)
+  statistics = cascade.new_statistics()
+  detections = list(variance_sampler.iterate_cascade(cascade, test_image, statistics=statistics))
+  assert 0 < len(detections) < len(reference)
+  for prediction, bb in detections:
+    assert abs(reference[(bb.topleft_f, bb.size_f)] - prediction) < 1e-8
+  # the face is not flat
+  assert max(p for p, _ in detections) == max(reference.values())
+
+  # all windows are counted, either as rejected or as classified
+  summary = statistics.summary()
+  assert summary['windows'] == len(reference)
+  assert summary['variance_rejections'] == len(reference) - len(detections)
+  assert summary['stage_counts'][0] == len(detections)
+
+  # the rejected windows are exactly the ones with a lower variance
+  scale, shape = list(sampler.scales(test_image))[2]
+  cascade.prepare(test_image, scale, True)
+  flat = sum(cascade.extractor.mean_variance(bb, True)[1] < 100. for bb in sampler.sample_scaled(shape))
+  assert flat == statistics.arrays()['variance_rejections'][2]
+
+  # the parallel evaluation rejects the same windows
+  parallel = list(variance_sampler.iterate_cascade(cascade, test_image, num_threads=2))
+  assert len(parallel) == len(detections)
+
+  # in a constant image, all windows are rejected
+  statistics = cascade.new_statistics()
+  assert not list(variance_sampler.iterate_cascade(cascade, numpy.full(test_image.shape, 128, numpy.uint8), statistics=statistics))
+  assert statistics.summary()['variance_rejections'] == statistics.summary()['windows'] > 0
+
+  # image pyramids need to contain the integral square images
+  pyramid = variance_sampler.image_pyramid(test_image, compute_integral_square_image=True)
+  assert len(list(variance_sampler.iterate_cascade(cascade, pyramid))) > 0
+  try:
+    list(variance_sampler.iterate_cascade(cascade, variance_sampler.image_pyramid(test_image)))
+    assert False, "The variance pre-filter requires integral square images"
+  except RuntimeError:
+    pass
+
+
+def test_tiled_detection():
+  # test that large images can be searched tile by tile
+  color_image = bob.io.base.load(bob.io.base.test_utils.datafile("testimage.jpg", 'bob.ip.facedetect'))
+  test_image = bob.ip.color.rgb_to_gray(color_image)
+  cascade = fd.default_cascade()
+  sampler = fd.detector.Sampler(distance=2, scale_factor=math.pow(2.,-1./4.), lowest_scale=0.125, maximum_size=300)
+
+  # the tiles lie inside the image, and their cores partition the image
+  tiles = list(sampler.tiles(test_image.shape, (400, 300)))
+  assert len(tiles) == 9
+  for tile, core in tiles:
+    assert tile.top >= 0 and tile.left >= 0 and tile.bottom <= test_image.shape[0] and tile.right <= test_image.shape[1]
+    assert tile.contains(core.topleft_f) and tile.contains(core.center)
+  assert abs(sum(core.area for _, core in tiles) - test_image.size) < 1e-6
+
+  # the same face is found as in the whole image
+  reference = list(sampler.iterate_cascade(cascade, test_image))
+  detections = list(sampler.iterate_cascade_tiled(cascade, test_image, (400, 300)))
+  assert 0 < len(detections)
+  best = fd.best_detection([bb for _, bb in reference], [p for p, _ in reference])[0]
+  tiled = fd.best_detection([bb for _, bb in detections], [p for p, _ in detections])[0]
+  assert best.similarity(tiled) > 0.7
+
+  # memory-mapped and color images are read tile by tile, with identical results
+  temp_file = bob.io.base.test_utils.temporary_filename(suffix=".npy")
+  try:
+    numpy.save(temp_file, test_image)
+    mapped = list(sampler.iterate_cascade_tiled(cascade, numpy.load(temp_file, mmap_mode='r'), (400, 300)))
+  finally:
+    os.remove(temp_file)
+  assert [(p, bb.topleft_f, bb.size_f) for p, bb in mapped] == [(p, bb.topleft_f, bb.size_f) for p, bb in detections]
+  colored = list(sampler.iterate_cascade_tiled(cascade, color_image, (400, 300)))
+  assert [(p, bb.topleft_f, bb.size_f) for p, bb in colored] == [(p, bb.topleft_f, bb.size_f) for p, bb in detections]
+
+  # the tiled detection needs to know the largest face
+  faces = fd.detect_all_faces(color_image, cascade, threshold=0, maximum_size=300, tile_size=(400, 300))
+  assert faces is not None and len(faces[0]) > 0
+  try:
+    fd.detect_all_faces(test_image, cascade, tile_size=400)
+    assert False, "Tiled detection requires a maximum size"
+  except ValueError:
+    pass
+
+
+def test_stream():
+  # test that the faces are tracked through a sequence of frames
+  test_image = bob.io.base.load(bob.io.base.test_utils.datafile("testimage.jpg", 'bob.ip.facedetect'))
+  reference_bbs, reference_qualities = fd.detect_all_faces(test_image, threshold=20)
+
+  stream = fd.FaceStream(threshold=20, full_scan_interval=3)
+  full_scans = []
+  for frame in range(5):
+    bbs, qualities = stream(test_image)
+    full_scans.append(stream.full_scan)
+    assert len(bbs) == len(qualities) == len(stream.tracks)
+    # the best face is found in each frame
+    assert bbs[0].similarity(reference_bbs[0]) > 0.7
+  # the first frame is scanned completely, but not all other frames
+  assert full_scans[0] and not all(full_scans)
+
+  # the first frame is scanned completely, so the results are identical to detect_all_faces
+  results = list(fd.detect_stream([test_image, test_image], threshold=20))
+  assert len(results) == 2
+  assert len(results[0][0]) == len(reference_bbs)
+  assert numpy.allclose(results[0][1], reference_qualities)
+
+  # a frame without faces
+  bbs, qualities = stream(numpy.zeros((100, 100), numpy.uint8))
+  assert bbs == [] and len(qualities) == 0
+  assert stream.tracks == []
+
+
+def test_roi():
+  # test that the search can be limited to a region of interest and to a range of face sizes
+  test_image = bob.ip.color.rgb_to_gray(bob.io.base.load(bob.io.base.test_utils.datafile("testimage.jpg", 'bob.ip.facedetect')))
+  sampler = fd.detector.Sampler(distance=2, scale_factor=math.pow(2.,-1./4.), lowest_scale=0.125)
+  limited = fd.detector.Sampler(distance=2, scale_factor=math.pow(2.,-1./4.), lowest_scale=0.125, minimum_size=50, maximum_size=200)
+  scales = [scale for scale, _ in sampler.scales(test_image)]
+  limited_scales = [scale for scale, _ in limited.scales(test_image)]
+  assert 0 < len(limited_scales) < len(scales)
+  assert all(scale in scales for scale in limited_scales)
+  for bb in limited.sample(test_image):
+    assert 50 - 1e-8 <= bb.size_f[0] <= 200 + 1e-8
+
+  # re-detect the best face in a region of interest around it
+  reference, quality = fd.detect_single_face(test_image)
+  roi = fd.BoundingBox((reference.top - reference.size[0] // 4, reference.left - reference.size[1] // 4), (reference.size[0] * 3 // 2, reference.size[1] * 3 // 2))
+  bb, q = fd.detect_single_face(test_image, roi=roi, minimum_size=reference.size[0] // 2, maximum_size=reference.size[0] * 2)
+  assert bb.similarity(reference) > 0.7
+
+  cascade = fd.default_cascade()
+  for prediction, bb in sampler.iterate_cascade(cascade, test_image, 0, roi=roi):
+    assert bb.top_f >= roi.top and bb.left_f >= roi.left
+    assert bb.bottom_f <= roi.bottom + 1 and bb.right_f <= roi.right + 1
+
+  # an empty region of interest yields nothing
+  assert fd.detect_all_faces(test_image, roi=fd.BoundingBox((-100, -100), (50, 50))) is None
+
+
+def test_contexts():
+  # test that several contexts of one cascade can be used in parallel threads
+  import threading
+  test_image = bob.ip.color.rgb_to_gray(bob.io.base.load(bob.io.base.test_utils.datafile("testimage.jpg", 'bob.ip.facedetect')))
+  cascade = fd.default_cascade()
+  sampler = fd.detector.Sampler(distance=2, scale_factor=math.pow(2.,-1./4.), lowest_scale=0.125)
+  reference = list(sampler.iterate_cascade(cascade, test_image, 0))
+
+  contexts = [cascade.new_context() for i in range(4)]
+  for context in contexts:
+    # the classifiers are shared, but not the lists of classifiers and the extractors
+    assert context.cascade is not cascade.cascade
+    assert all(c is r for c, r in zip(context.cascade, cascade.cascade))
+    assert context.extractor is not cascade.extractor
+    assert context.feature is not cascade.feature
+    assert context.compile().look_up_tables is cascade.compile().look_up_tables
+    assert context.compile().extractor is context.extractor
+    assert (context.extractor.model_indices == cascade.extractor.model_indices).all()
+
+  results = [None] * len(contexts)
+  def detect(i):
+    results[i] = list(sampler.iterate_cascade(contexts[i], test_image, 0))
+  threads = [threading.Thread(target=detect, args=(i,)) for i in range(len(contexts))]
+  for thread in threads: thread.start()
+  for thread in threads: thread.join()
+
+  for detections in results:
+    assert len(detections) == len(reference)
+    for (p1, bb1), (p2, bb2) in zip(detections, reference):
+      assert abs(p1 - p2) < 1e-8
+      assert bb1 == bb2
+
+  # compiled cascades have contexts, too
+  compiled = cascade.compile().new_context()
+  assert compiled.extractor is not cascade.extractor
+  detections = list(sampler.iterate_cascade(compiled, test_image, 0))
+  assert len(detections) == len(reference)
+
+  # a single cascade used by several threads either gives correct results, or refuses to prepare an image while it is evaluated
+  scale = list(sampler.scales(test_image))[2][0]
+  expected = cascade.evaluate_scale(test_image, scale, 2)
+  errors, results = [], []
+  def evaluate():
+    for i in range(10):
+      try:
+        results.append(cascade.evaluate_scale(test_image, scale, 2))
+      except RuntimeError as e:
+        errors.append(e)
+  threads = [threading.Thread(target=evaluate) for i in range(4)]
+  for thread in threads: thread.start()
+  for thread in threads: thread.join()
+  assert len(errors) + len(results) == 40
+  for e in errors:
+    assert "another thread" in str(e)
+  for result in results:
+    for r, e in zip(result, expected):
+      assert numpy.allclose(r, e)
+
+
+def test_single_precision():
+  # test that the single precision images result in (almost) the same features and predictions
+  test_image = bob.ip.color.rgb_to_gray(bob.io.base.load(bob.io.base.test_utils.datafile("testimage.jpg", 'bob.ip.facedetect')))
+  cascade = fd.default_cascade()
+  sampler = fd.detector.Sampler(distance=2, scale_factor=math.pow(2.,-1./4.), lowest_scale=0.125)
+  reference = list(sampler.iterate_cascade(cascade, test_image, 0))
+
+  context = cascade.new_context()
+  assert not context.extractor.single_precision
+  context.extractor.single_precision = True
+  assert context.extractor.single_precision
+  # the setting is copied to new contexts
+  assert context.new_context().extractor.single_precision
+
+  for scale in (1., 0.5):
+    context.prepare(test_image, scale)
+    assert context.extractor.image.dtype == numpy.float32
+    cascade.prepare(test_image, scale)
+    assert numpy.allclose(context.extractor.image, cascade.extractor.image, atol=1e-4)
+
+  detections = list(sampler.iterate_cascade(context, test_image, 0))
+  assert abs(len(detections) - len(reference)) <= len(reference) // 100
+  reference = dict(((bb.topleft_f, bb.size_f), p) for p, bb in reference)
+  same = [abs(reference[(bb.topleft_f, bb.size_f)] - p) < 1e-8 for p, bb in detections if (bb.topleft_f, bb.size_f) in reference]
+  assert sum(same) >= 0.99 * len(detections)
+
+  # dense codes are computed from the single precision image as well
+  context.extractor.dense_codes = True
+  dense = list(sampler.iterate_cascade(context, test_image, 0))
+  assert len(dense) == len(detections)
+  assert all(abs(p1 - p2) < 1e-8 for (p1, _), (p2, _) in zip(dense, detections))
+
+
+def test_default_cascade():
+  # test that the default cascade is loaded only once, but each call returns a new context
+  import threading
+  cascade = fd.default_cascade()
+  other = fd.default_cascade()
+  assert other is not cascade
+  assert other.cascade[0] is cascade.cascade[0]
+  assert other.extractor is not cascade.extractor
+
+  contexts = []
+  thread = threading.Thread(target=lambda: contexts.append(fd.default_cascade()))
+  thread.start()
+  thread.join()
+  assert contexts[0] is not cascade
+  assert contexts[0].cascade[0] is cascade.cascade[0]
+  assert contexts[0].extractor is not cascade.extractor
+
+  # modifying the returned cascade does not modify the cached cascade
+  other.cascade.append(other.cascade[0])
+  other.thresholds[0] = float('inf')
+  assert len(fd.default_cascade().cascade) == len(cascade.cascade)
+  assert fd.default_cascade().thresholds[0] == cascade.thresholds[0]
+
+  # an independent copy of the default cascade can be loaded
+  loaded = fd.default_cascade(cached = False)
+  assert loaded.cascade is not cascade.cascade
+  assert len(loaded.cascade) == len(cascade.cascade)
+
+  # the default sampler is shared as well
+  test_image = bob.ip.color.rgb_to_gray(bob.io.base.load(bob.io.base.test_utils.datafile("testimage.jpg", 'bob.ip.facedetect')))
+  assert fd.detect._sampler(cascade, None, None, None) is fd.detect._sampler(cascade, None, None, None)
+  assert fd.detect._sampler(cascade, None, 50, None) is not fd.detect._sampler(cascade, None, 50, None)
+  bb, quality = fd.detect_single_face(test_image)
+  reference = fd.detect_single_face(test_image, cascade = loaded)
+  assert bb == reference[0]
+  assert abs(quality - reference[1]) < 1e-8
+
+
+def test_lazy_import():
+  # test that importing the package for face detection does not import the training utilities
+  import subprocess, sys
+  code = "import sys, bob.ip.facedetect; assert 'bob.learn.boosting' not in sys.modules and 'bob.ip.facedetect.train' not in sys.modules; bob.ip.facedetect.TrainingSet; assert 'bob.ip.facedetect.train' in sys.modules"
+  subprocess.check_call([sys.executable, "-c", code])
+
+
+def test_binary_cascade():
+  # test that the binary cascade format can be memory-mapped and round-trips with the HDF5 format
+  test_image = bob.ip.color.rgb_to_gray(bob.io.base.load(bob.io.base.test_utils.datafile("testimage.jpg", 'bob.ip.facedetect')))
+  cascade = fd.default_cascade(cached = False)
+  sampler = fd.detector.Sampler(distance=2, scale_factor=math.pow(2.,-1./4.), lowest_scale=0.125)
+  reference = list(sampler.iterate_cascade(cascade, test_image, 0))
+
+  binary_file = bob.io.base.test_utils.temporary_filename(suffix = ".bin")
+  hdf5_file = bob.io.base.test_utils.temporary_filename(suffix = ".hdf5")
+  try:
+    fd.save_binary_cascade(cascade, binary_file)
+
+    # the compiled cascade is memory-mapped
+    for mmap_mode in ('c', None):
+      loaded = fd.load_binary_cascade(binary_file, mmap_mode = mmap_mode)
+      assert isinstance(loaded, fd.CompiledCascade)
+      assert isinstance(loaded.look_up_tables, numpy.memmap) == (mmap_mode is not None)
+      compiled = cascade.compile()
+      assert (loaded.feature_indices == compiled.feature_indices).all()
+      assert (loaded.look_up_tables == compiled.look_up_tables).all()
+      assert (loaded.tables()[1] == compiled.tables()[1]).all()
+      assert (loaded.offsets == compiled.offsets).all()
+      assert loaded.extractor.number_of_features == cascade.extractor.number_of_features
+      assert (loaded.extractor.model_indices == cascade.extractor.model_indices).all()
+      detections = list(sampler.iterate_cascade(loaded, test_image, 0))
+      assert len(detections) == len(reference)
+      for (p1, bb1), (p2, bb2) in zip(detections, reference):
+        assert abs(p1 - p2) < 1e-8
+        assert bb1 == bb2
+
+    # the cascade of boosted machines can be re-created and written to HDF5
+    restored = fd.load_binary_cascade(binary_file, compiled = False)
+    assert isinstance(restored, fd.Cascade)
+    restored.save(bob.io.base.HDF5File(hdf5_file, 'w'))
+    restored = fd.Cascade(bob.io.base.HDF5File(hdf5_file))
+    assert len(restored.cascade) == len(cascade.cascade)
+    assert numpy.allclose(restored.thresholds, cascade.thresholds)
+    for m1, m2 in zip(restored.cascade, cascade.cascade):
+      assert (m1.weights == m2.weights).all()
+      assert all((w1.lut == w2.lut).all() and (w1.indices == w2.indices).all() for w1, w2 in zip(m1.weak_machines, m2.weak_machines))
+    if cascade.extractor.selected_offsets is not None:
+      assert (restored.extractor.selected_offsets == cascade.extractor.selected_offsets).all()
+
+    # files of other formats are rejected
+    try:
+      fd.load_binary_cascade(hdf5_file)
+      assert False, "loading an HDF5 file as binary cascade should fail"
+    except ValueError:
+      pass
+  finally:
+    for filename in (binary_file, hdf5_file):
+      if os.path.exists(filename):
+        os.remove(filename)
+
+
+def test_binary_mb_lbp_cascade():
+  # test that cascades with multi-block LBP extractors round-trip through the binary format as well
+  import bob.learn.boosting
+  test_image = bob.ip.color.rgb_to_gray(bob.io.base.load(bob.io.base.test_utils.datafile("testimage.jpg", 'bob.ip.facedetect')))
+  extractor = fd.FeatureExtractor(patch_size = (24,20), extractors = [bob.ip.base.LBP(8, block_size = (3,3), block_overlap = (1,1)), bob.ip.base.LBP(8, block_size = (2,2), to_average = True, add_average_bit = True)])
+  assert extractor.extractor(0).is_multi_block_lbp
+  generator = numpy.random.RandomState(42)
+  cascade = fd.Cascade(feature_extractor = extractor)
+  for stage in range(3):
+    machine = bob.learn.boosting.BoostedMachine()
+    for index in generator.randint(0, extractor.number_of_features, 10):
+      lut = generator.uniform(-1., 1., (extractor.number_of_labels, 1))
+      machine.add_weak_machine(bob.learn.boosting.LUTMachine(lut, numpy.array([index], numpy.int32)), generator.uniform(0.5, 1.))
+    cascade.add(machine, -2.)
+
+  hdf5_file = bob.io.base.test_utils.temporary_filename(suffix = ".hdf5")
+  binary_file = bob.io.base.test_utils.temporary_filename(suffix = ".bin")
+  try:
+    cascade.save(bob.io.base.HDF5File(hdf5_file, 'w'))
+    reference = fd.Cascade(bob.io.base.HDF5File(hdf5_file))
+    fd.save_binary_cascade(reference, binary_file)
+    scale = 0.5
+    expected = reference.evaluate_scale(test_image, scale, 2)
+    for compiled in (True, False):
+      loaded = fd.load_binary_cascade(binary_file, compiled = compiled)
+      for flag in ("is_multi_block_lbp", "block_size", "block_overlap", "to_average", "add_average_bit", "uniform", "elbp_type"):
+        for index in (0, extractor.number_of_features - 1):
+          assert getattr(loaded.extractor.extractor(index), flag) == getattr(reference.extractor.extractor(index), flag)
+      result = loaded.evaluate_scale(test_image, scale, 2)
+      for r, e in zip(result, expected):
+        assert numpy.allclose(r, e)
+  finally:
+    for filename in (binary_file, hdf5_file):
+      if os.path.exists(filename):
+        os.remove(filename)
@@ -1,5 +1,6 @@
 import subprocess
 import os
+import json
 import shutil
 import sys
 
@@ -94,10 +95,14 @@ def test_extraction():
     assert hdf5.get("TotalPositives") == 9 # yes, an odd number makes sense, even if we have mirrored images. The Sampler is the reason
     assert hdf5.get("TotalNegatives") == 1262
 
-    assert hdf5.has_group("Image-0")
-    hdf5.cd("Image-0")
-    for k in hdf5.keys(relative=True):
-      assert k.startswith("Positives") or k.startswith("Negatives")
+    # the index covers all features, which stem from the original and the mirrored first image
+    store = bob.ip.facedetect.train.FeatureStore(os.path.join(feature_dir, "Features_00.hdf5"))
+    assert store.counts == (9, 1262)
+    index = store.index
+    assert (index[:,0] == 0).all()
+    assert set(index[:,1].tolist()) == set((0, 1))
+    assert (index[:,4] - index[:,3]).sum() == 9
+    assert (index[:,6] - index[:,5]).sum() == 1262
 
   finally:
     # make sure that we delete the list file at the end, no matter what the test results in
@@ -174,3 +179,39 @@ def test_detection():
     os.remove(cascade_file)
     if os.path.exists(detected_file):
       os.remove(detected_file)
+
+
+def test_benchmark():
+  # Tests that the bin/benchmark_detector.py writes the timings
+  result_file = bob.io.base.test_utils.temporary_filename(prefix="bobtest_", suffix='.json')
+  try:
+    executables = bob.extension.find_executable('benchmark_detector.py', prefixes = [os.path.dirname(sys.argv[0]), 'bin'])
+    assert executables
+    executable = executables[0]
+
+    command = [executable,
+               '--synthetic-sizes', '60x80',
+               '--distances', '4',
+               '--scale-factors', '0.5',
+               '--repetitions', '1',
+               '--max-windows', '100',
+               '--output-file', result_file,
+               '-vvv'
+              ]
+
+    devnull = open(os.devnull, 'w')
+    ret = subprocess.call(command, stdout=devnull)
+    assert ret == 0
+
+    with open(result_file) as f:
+      report = json.load(f)
+    assert report['cascade_load_ms'] > 0
+    assert len(report['results']) == 2
+    for result in report['results']:
+      assert result['distance'] == 4
+      assert result['windows'] > 0
+      assert result['detect_ms'] > 0
+
+  finally:
+    if os.path.exists(result_file):
+      os.remove(result_file)
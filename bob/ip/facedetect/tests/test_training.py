@@ -97,3 +97,219 @@ def test_extraction():
   finally:
     if os.path.exists(temp_dir):
       shutil.rmtree(temp_dir)
+
+
+def test_extraction_workers():
+  # Test that the features extracted with local worker processes are identical to the sequentially extracted ones
+
+  temp_dir = tempfile.mkdtemp(prefix="FD_")
+
+  try:
+    train_set = fd.train.TrainingSet(temp_dir)
+    annotations = fd.train.read_annotation_file(bob.io.base.test_utils.datafile("testimage.pos", 'bob.ip.facedetect'), 'named')
+    train_set.add_image(bob.io.base.test_utils.datafile("testimage.jpg", 'bob.ip.facedetect'), annotations)
+
+    sampler = fd.detector.Sampler(distance=2, scale_factor=math.pow(2.,-1./4.), lowest_scale=0.125)
+    extractor = fd.FeatureExtractor(patch_size = (24,20), extractors = [bob.ip.base.LBP(8)])
+
+    # extract features with more workers than images, so that one shard stays empty
+    train_set.extract(sampler, extractor, number_of_examples_per_scale=(None, None), similarity_thresholds=(0.3,0.7), workers=2)
+
+    assert os.path.exists(os.path.join(temp_dir, "Extractor.hdf5"))
+    assert not os.path.exists(os.path.join(temp_dir, "Features_00.hdf5"))
+    assert os.path.exists(os.path.join(temp_dir, "Features_01.hdf5"))
+    assert os.path.exists(os.path.join(temp_dir, "Features_02.hdf5"))
+    assert not os.path.exists(os.path.join(temp_dir, "Features_03.hdf5"))
+
+    totals = [bob.io.base.HDF5File(os.path.join(temp_dir, "Features_%02d.hdf5" % shard)).get("TotalPositives") for shard in (1,2)]
+    assert sorted(totals) == [0, 12]
+
+    features, labels = train_set.sample()
+
+    f = bob.io.base.HDF5File(bob.io.base.test_utils.datafile("training.hdf5", 'bob.ip.facedetect'))
+    assert (features == f.get("Features")).all()
+    assert (labels == f.get("Labels")).all()
+
+    # the features can also be extracted into memory-mapped .npy files, which replace the HDF5 files
+    train_set.extract(sampler, extractor, number_of_examples_per_scale=(None, None), similarity_thresholds=(0.3,0.7), workers=2, feature_format='npy')
+    assert not os.path.exists(os.path.join(temp_dir, "Features_01.hdf5"))
+    assert os.path.isdir(os.path.join(temp_dir, "Features_01"))
+    assert os.path.isdir(os.path.join(temp_dir, "Features_02"))
+
+    features, labels = train_set.sample()
+    assert (features == f.get("Features")).all()
+    assert (labels == f.get("Labels")).all()
+
+    # workers cannot be combined with parallel
+    try:
+      train_set.extract(sampler, extractor, parallel=2, workers=2)
+      assert False, "ValueError was not raised"
+    except ValueError:
+      pass
+
+    # the features are numbered by image, so that the sampled features are identical for any number of workers
+    # (the images differ in their ground truth, so that they have different features)
+    ground_truth = train_set.bounding_boxes[0]
+    samples = []
+    for feature_directory, workers in (("sequential", None), ("one", 1), ("two", 2)):
+      train_set = fd.train.TrainingSet(os.path.join(temp_dir, feature_directory))
+      for shift in range(4):
+        train_set.image_paths.append(bob.io.base.test_utils.datafile("testimage.jpg", 'bob.ip.facedetect'))
+        train_set.bounding_boxes.append([fd.BoundingBox((bb.top_f + 3*shift, bb.left_f + 3*shift), bb.size_f) for bb in ground_truth])
+      train_set.extract(sampler, extractor, number_of_examples_per_scale=(None, None), similarity_thresholds=(0.3,0.7), use_every_nth_negative_scale=2, workers=workers)
+      samples.append(train_set.sample() + train_set.sample(maximum_number_of_positives=10, maximum_number_of_negatives=100))
+    for sample in samples[1:]:
+      for array, reference in zip(sample, samples[0]):
+        assert array.shape == reference.shape
+        assert (array == reference).all()
+  finally:
+    if os.path.exists(temp_dir):
+      shutil.rmtree(temp_dir)
+
+
+def test_window_labels():
+  # Test that the vectorized labelling of the windows is identical to labelling each window separately
+  from bob.ip.facedetect.train.TrainingSet import _label_windows
+  sampler = fd.detector.Sampler(distance=2)
+  positions = sampler.sample_scaled_array((120, 100))
+  ground_truth = [fd.BoundingBox((40, 30), (24, 20)), fd.BoundingBox((42, 33), (30, 25)), fd.BoundingBox((10, 60), (20, 16))]
+  # the thresholds might also be given in reversed order
+  for thresholds in ((0.3, 0.7), (0.5, 0.2)):
+    positive, negative = _label_windows(positions, sampler.m_patch_box.size_f, fd.BoundingBoxArray(ground_truth), thresholds)
+    assert positive.any() and negative.any()
+
+    for i, bb in enumerate(sampler.sample_scaled((120, 100))):
+      # the checks are applied in the same order as in previous versions
+      expected_positive, expected_negative = False, True
+      for gt in ground_truth:
+        similarity = bb.similarity(gt)
+        if similarity > thresholds[1]:
+          expected_positive, expected_negative = True, False
+          break
+        if similarity > thresholds[0]:
+          expected_negative = False
+          break
+      assert positive[i] == expected_positive
+      assert negative[i] == expected_negative
+
+  # without ground truth, all windows are negative
+  positive, negative = _label_windows(positions, sampler.m_patch_box.size_f, fd.BoundingBoxArray(), thresholds)
+  assert not positive.any() and negative.all()
+
+
+def test_feature_store():
+  # Test that the features are stored and read in chunks, in both the HDF5 and the .npy format
+  temp_dir = tempfile.mkdtemp(prefix="FD_")
+
+  try:
+    positives = numpy.arange(7*5, dtype=numpy.uint16).reshape((7,5))
+    negatives = numpy.arange(11*5, dtype=numpy.uint16).reshape((11,5)) + 100
+
+    for store_class, filename in ((fd.train.FeatureStore, "Features.hdf5"), (fd.train.NumpyFeatureStore, "Features")):
+      feature_file = os.path.join(temp_dir, filename)
+      store = store_class(feature_file, 'w', chunk_size=3, first_image=2)
+      store.add(0, 'o', 1., positives[:4], negatives[:6])
+      store.add(0, 'm', 1., positives[4:], numpy.zeros((0,5), numpy.uint16))
+      store.add(3, 'o', 0.5, numpy.zeros((0,5), numpy.uint16), negatives[6:])
+      store.add(4, 'o', 0.5, numpy.zeros((0,5), numpy.uint16), numpy.zeros((0,5), numpy.uint16))
+      store.close()
+
+      store = store_class(feature_file, chunk_size=3)
+      assert store.counts == (7, 11)
+      assert store.chunk_size == 3
+      assert store.number_of_features == 5
+      assert store.first_image == 2
+      assert (store.get(1, range(7)) == positives).all()
+      assert (store.get(-1, [10, 0, 4]) == negatives[[10, 0, 4]]).all()
+      assert store.get(1, []).shape == (0, 5)
+
+      # the features can be read into a pre-allocated array
+      features = numpy.zeros((4, 5), numpy.uint16)
+      assert store.get(-1, [1, 9, 2, 5], features) is features
+      assert (features == negatives[[1, 9, 2, 5]]).all()
+
+      # iterating the chunks returns all features
+      assert (numpy.concatenate([f for _, f in store.iterate(-1)]) == negatives).all()
+      assert [b for b, _ in store.iterate(1)] == [0, 3, 6]
+
+      # the index stores the image, the part, the scale and the row ranges
+      assert numpy.allclose(store.index, [[0, 0, 1., 0, 4, 0, 6], [0, 1, 1., 4, 7, 6, 6], [3, 0, 0.5, 7, 7, 6, 11]])
+
+      try:
+        store.get(1, [7])
+        assert False, "IndexError was not raised"
+      except IndexError:
+        pass
+      try:
+        store.get(1, [0, 1], numpy.zeros((3, 5), numpy.uint16))
+        assert False, "ValueError was not raised"
+      except ValueError:
+        pass
+      store.close()
+
+    # the .npy files can be read with numpy
+    assert (numpy.load(os.path.join(temp_dir, "Features", "Negatives.npy")) == negatives).all()
+  finally:
+    if os.path.exists(temp_dir):
+      shutil.rmtree(temp_dir)
+
+
+def test_legacy_feature_store():
+  # Test that feature files of earlier versions are read, and that the sampled features are numbered and ordered as before
+  temp_dir = tempfile.mkdtemp(prefix="FD_")
+
+  try:
+    # the feature file of earlier versions, with one group per image and one dataset per part and scale
+    datasets = {
+      "Image-2" : {"Negatives-o-0.50000" : 3, "Negatives-o-1.00000" : 1, "Positives-o-0.50000" : 1},
+      "Image-10" : {"Negatives-o-1.00000" : 2, "Positives-o-1.00000" : 2, "Positives-m-1.00000" : 1},
+    }
+    hdf5 = bob.io.base.HDF5File(os.path.join(temp_dir, "Features_00.hdf5"), 'w')
+    value = 0
+    for image in sorted(datasets):
+      hdf5.create_group(image)
+      hdf5.cd(image)
+      for dataset in sorted(datasets[image]):
+        # the features of each dataset are unique
+        hdf5.set(dataset, numpy.arange(value, value + 5 * datasets[image][dataset], dtype=numpy.uint16).reshape((-1, 5)))
+        value += 5 * datasets[image][dataset]
+      hdf5.cd("..")
+    hdf5.set("TotalPositives", 4)
+    hdf5.set("TotalNegatives", 6)
+    del hdf5
+
+    feature_file = os.path.join(temp_dir, "Features_00.hdf5")
+    try:
+      fd.train.FeatureStore(feature_file)
+      assert False, "IOError was not raised"
+    except IOError:
+      pass
+
+    # the features are numbered by the sorted names of the images and datasets, i.e., Image-10 before Image-2, and mirrored before original parts
+    def expected(image, dataset, indices):
+      begin = sum(5 * datasets[i][d] for i in sorted(datasets) for d in sorted(datasets[i]) if (i, d) < (image, dataset))
+      return numpy.arange(begin, begin + 5 * datasets[image][dataset], dtype=numpy.uint16).reshape((-1, 5))[indices]
+    positives = numpy.concatenate([expected("Image-10", "Positives-m-1.00000", [0]), expected("Image-10", "Positives-o-1.00000", [0, 1]), expected("Image-2", "Positives-o-0.50000", [0])])
+    negatives = numpy.concatenate([expected("Image-10", "Negatives-o-1.00000", [0, 1]), expected("Image-2", "Negatives-o-0.50000", [0, 1, 2]), expected("Image-2", "Negatives-o-1.00000", [0])])
+
+    store = fd.train.LegacyFeatureStore(feature_file)
+    assert store.counts == (4, 6)
+    assert store.number_of_features == 5
+    assert store.first_image == 2
+    assert (store.get(1, range(4)) == positives).all()
+    assert (store.get(-1, [5, 0, 3]) == negatives[[5, 0, 3]]).all()
+    assert (numpy.concatenate([f for _, f in store.iterate(-1)]) == negatives).all()
+    assert [b for b, _ in store.iterate(1)] == [0, 1, 3]
+    assert numpy.allclose(store.index, [[10, 1, 1., 0, 1, 0, 0], [10, 0, 1., 1, 3, 0, 2], [2, 0, 0.5, 3, 4, 2, 5], [2, 0, 1., 4, 4, 5, 6]])
+    store.close()
+
+    # the training set reads the feature file, and returns the features image by image, with the negatives of each image before its positives
+    train_set = fd.train.TrainingSet(temp_dir)
+    features, labels = train_set.sample(positive_indices=set([0, 3]), negative_indices=set([1, 5]))
+    assert (features == numpy.array([negatives[1], positives[0], negatives[5], positives[3]])).all()
+    assert (labels == [-1, 1, -1, 1]).all()
+    assert train_set.positive_indices == set([0, 3])
+    assert train_set.negative_indices == set([1, 5])
+  finally:
+    if os.path.exists(temp_dir):
+      shutil.rmtree(temp_dir)
@@ -0,0 +1,429 @@
+import bob.io.base
+import numpy
+import os
+import struct
+
+# the names of the datasets of the positive and the negative features
+_DATASETS = ("Positives", "Negatives")
+# the parts of the images, i.e., the original and the mirrored image
+_PARTS = "om"
+
+def _first_image(index):
+  """Returns the smallest image in the given index, which is used when the first image was not stored."""
+  return int(index[:,0].min()) if len(index) else 0
+
+
+class FeatureStore:
+  """Stores the positive and negative training features of one feature file, as written by :py:meth:`TrainingSet.extract`.
+
+  All positive (and all negative) features of the file are stored in a single appendable dataset.
+  The features are appended in chunks of ``chunk_size`` rows, so that any feature can be read by loading a single chunk, and all features can be iterated chunk by chunk without loading the whole dataset.
+  Additionally, the file contains the total number of positive and negative features (see :py:attr:`counts`), as well as an :py:attr:`index`, which stores the image, the part and the scale, from which the rows of the datasets were extracted.
+  The ``first_image`` of the part of the training set, which was assigned to the process that wrote the file, is stored as well; it is used to order the features of several files in :py:meth:`TrainingSet.sample`.
+  Feature files that were written by earlier versions can be read with the :py:class:`LegacyFeatureStore`.
+
+  **Constructor Documentation:**
+
+    Opens the given feature file for reading, or creates it for writing.
+
+    **Parameters:**
+
+    ``filename`` : str
+      The name of the feature file
+
+    ``mode`` : 'r' or 'w'
+      Should the file be opened for reading or (over)writing?
+
+    ``chunk_size`` : int
+      The number of rows that are stored in each chunk; only used when writing, otherwise it is read from file
+
+    ``first_image`` : int
+      The index of the first image of the part of the training set, from which the features are extracted; only used when writing, otherwise it is read from file
+  """
+
+  def __init__(self, filename, mode = 'r', chunk_size = 1024, first_image = 0):
+    if mode not in ('r', 'w'):
+      raise ValueError("The mode '%s' is not supported; use 'r' or 'w'" % mode)
+    self.filename = filename
+    self.mode = mode
+    self.hdf5 = bob.io.base.HDF5File(filename, mode)
+    if mode == 'r':
+      if not self.hdf5.has_key("ChunkSize"):
+        raise IOError("The feature file %s was written in an outdated format; please read it with a LegacyFeatureStore" % filename)
+      self.chunk_size = int(self.hdf5.get("ChunkSize"))
+      self.counts = (int(self.hdf5.get("TotalPositives")), int(self.hdf5.get("TotalNegatives")))
+      self.number_of_features = int(self.hdf5.get("NumberOfFeatures"))
+      self._index = None
+      self.first_image = int(self.hdf5.get("FirstImage")) if self.hdf5.has_key("FirstImage") else _first_image(self.index)
+    else:
+      self.chunk_size = chunk_size
+      self.first_image = first_image
+      self.counts = (0, 0)
+      self.number_of_features = 0
+      self._index = []
+      self._buffers = ([], [])
+
+
+  def add(self, image, part, scale, positives, negatives):
+    """add(image, part, scale, positives, negatives) -> None
+
+    Appends the positive and negative features that were extracted from the given image, part and scale.
+
+    **Parameters:**
+
+    ``image`` : int
+      The index of the image in the :py:class:`TrainingSet`
+
+    ``part`` : 'o' or 'm'
+      Were the features extracted from the original or the mirrored image?
+
+    ``scale`` : float
+      The scale of the image, in which the features were extracted
+
+    ``positives, negatives`` : array_like (2D, uint16)
+      The positive and the negative features, with one row for each feature; might be empty
+    """
+    assert self.mode == 'w'
+    ranges = []
+    counts = []
+    for label, features in enumerate((positives, negatives)):
+      count = self.counts[label]
+      if len(features):
+        self.number_of_features = features.shape[1]
+        self._buffers[label].append(numpy.asarray(features, numpy.uint16))
+        self._write(label, False)
+      ranges.extend((count, count + len(features)))
+      counts.append(count + len(features))
+    if ranges[0] < ranges[1] or ranges[2] < ranges[3]:
+      self._index.append([image, _PARTS.index(part), scale] + ranges)
+    self.counts = tuple(counts)
+
+
+  def _write(self, label, last):
+    """Writes all complete chunks (and the last incomplete chunk, when ``last`` is enabled) of the given label to file."""
+    buffered = sum(len(b) for b in self._buffers[label])
+    if buffered < self.chunk_size and not (last and buffered):
+      return
+    features = numpy.concatenate(self._buffers[label])
+    start = 0
+    while buffered - start >= self.chunk_size:
+      self.hdf5.append(_DATASETS[label], features[start:start+self.chunk_size])
+      start += self.chunk_size
+    if last and start < buffered:
+      # fill up the last chunk with zeros; these rows are not counted
+      chunk = numpy.zeros((self.chunk_size, features.shape[1]), numpy.uint16)
+      chunk[:buffered-start] = features[start:]
+      self.hdf5.append(_DATASETS[label], chunk)
+      start = buffered
+    self._buffers[label][:] = [features[start:]] if start < buffered else []
+
+
+  def close(self):
+    """close() -> None
+
+    Writes the remaining features, the total numbers of features and the index, and closes the file.
+    """
+    if self.hdf5 is None:
+      return
+    if self.mode == 'w':
+      for label in range(2):
+        self._write(label, True)
+      self.hdf5.set("TotalPositives", self.counts[0])
+      self.hdf5.set("TotalNegatives", self.counts[1])
+      self.hdf5.set("ChunkSize", self.chunk_size)
+      self.hdf5.set("NumberOfFeatures", self.number_of_features)
+      self.hdf5.set("FirstImage", self.first_image)
+      if self._index:
+        self.hdf5.set("Index", numpy.array(self._index, numpy.float64))
+    self.hdf5 = None
+
+
+  @property
+  def index(self):
+    """The index of the stored features, an array of shape ``(N, 7)`` with one ``(image, part, scale, positive_begin, positive_end, negative_begin, negative_end)`` row for each image, part (0 for the original and 1 for the mirrored image) and scale, from which features were extracted"""
+    if self._index is None:
+      self._index = self.hdf5.get("Index").reshape((-1, 7)) if self.hdf5.has_key("Index") else numpy.zeros((0, 7))
+    return numpy.array(self._index, numpy.float64).reshape((-1, 7))
+
+
+  def get(self, label, indices, features = None):
+    """get(label, indices, [features]) -> features
+
+    Returns the positive or negative features with the given indices.
+
+    Each chunk that contains any of the given indices is read only once.
+
+    **Parameters:**
+
+    ``label`` : +1 or -1
+      Should positive (+1) or negative (-1) features be returned?
+
+    ``indices`` : array_like (1D, int)
+      The indices of the features in this file, which must be smaller than the according :py:attr:`counts`
+
+    ``features`` : array_like (2D, uint16) or ``None``
+      If given, the pre-allocated array of shape ``(len(indices), number_of_features)``, into which the features are written
+
+    **Returns:**
+
+    ``features`` : array_like (2D, uint16)
+      The features, with one row for each of the given ``indices``
+    """
+    label, indices, features = self._check(label, indices, features)
+    chunks = indices // self.chunk_size
+    for chunk in numpy.unique(chunks).tolist():
+      data = self.hdf5.read(_DATASETS[label], chunk)
+      selected = chunks == chunk
+      features[selected] = data[indices[selected] % self.chunk_size]
+    return features
+
+
+  def _check(self, label, indices, features):
+    """Checks the indices and allocates the features for :py:meth:`get`."""
+    label = 0 if label > 0 else 1
+    indices = numpy.asarray(indices, numpy.int64).reshape((-1,))
+    if len(indices) and (indices.min() < 0 or indices.max() >= self.counts[label]):
+      raise IndexError("The indices must be between 0 and %d" % self.counts[label])
+    if features is None:
+      features = numpy.empty((len(indices), self.number_of_features), numpy.uint16)
+    elif features.shape != (len(indices), self.number_of_features) or features.dtype != numpy.uint16:
+      raise ValueError("The features must be of type uint16 and shape (%d, %d)" % (len(indices), self.number_of_features))
+    return label, indices, features
+
+
+  def iterate(self, label):
+    """iterate(label) -> begin, features
+
+    Iterates over all positive or negative features chunk by chunk.
+
+    **Parameters:**
+
+    ``label`` : +1 or -1
+      Should positive (+1) or negative (-1) features be iterated?
+
+    **Yields:**
+
+    ``begin`` : int
+      The index of the first feature in the current chunk
+
+    ``features`` : array_like (2D, uint16)
+      The features of the current chunk
+    """
+    label = 0 if label > 0 else 1
+    for begin in range(0, self.counts[label], self.chunk_size):
+      yield begin, self.hdf5.read(_DATASETS[label], begin // self.chunk_size)[:self.counts[label] - begin]
+
+
+
+class LegacyFeatureStore(FeatureStore):
+  """Reads the positive and negative training features of one feature file, which was written by an earlier version of :py:meth:`TrainingSet.extract`.
+
+  These feature files contain one group ``Image-<index>`` for each image, with one dataset ``Positives-<part>-<scale>`` and ``Negatives-<part>-<scale>`` for each part and scale of the image.
+  This class provides the reading interface of the :py:class:`FeatureStore`.
+  The features are numbered in the order, in which earlier versions read them, i.e., by the (lexicographically) sorted names of the groups and the datasets, so that indices that were stored with earlier versions select the same features.
+
+  **Constructor Documentation:**
+
+    Opens the given feature file for reading.
+
+    **Parameters:**
+
+    ``filename`` : str
+      The name of the feature file
+  """
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.mode = 'r'
+    self.hdf5 = bob.io.base.HDF5File(filename)
+    self.number_of_features = 0
+    # the (group, dataset, begin, size) of the positive and negative datasets, in the order of their features
+    self._datasets = ([], [])
+    self._index = []
+    counts = [0, 0]
+    images = []
+    for group in sorted(self.hdf5.sub_groups(recursive = False, relative = True)):
+      image = int(group.split("-")[1])
+      images.append(image)
+      self.hdf5.cd(group)
+      # the sizes of the positive and negative datasets of all parts and scales
+      sizes = {}
+      for dataset in sorted(self.hdf5.keys(relative = True)):
+        name, part, scale = dataset.split("-")
+        features = self.hdf5.get(dataset)
+        self.number_of_features = features.shape[1]
+        sizes.setdefault((part, scale), [0, 0])[_DATASETS.index(name)] = len(features)
+      self.hdf5.cd("..")
+      # all negatives of the image are numbered before all positives, but both are sorted by part and scale
+      for part, scale in sorted(sizes):
+        ranges = []
+        for label, size in enumerate(sizes[(part, scale)]):
+          if size:
+            self._datasets[label].append((group, "%s-%s-%s" % (_DATASETS[label], part, scale), counts[label], size))
+          ranges.extend((counts[label], counts[label] + size))
+          counts[label] += size
+        self._index.append([image, _PARTS.index(part), float(scale)] + ranges)
+    self.counts = tuple(counts)
+    self.first_image = min(images) if images else 0
+
+
+  def _read(self, group, dataset):
+    """Reads the features of the given dataset."""
+    self.hdf5.cd(group)
+    features = self.hdf5.get(dataset)
+    self.hdf5.cd("..")
+    return features
+
+
+  def get(self, label, indices, features = None):
+    """get(label, indices, [features]) -> features
+
+    Returns the positive or negative features with the given indices, see :py:meth:`FeatureStore.get`.
+
+    Each dataset that contains any of the given indices is read only once.
+    """
+    label, indices, features = self._check(label, indices, features)
+    datasets = self._datasets[label]
+    selected_datasets = numpy.searchsorted([dataset[2] for dataset in datasets], indices, side = 'right') - 1
+    for d in numpy.unique(selected_datasets).tolist():
+      group, dataset, begin, _ = datasets[d]
+      selected = selected_datasets == d
+      features[selected] = self._read(group, dataset)[indices[selected] - begin]
+    return features
+
+
+  def iterate(self, label):
+    """iterate(label) -> begin, features
+
+    Iterates over all positive or negative features dataset by dataset, see :py:meth:`FeatureStore.iterate`.
+    """
+    label = 0 if label > 0 else 1
+    for group, dataset, begin, _ in self._datasets[label]:
+      yield begin, self._read(group, dataset)
+
+
+
+# the number of bytes reserved for the header of the .npy files, which is written when the file is closed
+_NPY_HEADER_SIZE = 128
+
+def _npy_header(shape):
+  """Returns the header of a .npy file (version 1.0) containing a uint16 array of the given shape, padded to the reserved header size."""
+  header = "{'descr': '<u2', 'fortran_order': False, 'shape': (%d, %d), }" % shape
+  # the header is padded with spaces and terminated by a newline
+  header = header.ljust(_NPY_HEADER_SIZE - 11) + "\n"
+  return numpy.lib.format.magic(1, 0) + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+class NumpyFeatureStore(FeatureStore):
+  """Stores the positive and negative training features of one feature directory as memory-mapped ``.npy`` files.
+
+  This is an alternative layout of the :py:class:`FeatureStore`, which provides the same interface.
+  The positive and negative features are stored in the files ``Positives.npy`` and ``Negatives.npy``, the :py:attr:`index` in ``Index.npy`` and the ``first_image`` in ``FirstImage.npy`` inside the given directory.
+  The features are written row by row while extracting, and the headers of the files are written when the store is closed.
+  When reading, the features are memory-mapped, so that :py:meth:`get` is a single gather operation, which does not decode or copy any data except for the requested features.
+
+  **Constructor Documentation:**
+
+    Opens the given feature directory for reading, or creates it for writing.
+
+    **Parameters:**
+
+    ``filename`` : str
+      The name of the feature directory
+
+    ``mode`` : 'r' or 'w'
+      Should the directory be opened for reading or (over)writing?
+
+    ``chunk_size`` : int
+      The number of rows that :py:meth:`iterate` returns at once
+
+    ``first_image`` : int
+      The index of the first image of the part of the training set, from which the features are extracted; only used when writing, otherwise it is read from file
+  """
+
+  def __init__(self, filename, mode = 'r', chunk_size = 1024, first_image = 0):
+    if mode not in ('r', 'w'):
+      raise ValueError("The mode '%s' is not supported; use 'r' or 'w'" % mode)
+    self.filename = filename
+    self.mode = mode
+    self.chunk_size = chunk_size
+    self.hdf5 = None
+    if mode == 'r':
+      self._features = [self._load(name) for name in _DATASETS]
+      self.counts = tuple(len(features) for features in self._features)
+      self.number_of_features = self._features[0].shape[1]
+      self._index = numpy.load(os.path.join(filename, "Index.npy"))
+      first_image_file = os.path.join(filename, "FirstImage.npy")
+      self.first_image = int(numpy.load(first_image_file)) if os.path.exists(first_image_file) else _first_image(self.index)
+    else:
+      bob.io.base.create_directories_safe(filename)
+      self.first_image = first_image
+      self.counts = (0, 0)
+      self.number_of_features = 0
+      self._index = []
+      self._buffers = ([], [])
+      self._files = [open(os.path.join(filename, name + ".npy"), "wb") for name in _DATASETS]
+      for f in self._files:
+        f.write(b"\0" * _NPY_HEADER_SIZE)
+
+
+  def _load(self, name):
+    """Memory-maps the features with the given name."""
+    filename = os.path.join(self.filename, name + ".npy")
+    with open(filename, "rb") as f:
+      numpy.lib.format.read_magic(f)
+      shape = numpy.lib.format.read_array_header_1_0(f)[0]
+    # empty files cannot be memory-mapped
+    return numpy.load(filename, mmap_mode = 'r') if shape[0] else numpy.zeros(shape, numpy.uint16)
+
+
+  def _write(self, label, last):
+    """Writes all buffered features of the given label to file."""
+    for features in self._buffers[label]:
+      self._files[label].write(numpy.ascontiguousarray(features, "<u2").tobytes())
+    self._buffers[label][:] = []
+
+
+  def close(self):
+    """close() -> None
+
+    Writes the headers of the feature files, the index and the first image, and closes the files.
+    """
+    if self.mode != 'w' or self._files is None:
+      return
+    for label, f in enumerate(self._files):
+      f.seek(0)
+      f.write(_npy_header((self.counts[label], self.number_of_features)))
+      f.close()
+    self._files = None
+    numpy.save(os.path.join(self.filename, "Index.npy"), numpy.array(self._index, numpy.float64).reshape((-1, 7)))
+    numpy.save(os.path.join(self.filename, "FirstImage.npy"), numpy.array(self.first_image, numpy.int64))
+
+
+  @property
+  def index(self):
+    """The index of the stored features, see :py:attr:`FeatureStore.index`"""
+    return numpy.array(self._index, numpy.float64).reshape((-1, 7))
+
+
+  def get(self, label, indices, features = None):
+    """get(label, indices, [features]) -> features
+
+    Returns the positive or negative features with the given indices, see :py:meth:`FeatureStore.get`.
+
+    The features are gathered from the memory-mapped file in a single operation.
+    """
+    label, indices, features = self._check(label, indices, features)
+    numpy.take(self._features[label], indices, axis = 0, out = features, mode = 'clip')
+    return features
+
+
+  def iterate(self, label):
+    """iterate(label) -> begin, features
+
+    Iterates over all positive or negative features in chunks of ``chunk_size`` rows, see :py:meth:`FeatureStore.iterate`.
+    """
+    label = 0 if label > 0 else 1
+    for begin in range(0, self.counts[label], self.chunk_size):
+      # only the current chunk is copied into memory
+      yield begin, numpy.array(self._features[label][begin : begin + self.chunk_size])
@@ -6,12 +6,106 @@ import bob.ip.color
 import numpy
 
 import os
-import collections
+import shutil
+import queue
+import traceback
+import multiprocessing
 import logging
 logger = logging.getLogger('bob.ip.facedetect')
 
 from .utils import bounding_box_from_annotation, parallel_part, quasi_random_indices
+from .FeatureStore import FeatureStore, LegacyFeatureStore, NumpyFeatureStore
 from .._library import BoundingBox, FeatureExtractor
+from ..boxes import BoundingBoxArray
+from ..detector import Sampler
+from ..detect import _sampler_parameters
+
+# the feature stores of the supported feature formats, and the extensions of their feature files
+_FEATURE_FORMATS = {'hdf5' : (FeatureStore, ".hdf5"), 'npy' : (NumpyFeatureStore, "")}
+
+def _feature_store(feature_file, mode = 'r', first_image = 0):
+  """Opens the feature store of the given feature file or directory; feature files of earlier versions are read with a :py:class:`LegacyFeatureStore`."""
+  if not feature_file.endswith(".hdf5"):
+    return NumpyFeatureStore(feature_file, mode, first_image = first_image)
+  if mode == 'r' and not bob.io.base.HDF5File(feature_file).has_key("ChunkSize"):
+    return LegacyFeatureStore(feature_file)
+  return FeatureStore(feature_file, mode, first_image = first_image)
+
+
+def _extraction_worker(feature_directory, image_paths, bounding_boxes, sampler_parameters, extractor_file, parameters, feature_format, shard, tasks, results):
+  """Extracts the features of the images, whose indices are taken from the ``tasks`` queue, into the given shard, until ``None`` is taken; runs in the worker processes of :py:meth:`TrainingSet.extract`.
+
+  BoundingBox objects cannot be pickled, so the bounding boxes are given as ``(top, left, height, width)`` tuples.
+  The progress, the final number of features and any error are reported through the ``results`` queue."""
+  try:
+    training_set = TrainingSet(feature_directory)
+    training_set.image_paths = image_paths
+    training_set.bounding_boxes = [[BoundingBox(bb[:2], bb[2:]) for bb in boxes] for boxes in bounding_boxes]
+    sampler = Sampler(**sampler_parameters)
+    feature_extractor = FeatureExtractor(bob.io.base.HDF5File(extractor_file))
+    # all shards share the whole training set, so that their features are numbered together in :py:meth:`TrainingSet.sample`
+    store = _feature_store(training_set._feature_file(index = shard, feature_format = feature_format), 'w', 0)
+    for index in iter(tasks.get, None):
+      training_set._extract_image(index, store, sampler, feature_extractor, parameters)
+      results.put(("image", shard, index))
+    store.close()
+    results.put(("done", shard, store.counts))
+  except Exception:
+    results.put(("error", shard, traceback.format_exc()))
+
+
+def _feature_segments(stores):
+  """Returns the segments of consecutive positive and negative features of the given feature stores, in the order in which :py:meth:`TrainingSet.sample` numbers the features.
+
+  As in earlier versions, the features are numbered by the part of the training set that was assigned to the extracting process (see :py:func:`parallel_part`), then by the lexicographically sorted names ``Image-<index>`` of the images, and by the stored order of parts and scales for each image.
+  The worker processes of :py:meth:`TrainingSet.extract` share the whole training set, so that the numbering does not depend on how the images were distributed over their feature files.
+  For the positives and the negatives, an array with one ``(store, begin, global_begin, length, image)`` row for each segment is returned, where ``begin`` is the index of the first feature of the segment inside the ``store``, ``global_begin`` its index in the numbering of all features, and ``image`` the position of its image in the numbering."""
+  table = numpy.concatenate([numpy.column_stack((numpy.full(len(index), i), index)) for i, index in enumerate(store.index for store in stores)] + [numpy.zeros((0, 8))]).astype(numpy.int64)
+  first_images = [store.first_image for store in stores]
+  # sort by part and image name, keeping the order of the stores and of the rows inside each store
+  table = table[sorted(range(len(table)), key = lambda r: (first_images[table[r,0]], "Image-%d" % table[r,1]))]
+  images = numpy.ones(len(table), bool)
+  images[1:] = table[1:,1] != table[:-1,1]
+  images = numpy.cumsum(images) - 1
+  segments = []
+  for begin, end in ((4, 5), (6, 7)):
+    lengths = table[:,end] - table[:,begin]
+    used = lengths > 0
+    segments.append(numpy.column_stack((table[used,0], table[used,begin], numpy.cumsum(lengths[used]) - lengths[used], lengths[used], images[used])))
+  return segments
+
+
+def _locate(segments, indices):
+  """Returns the stores, the indices inside the stores and the positions of the images of the features with the given (sorted) global indices."""
+  selected = numpy.searchsorted(segments[:,2] + segments[:,3], indices, side = 'right')
+  return segments[selected,0], segments[selected,1] + indices - segments[selected,2], segments[selected,4]
+
+
+def _global_indices(segments, store, indices):
+  """Returns the global indices of the features with the given indices inside the given store."""
+  segments = segments[segments[:,0] == store]
+  segments = segments[numpy.argsort(segments[:,1])]
+  selected = numpy.searchsorted(segments[:,1], indices, side = 'right') - 1
+  return segments[selected,2] + indices - segments[selected,1]
+
+
+def _label_windows(positions, patch_size, ground_truth, similarity_thresholds):
+  """Labels the windows at the given top-left positions with the given patch size as positive and negative examples.
+
+  A window is labelled by the first ground truth bounding box, to which its Jaccard similarity is higher than the lower of the two ``similarity_thresholds``: it is positive, when this similarity is also higher than ``similarity_thresholds[1]``.
+  Windows with lower similarities to all ground truth bounding boxes are negative.
+  This is the same order of checks as labelling each window separately, also when ``similarity_thresholds[1]`` is lower than ``similarity_thresholds[0]``.
+  Returns two boolean masks, which are ``True`` for the positive and the negative windows."""
+  if not len(ground_truth):
+    return numpy.zeros(len(positions), bool), numpy.ones(len(positions), bool)
+  windows = BoundingBoxArray.from_arrays(positions[:,0], positions[:,1], patch_size[0], patch_size[1])
+  similarities = windows.similarity(ground_truth)
+  overlapping = similarities > min(similarity_thresholds)
+  first = numpy.argmax(overlapping, axis=1)
+  negative = ~overlapping.any(axis=1)
+  positive = ~negative & (similarities[numpy.arange(len(first)), first] > similarity_thresholds[1])
+  return positive, negative
+
 
 class TrainingSet:
   """A set of images including bounding boxes that are used as a training set
@@ -143,22 +237,22 @@ class TrainingSet:
       yield image, self.bounding_boxes[index], self.image_paths[index]
 
 
-  def _feature_file(self, parallel = None, index = None):
-    """Returns the name of an intermediate file for storing features."""
+  def _feature_file(self, parallel = None, index = None, feature_format = 'hdf5'):
+    """Returns the name of an intermediate file (or directory) for storing features."""
     if index is None:
       index = 0 if parallel is None or "SGE_TASK_ID" not in os.environ else int(os.environ["SGE_TASK_ID"])
-    return os.path.join(self.feature_directory, "Features_%02d.hdf5" % index)
+    return os.path.join(self.feature_directory, "Features_%02d%s" % (index, _FEATURE_FORMATS[feature_format][1]))
 
   def __len__(self):
     """Returns the number of files stored inside this training set."""
     return len(self.image_paths)
 
 
-  def extract(self, sampler, feature_extractor, number_of_examples_per_scale = (100, 100), similarity_thresholds = (0.5, 0.8), parallel = None, mirror = False, use_every_nth_negative_scale = 1):
+  def extract(self, sampler, feature_extractor, number_of_examples_per_scale = (100, 100), similarity_thresholds = (0.5, 0.8), parallel = None, mirror = False, use_every_nth_negative_scale = 1, use_image_pyramid = False, workers = None, feature_format = 'hdf5'):
     """Extracts features from **all** images in **all** scales and writes them to file.
 
     This function iterates over all images that are present in the internally stored list, and extracts features using the given ``feature_extractor`` for every image patch that the given ``sampler`` returns.
-    The final features will be stored in the ``feature_directory`` that is set in the constructor.
+    The final features will be stored in the ``feature_directory`` that is set in the constructor, using one :py:class:`FeatureStore` for each process.
 
     For each image, the ``sampler`` samples patch locations, which cover the whole image in different scales.
     For each patch locations is tested, how similar they are to the face bounding boxes that belong to that image, using the Jaccard :py:meth:`BoundingBox.similarity`.
@@ -173,6 +267,9 @@ class TrainingSet:
     Furthermore, this function is designed to be run using several parallel processes, e.g., using the `GridTK <https://pypi.python.org/pypi/gridtk>`_.
     Each of the processes will run on a particular subset of the images, which is defined by the ``SGE_TASK_ID`` environment variable.
     The ``parallel`` parameter defines the total number of parallel processes that are used.
+    Alternatively, the images can be processed by ``workers`` local processes, which take the images one by one, so that large images do not stall the other workers.
+    Each worker process writes its own feature file, which it closes after the images are processed.
+    Since :py:meth:`sample` numbers the features by image, the sampled features do not depend on the number of workers, or on which worker processed which image.
 
     **Parameters:**
 
@@ -198,19 +295,36 @@ class TrainingSet:
       Skip some negative scales to decrease the number of negative examples, i.e., only extract and store negative features, when ``scale_counter % use_every_nth_negative_scale == 0``
 
       .. note::
-         The ``scale_counter`` is not reset between images, so that we might get features from different scales in subsequent images.
+         The ``scale_counter`` is reset for each image, but it is not reset between the original and the mirrored image.
+
+    ``use_image_pyramid`` : bool
+      Compute all scales of an image at once using :py:meth:`Sampler.image_pyramid`, where smaller scales are computed from larger scales, instead of scaling the original image for each scale separately.
+      This is faster for large images, but the extracted features might differ slightly.
+
+    ``workers`` : int or ``None``
+      If given, the number of local worker processes, which are used to extract features; cannot be combined with ``parallel``
+
+    ``feature_format`` : 'hdf5' or 'npy'
+      The format of the feature files; ``'hdf5'`` stores the features of each process in a :py:class:`FeatureStore` file, while ``'npy'`` stores them in a directory of memory-mappable ``.npy`` files (see :py:class:`NumpyFeatureStore`), from which :py:meth:`sample` can read the features faster
     """
 
-    feature_file = self._feature_file(parallel)
+    if parallel is not None and workers is not None:
+      raise ValueError("The `parallel` and `workers` options cannot be combined")
+    if feature_format not in _FEATURE_FORMATS:
+      raise ValueError("The feature format '%s' is not supported; use one of %s" % (feature_format, sorted(_FEATURE_FORMATS)))
+
     bob.io.base.create_directories_safe(self.feature_directory)
 
+    extractor_file = os.path.join(self.feature_directory, "Extractor.hdf5")
     if parallel is None or "SGE_TASK_ID" not in os.environ or os.environ["SGE_TASK_ID"] == '1':
-      extractor_file = os.path.join(self.feature_directory, "Extractor.hdf5")
       hdf5 = bob.io.base.HDF5File(extractor_file, "w")
       feature_extractor.save(hdf5)
       del hdf5
 
-    total_positives, total_negatives = 0, 0
+    parameters = (number_of_examples_per_scale, similarity_thresholds, mirror, use_every_nth_negative_scale, use_image_pyramid)
+
+    if workers is not None:
+      return self._extract_with_workers(sampler, extractor_file, parameters, workers, feature_format)
 
     indices = parallel_part(range(len(self)), parallel)
     if not indices:
@@ -218,78 +332,146 @@ class TrainingSet:
     else:
       logger.info("Extracting features for images in range %d - %d of %d", indices[0], indices[-1], len(self))
 
-    hdf5 = bob.io.base.HDF5File(feature_file, "w")
+    # remove the features of this process, which might have been extracted in another format before
+    process = 0 if parallel is None or "SGE_TASK_ID" not in os.environ else int(os.environ["SGE_TASK_ID"])
+    self._remove_feature_files(process)
+    store = _feature_store(self._feature_file(index = process, feature_format = feature_format), 'w', indices[0] if indices else 0)
     for index in indices:
-      hdf5.create_group("Image-%d" % index)
-      hdf5.cd("Image-%d" % index)
-
       logger.debug("Processing file %d of %d: %s", index+1, indices[-1]+1, self.image_paths[index])
+      self._extract_image(index, store, sampler, feature_extractor, parameters)
+    store.close()
+
+
+  def _extract_image(self, index, store, sampler, feature_extractor, parameters):
+    """Extracts the features of the image with the given index into the given :py:class:`FeatureStore`."""
+    number_of_examples_per_scale, similarity_thresholds, mirror, use_every_nth_negative_scale, use_image_pyramid = parameters
+    features = []
+
+    # load image
+    image = bob.io.base.load(self.image_paths[index])
+    if image.ndim == 3:
+      image = bob.ip.color.rgb_to_gray(image)
+    # get ground_truth bounding boxes
+    ground_truth = BoundingBoxArray(self.bounding_boxes[index])
+
+    # collect image and GT for originally and mirrored image
+    images = [image] if not mirror else [image, bob.ip.base.flop(image)]
+    ground_truths = [ground_truth] if not mirror else [ground_truth, ground_truth.mirror_x(image.shape[1])]
+    parts = "om"
+
+    # now, sample
+    scale_counter = -1
+    for image, ground_truth, part in zip(images, ground_truths, parts):
+      if use_image_pyramid:
+        image = sampler.image_pyramid(image, compute_integral_image = True)
+      for scale, scaled_image_shape, level in sampler.levels(image):
+        scale_counter += 1
+        # label all possible positions in the image at once
+        positions = sampler.sample_scaled_array(scaled_image_shape)
+        positive, negative = _label_windows(positions, sampler.m_patch_box.size_f, ground_truth.scale(scale), similarity_thresholds)
+        positives = numpy.flatnonzero(positive)
+        negatives = numpy.flatnonzero(negative) if scale_counter % use_every_nth_negative_scale == 0 else numpy.zeros(0, int)
+
+        # per scale, limit the number of positive and negative samples
+        positives = positions[positives[list(quasi_random_indices(len(positives), number_of_examples_per_scale[0]))]]
+        negatives = positions[negatives[list(quasi_random_indices(len(negatives), number_of_examples_per_scale[1]))]]
+        patch_size = sampler.m_patch_box.size_f
+        positives = BoundingBoxArray.from_arrays(positives[:,0], positives[:,1], patch_size[0], patch_size[1])
+        negatives = BoundingBoxArray.from_arrays(negatives[:,0], negatives[:,1], patch_size[0], patch_size[1])
+
+        # extract features
+        feature_extractor.prepare(image, level)
+        positive_features = numpy.zeros((len(positives), feature_extractor.number_of_features), numpy.uint16)
+        if len(positives):
+          feature_extractor.extract_all_batch(positives.boxes, positive_features)
+        negative_features = numpy.zeros((len(negatives), feature_extractor.number_of_features), numpy.uint16)
+        if len(negatives):
+          feature_extractor.extract_all_batch(negatives.boxes, negative_features)
+        features.append((part, scale, positive_features, negative_features))
+
+    # store the features of the parts and scales sorted by part and scale
+    for part, scale, positive_features, negative_features in sorted(features, key = lambda f: (f[0], "%.5f" % f[1])):
+      store.add(index, part, scale, positive_features, negative_features)
+
+
+  def _extract_with_workers(self, sampler, extractor_file, parameters, workers, feature_format):
+    """Extracts the features of all images using a pool of ``workers`` local processes, see :py:meth:`extract`."""
+    # remove the feature files of previous extractions in any format, which would otherwise be read by :py:meth:`sample`
+    self._remove_feature_files(0)
+    index = 1
+    while self._remove_feature_files(index):
+      index += 1
+
+    # the images are handed out one by one, so that workers which are done with small images take over the remaining images
+    tasks, results = multiprocessing.Queue(), multiprocessing.Queue()
+    for index in range(len(self)):
+      tasks.put(index)
+    for _ in range(workers):
+      tasks.put(None)
+
+    logger.info("Extracting features for %d images using %d worker processes", len(self), workers)
+    bounding_boxes = [[bb.topleft_f + bb.size_f for bb in bounding_boxes] for bounding_boxes in self.bounding_boxes]
+    # each worker process writes its own shard
+    processes = [multiprocessing.Process(target = _extraction_worker, args = (self.feature_directory, self.image_paths, bounding_boxes, _sampler_parameters(sampler), extractor_file, parameters, feature_format, shard, tasks, results)) for shard in range(1, workers+1)]
+    for process in processes:
+      process.start()
+
+    totals = {}
+    try:
+      while len(totals) < workers:
+        try:
+          kind, shard, value = results.get(timeout = 1.)
+        except queue.Empty:
+          if any(process.exitcode not in (None, 0) for process in processes):
+            raise RuntimeError("A worker process of the feature extraction terminated unexpectedly")
+          continue
+        if kind == "error":
+          raise RuntimeError("The feature extraction failed in worker process %d:\n%s" % (shard, value))
+        if kind == "image":
+          logger.debug("Processed file %d of %d in shard %d: %s", value+1, len(self), shard, self.image_paths[value])
+        else:
+          totals[shard] = value
+      for process in processes:
+        process.join()
+    finally:
+      for process in processes:
+        if process.is_alive():
+          process.terminate()
+
+    # each shard stores the total number of its features, as expected by :py:meth:`sample`
+    logger.info("Extracted %d positive and %d negative features into %d shards", sum(t[0] for t in totals.values()), sum(t[1] for t in totals.values()), workers)
+
+
+  def _existing_feature_files(self, index):
+    """Returns the names of the existing feature files (or directories) of all formats with the given index."""
+    feature_files = [self._feature_file(index = index, feature_format = feature_format) for feature_format in sorted(_FEATURE_FORMATS)]
+    return [feature_file for feature_file in feature_files if os.path.exists(feature_file)]
+
+  def _remove_feature_files(self, index):
+    """Removes the feature files of all formats with the given index, and returns whether any file was removed."""
+    feature_files = self._existing_feature_files(index)
+    for feature_file in feature_files:
+      if os.path.isdir(feature_file):
+        shutil.rmtree(feature_file)
+      else:
+        os.remove(feature_file)
+    return bool(feature_files)
+
+  def _feature_files(self):
+    """Returns the names of all existing feature files, see :py:meth:`extract`."""
+    # get all existing feature files
+    feature_files = self._existing_feature_files(0)
+    if feature_files:
+      return feature_files[:1]
+    i = 1
+    while True:
+      feature_file = self._existing_feature_files(i)
+      if not feature_file:
+        break
+      feature_files.append(feature_file[0])
+      i += 1
+    return feature_files
 
-      # load image
-      image = bob.io.base.load(self.image_paths[index])
-      if image.ndim == 3:
-        image = bob.ip.color.rgb_to_gray(image)
-      # get ground_truth bounding boxes
-      ground_truth = self.bounding_boxes[index]
-
-      # collect image and GT for originally and mirrored image
-      images = [image] if not mirror else [image, bob.ip.base.flop(image)]
-      ground_truths = [ground_truth] if not mirror else [ground_truth, [gt.mirror_x(image.shape[1]) for gt in ground_truth]]
-      parts = "om"
-
-      # now, sample
-      scale_counter = -1
-      for image, ground_truth, part in zip(images, ground_truths, parts):
-        for scale, scaled_image_shape in sampler.scales(image):
-          scale_counter += 1
-          scaled_gt = [gt.scale(scale) for gt in ground_truth]
-          positives = []
-          negatives = []
-          # iterate over all possible positions in the image
-          for bb in sampler.sample_scaled(scaled_image_shape):
-            # check if the patch is a positive example
-            positive = False
-            negative = True
-            for gt in scaled_gt:
-              similarity = bb.similarity(gt)
-              if similarity > similarity_thresholds[1]:
-                positive = True
-                break
-              if similarity > similarity_thresholds[0]:
-                negative = False
-                break
-
-            if positive:
-              positives.append(bb)
-            elif negative and scale_counter % use_every_nth_negative_scale == 0:
-              negatives.append(bb)
-
-          # per scale, limit the number of positive and negative samples
-          positives = [positives[i] for i in quasi_random_indices(len(positives), number_of_examples_per_scale[0])]
-          negatives = [negatives[i] for i in quasi_random_indices(len(negatives), number_of_examples_per_scale[1])]
-
-          # extract features
-          feature_extractor.prepare(image, scale)
-          # .. negative features
-          if negatives:
-            negative_features = numpy.zeros((len(negatives), feature_extractor.number_of_features), numpy.uint16)
-            for i, bb in enumerate(negatives):
-              feature_extractor.extract_all(bb, negative_features, i)
-            hdf5.set("Negatives-%s-%.5f" % (part,scale), negative_features)
-            total_negatives += len(negatives)
-
-          # positive features
-          if positives:
-            positive_features = numpy.zeros((len(positives), feature_extractor.number_of_features), numpy.uint16)
-            for i, bb in enumerate(positives):
-              feature_extractor.extract_all(bb, positive_features, i)
-            hdf5.set("Positives-%s-%.5f" % (part,scale), positive_features)
-            total_positives += len(positives)
-      # cd backwards after each image
-      hdf5.cd("..")
-
-    hdf5.set("TotalPositives", total_positives)
-    hdf5.set("TotalNegatives", total_negatives)
 
   def sample(self, model = None, maximum_number_of_positives = None, maximum_number_of_negatives = None, positive_indices = None, negative_indices = None):
     """sample([model], [maximum_number_of_positives], [maximum_number_of_negatives], [positive_indices], [negative_indices]) -> positives, negatives
@@ -308,6 +490,11 @@ class TrainingSet:
     .. note::
        The ``positive_indices`` and ``negative_indices`` only have an effect, when ``model`` is ``None``.
 
+    .. note::
+       As in earlier versions, the positive and negative features are numbered by the part of the training set that was extracted in each ``parallel`` process, then by the lexicographic order of the image names (``Image-0``, ``Image-1``, ``Image-10``, ..., ``Image-2``), then by part and by scale.
+       When ``model`` is ``None``, the selected features are returned image by image, with the negatives of each image before its positives.
+       Hence, indices that were stored with earlier versions select the same features, and feature files that were extracted with earlier versions are read by a :py:class:`LegacyFeatureStore`.
+
     **Parameters:**
 
     ``model`` : :py:class:`bob.learn.boosting.BoostedMachine` or ``None``
@@ -325,32 +512,12 @@ class TrainingSet:
       The new set of training features for the positive class (faces) and negative class (background).
     """
 
-    # get all existing feature files
-    feature_file = self._feature_file(index = 0)
-    if os.path.exists(feature_file):
-      feature_files = [feature_file]
-    else:
-      feature_files = []
-      i = 1
-      while True:
-        feature_file = self._feature_file(index = i)
-        if not os.path.exists(feature_file):
-          break
-        feature_files.append(feature_file)
-        i += 1
+    stores = [_feature_store(feature_file) for feature_file in self._feature_files()]
+    logger.info("Reading %d feature files", len(stores))
 
-    features = []
-    labels = []
-
-    # make a first iteration through the feature files and count the number of positives and negatives
-    positive_count, negative_count = 0, 0
-    logger.info("Reading %d feature files", len(feature_files))
-    for feature_file in feature_files:
-      logger.debug(".. Loading file %s", feature_file)
-      hdf5 = bob.io.base.HDF5File(feature_file)
-      positive_count += hdf5.get("TotalPositives")
-      negative_count += hdf5.get("TotalNegatives")
-      del hdf5
+    # the features of all files are numbered by part and image
+    positive_segments, negative_segments = _feature_segments(stores)
+    positive_count, negative_count = (int(segments[:,3].sum()) for segments in (positive_segments, negative_segments))
 
     if model is None:
       # get a list of indices and store them, so that we don't re-use them next time
@@ -361,37 +528,29 @@ class TrainingSet:
       self.positive_indices |= positive_indices
       self.negative_indices |= negative_indices
 
-      # now, iterate through the files again and sample
-      positive_indices = collections.deque(sorted(positive_indices))
-      negative_indices = collections.deque(sorted(negative_indices))
-
       logger.info("Extracting %d of %d positive and %d of %d negative samples" % (len(positive_indices), positive_count, len(negative_indices), negative_count))
 
-      positive_count, negative_count = 0, 0
-      for feature_file in feature_files:
-        hdf5 = bob.io.base.HDF5File(feature_file)
-        for image in sorted(hdf5.sub_groups(recursive=False, relative=True)):
-          hdf5.cd(image)
-          for scale in sorted(hdf5.keys(relative=True)):
-            read = hdf5.get(scale)
-            size = read.shape[0]
-            if scale.startswith("Positives"):
-              # copy positive data
-              while positive_indices and positive_count <= positive_indices[0] and positive_count + size > positive_indices[0]:
-                assert positive_indices[0] >= positive_count
-                features.append(read[positive_indices.popleft() - positive_count, :])
-                labels.append(1)
-              positive_count += size
-            else:
-              # copy negative data
-              while negative_indices and negative_count <= negative_indices[0] and negative_count + size > negative_indices[0]:
-                assert negative_indices[0] >= negative_count
-                features.append(read[negative_indices.popleft() - negative_count, :])
-                labels.append(-1)
-              negative_count += size
-          hdf5.cd("..")
-      # return features and labels
-      return numpy.array(features), numpy.array(labels)
+      # now, read the features with the given indices from the feature files directly into the pre-allocated result
+      number_of_features = max([store.number_of_features for store in stores] + [0])
+      features = numpy.empty((len(negative_indices) + len(positive_indices), number_of_features), numpy.uint16)
+      labels = numpy.empty(len(features), int)
+      images = numpy.empty(len(features), numpy.int64)
+      row = 0
+      for label, indices, segments, count in ((-1, negative_indices, negative_segments, negative_count), (1, positive_indices, positive_segments, positive_count)):
+        indices = numpy.array(sorted(indices), numpy.int64)
+        indices = indices[indices < count]
+        files, local_indices, images[row:row+len(indices)] = _locate(segments, indices)
+        for i, store in enumerate(stores):
+          selected = numpy.flatnonzero(files == i)
+          if len(selected):
+            features[row + selected] = store.get(label, local_indices[selected])
+        labels[row:row+len(indices)] = label
+        row += len(indices)
+      # return features and labels image by image, with the negatives of each image before its positives
+      if not row:
+        return numpy.array([]), numpy.array([])
+      order = numpy.argsort(images[:row], kind = 'mergesort')
+      return features[order], labels[order]
 
     else:
       positive_count -= len(self.positive_indices)
@@ -400,35 +559,42 @@ class TrainingSet:
 
       # compute the worst features based on the current model
       worst_positives, worst_negatives = [], []
-      positive_count, negative_count = 0, 0
-
-      for feature_file in feature_files:
-        hdf5 = bob.io.base.HDF5File(feature_file)
-        for image in sorted(hdf5.sub_groups(recursive=False, relative=True)):
-          hdf5.cd(image)
-          for scale in sorted(hdf5.keys(relative=True)):
-            read = hdf5.get(scale)
+      # features with equal predictions are ordered by their index, so that the result does not depend on the order of the feature files
+      cut_positives = cut_negatives = False
+
+      for i, store in enumerate(stores):
+        start_positives, start_negatives = len(worst_positives), len(worst_negatives)
+        for label, segments in ((-1, negative_segments), (1, positive_segments)):
+          # the features are read and predicted chunk by chunk
+          for begin, read in store.iterate(label):
             size = read.shape[0]
+            indices = _global_indices(segments, i, numpy.arange(begin, begin + size)).tolist()
             prediction = bob.blitz.array((size,), numpy.float64)
             # forward features through the model
             result = model.forward(read, prediction)
-            if scale.startswith("Positives"):
-              indices = [i for i in range(size) if positive_count + i not in self.positive_indices]
-              worst_positives.extend([(prediction[i], positive_count + i, read[i]) for i in indices if prediction[i] <= 0])
-              positive_count += size
+            if label > 0:
+              worst_positives.extend([(prediction[j], indices[j], read[j].copy()) for j in range(size) if indices[j] not in self.positive_indices and prediction[j] <= 0])
             else:
-              indices = [i for i in range(size) if negative_count + i not in self.negative_indices]
-              worst_negatives.extend([(prediction[i], negative_count + i, read[i]) for i in indices if prediction[i] >= 0])
-              negative_count += size
-          hdf5.cd("..")
+              worst_negatives.extend([(prediction[j], indices[j], read[j].copy()) for j in range(size) if indices[j] not in self.negative_indices and prediction[j] >= 0])
+        # as in earlier versions, the features of each file are collected in the order of their indices
+        worst_positives[start_positives:] = sorted(worst_positives[start_positives:], key=lambda k: k[1])
+        worst_negatives[start_negatives:] = sorted(worst_negatives[start_negatives:], key=lambda k: k[1])
 
         # cut off good results
         if maximum_number_of_positives is not None and len(worst_positives) > maximum_number_of_positives:
           # keep only the positives with the low predictions (i.e., the worst)
-          worst_positives = sorted(worst_positives, key=lambda k: k[0])[:maximum_number_of_positives]
+          worst_positives = sorted(worst_positives, key=lambda k: (k[0], k[1]))[:maximum_number_of_positives]
+          cut_positives = True
         if maximum_number_of_negatives is not None and len(worst_negatives) > maximum_number_of_negatives:
           # keep only the negatives with the high predictions (i.e., the worst)
-          worst_negatives = sorted(worst_negatives, reverse=True, key=lambda k: k[0])[:maximum_number_of_negatives]
+          worst_negatives = sorted(worst_negatives, key=lambda k: (-k[0], k[1]))[:maximum_number_of_negatives]
+          cut_negatives = True
+
+      # features that were not cut off are returned in the order of their indices
+      if not cut_positives:
+        worst_positives.sort(key=lambda k: k[1])
+      if not cut_negatives:
+        worst_negatives.sort(key=lambda k: k[1])
 
       # mark all indices to be used
       self.positive_indices |= set(k[1] for k in worst_positives)
@@ -1,4 +1,5 @@
 from .TrainingSet import TrainingSet
+from .FeatureStore import FeatureStore, LegacyFeatureStore, NumpyFeatureStore
 from .Bootstrap import Bootstrap
 from . import utils
 from .utils import bounding_box_from_annotation, expected_eye_positions, quasi_random_indices, parallel_part
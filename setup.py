@@ -99,6 +99,7 @@ setup(
           "bob/ip/facedetect/cpp/boundingbox.cpp",
 
           "bob/ip/facedetect/bounding_box.cpp",
+          "bob/ip/facedetect/image_pyramid.cpp",
           "bob/ip/facedetect/feature_extractor.cpp",
           "bob/ip/facedetect/main.cpp",
         ],
@@ -142,7 +143,8 @@ setup(
         'validate_detector.py = bob.ip.facedetect.script.validate_detector:main',
         'detect_faces.py = bob.ip.facedetect.script.detect_faces:main',
         'evaluate_detections.py = bob.ip.facedetect.script.evaluate:main',
-        'plot_froc.py = bob.ip.facedetect.script.plot_froc:main'
+        'plot_froc.py = bob.ip.facedetect.script.plot_froc:main',
+        'benchmark_detector.py = bob.ip.facedetect.script.benchmark:main'
       ],
     },
 